@@ -0,0 +1,124 @@
+"""
+Micro-benchmark for backtest_trade_confirmation.
+
+Compares the array backtest in technical_analysis_core with running the live
+analysis pipeline once per bar, on the candles up to that bar exactly as the
+app does, on a synthetic random walk, and checks that both produce the same
+scores, signals and trade levels.
+
+Run from the repository root:
+    python -m benchmarks.bench_backtest
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from technical_analysis_core import (
+    backtest_trade_confirmation,
+    compute_indicator_frame,
+    get_pipeline_cache,
+    run_analysis_pipeline,
+)
+
+# (label, bars, candle frequency)
+CASES = [
+    ("5y daily", 1_250, "B"),
+    ("3mo 5m", 4_700, "5min"),
+    ("1y 5m", 18_750, "5min"),
+]
+VOLUME_MA_WINDOW = 20
+PARAMS = dict(
+    left_bars=3,
+    right_bars=3,
+    zone_width_pct=0.8,
+    min_touches=2,
+    trendline_tolerance_pct=1.0,
+    require_trendline_confirmation=False,
+    use_retest_bonus=True,
+    breakout_buffer_pct=0.15,
+)
+SIGNAL_COLUMNS = ["Buy_Score", "Sell_Score", "Signal", "Side", "Stop_Loss", "Target_1", "Target_2"]
+# The per-bar loop needs minutes on the larger cases; it is timed on this
+# many bars and scaled linearly. Parity is also checked on the last
+# PARITY_TAIL_BARS bars, where every pivot of the series is in play.
+LEGACY_MAX_BARS = 600
+PARITY_TAIL_BARS = 40
+
+
+def per_bar_signals(raw: pd.DataFrame, bars: range) -> pd.DataFrame:
+    """The previous way to get historical signals: one full pipeline run per bar."""
+    cache = get_pipeline_cache()
+    rows = []
+    for t in bars:
+        cache.clear()
+        analysis = run_analysis_pipeline(
+            raw=raw.iloc[: t + 1],
+            series_id=("BENCH", "5m"),
+            volume_ma_window=VOLUME_MA_WINDOW,
+            **PARAMS,
+        )
+        trade_confirmation = analysis["trade_confirmation"]
+        levels = analysis["trade_levels"] or {}
+        rows.append(
+            (
+                trade_confirmation.buy_score,
+                trade_confirmation.sell_score,
+                trade_confirmation.signal,
+                levels.get("side", ""),
+                levels.get("stop_loss", np.nan),
+                levels.get("target_1", np.nan),
+                levels.get("target_2", np.nan),
+            )
+        )
+    cache.clear()
+    return pd.DataFrame(rows, columns=SIGNAL_COLUMNS, index=raw.index[bars])
+
+
+def make_frame(n: int, freq: str) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    close = np.round((1000 + rng.normal(0, 4, n).cumsum()) * 20) / 20
+    open_ = close + np.round(rng.normal(0, 2, n), 2)
+    index = pd.date_range("2019-01-01 09:15", periods=n, freq=freq, tz="Asia/Kolkata", name="Date")
+    raw = pd.DataFrame(
+        {
+            "Open": open_,
+            "High": np.maximum(open_, close) + rng.random(n) * 4,
+            "Low": np.minimum(open_, close) - rng.random(n) * 4,
+            "Close": close,
+            "Volume": rng.integers(1_000, 9_000, n).astype(float),
+        },
+        index=index,
+    )
+    return raw
+
+
+def main():
+    print(f"{'case':>10} {'bars':>8} {'per-bar (s)':>12} {'backtest (s)':>13} {'speedup':>9} {'trades':>7}")
+    for label, n, freq in CASES:
+        raw = make_frame(n, freq)
+        df = compute_indicator_frame(raw, VOLUME_MA_WINDOW)
+
+        start = time.perf_counter()
+        expected = per_bar_signals(raw, range(LEGACY_MAX_BARS))
+        legacy = (time.perf_counter() - start) * n / len(expected)
+
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            result = backtest_trade_confirmation(df, **PARAMS)
+            timings.append(time.perf_counter() - start)
+        vectorized = min(timings)
+
+        got = result.signals[SIGNAL_COLUMNS]
+        tail = per_bar_signals(raw, range(n - PARITY_TAIL_BARS, n))
+        pd.testing.assert_frame_equal(got.iloc[:LEGACY_MAX_BARS], expected, check_dtype=False, check_freq=False)
+        pd.testing.assert_frame_equal(got.iloc[-PARITY_TAIL_BARS:], tail, check_dtype=False, check_freq=False)
+        print(
+            f"{label:>10} {n:>8,} {legacy:>12.2f} {vectorized:>13.3f} {legacy / vectorized:>8.0f}x "
+            f"{result.summary['trades']:>7}  (per-bar extrapolated from {len(expected)} bars)"
+        )
+
+
+if __name__ == "__main__":
+    main()
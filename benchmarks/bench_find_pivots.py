@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for find_pivots.
+
+Compares the sliding-window implementation in technical_analysis_core with
+the previous bar-by-bar loop on a synthetic random walk.
+
+Run from the repository root:
+    python -m benchmarks.bench_find_pivots
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from technical_analysis_core import EMPTY_PIVOT_COLUMNS, find_pivots
+
+SIZES = [10_000, 100_000, 1_000_000]
+LEFT_BARS = 3
+RIGHT_BARS = 3
+# The legacy loop needs minutes at 1M bars; above this size it is timed on a
+# slice and scaled linearly, which is how it grows.
+LEGACY_MAX_BARS = 100_000
+
+
+def legacy_find_pivots(df: pd.DataFrame, left_bars: int = 3, right_bars: int = 3):
+    highs = []
+    lows = []
+
+    if len(df) < (left_bars + right_bars + 1):
+        return (
+            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
+            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
+        )
+
+    for i in range(left_bars, len(df) - right_bars):
+        high_slice = df["High"].iloc[i - left_bars: i + right_bars + 1]
+        low_slice = df["Low"].iloc[i - left_bars: i + right_bars + 1]
+        cur_high = df["High"].iloc[i]
+        cur_low = df["Low"].iloc[i]
+
+        if cur_high == high_slice.max():
+            highs.append({"Date": df.index[i], "Price": float(cur_high), "Type": "Resistance"})
+        if cur_low == low_slice.min():
+            lows.append({"Date": df.index[i], "Price": float(cur_low), "Type": "Support"})
+
+    highs_df = pd.DataFrame(highs, columns=EMPTY_PIVOT_COLUMNS)
+    lows_df = pd.DataFrame(lows, columns=EMPTY_PIVOT_COLUMNS)
+    return highs_df, lows_df
+
+
+def make_bars(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    # Prices on a 0.05 tick grid so equal highs/lows (ties) actually occur.
+    close = np.round((1000 + rng.standard_normal(n).cumsum()) * 20) / 20
+    index = pd.date_range("2015-01-01 09:15", periods=n, freq="5min", tz="Asia/Kolkata", name="Date")
+    return pd.DataFrame({"High": close + 0.5, "Low": close - 0.5, "Close": close}, index=index)
+
+
+def check_same_result(df: pd.DataFrame) -> None:
+    for new, old in zip(find_pivots(df, LEFT_BARS, RIGHT_BARS), legacy_find_pivots(df, LEFT_BARS, RIGHT_BARS)):
+        pd.testing.assert_frame_equal(new, old)
+
+
+def best_of(fn, df: pd.DataFrame, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(df, LEFT_BARS, RIGHT_BARS)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'bars':>10} {'legacy (s)':>12} {'vectorized (s)':>16} {'speedup':>9}")
+    for n in SIZES:
+        df = make_bars(n)
+        check_same_result(df.iloc[:20_000])
+
+        sample = df.iloc[:LEGACY_MAX_BARS]
+        legacy = best_of(legacy_find_pivots, sample, 1) * n / len(sample)
+        vectorized = best_of(find_pivots, df, 5)
+        note = "" if n <= LEGACY_MAX_BARS else "  (legacy extrapolated)"
+        print(f"{n:>10,} {legacy:>12.3f} {vectorized:>16.4f} {legacy / vectorized:>8.0f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
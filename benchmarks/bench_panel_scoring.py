@@ -0,0 +1,139 @@
+"""
+Micro-benchmark for score_candle_panel.
+
+Scores the latest candle of a synthetic universe the size of the NSE_EQ
+segment from one aligned panel, compares it with running the per-symbol
+pipeline (indicators, pivots, zones, trendlines, structure, confirmation,
+trade levels) on every symbol, and checks that both agree on every column.
+
+Run from the repository root:
+    python -m benchmarks.bench_panel_scoring
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from technical_analysis_core import (
+    build_candle_panel,
+    cluster_levels,
+    compute_indicator_frame,
+    detect_market_structure,
+    detect_trendlines,
+    evaluate_trade_confirmation,
+    find_pivots,
+    get_trade_levels,
+    nearest_zones,
+    score_candle_panel,
+)
+
+SYMBOLS = 2_000
+BARS = 250
+PARAMS = dict(
+    left_bars=3,
+    right_bars=3,
+    zone_width_pct=0.8,
+    min_touches=2,
+    trendline_tolerance_pct=1.0,
+    require_trendline_confirmation=False,
+    use_retest_bonus=True,
+    breakout_buffer_pct=0.15,
+)
+VOLUME_MA_WINDOW = 20
+# The per-symbol loop is timed on this many symbols and scaled linearly.
+LEGACY_MAX_SYMBOLS = 200
+
+
+def per_symbol_row(raw: pd.DataFrame) -> dict:
+    """The previous way to score a symbol: the single-chart pipeline on its own frame."""
+    df = compute_indicator_frame(raw, VOLUME_MA_WINDOW)
+    pivot_highs, pivot_lows = find_pivots(df, PARAMS["left_bars"], PARAMS["right_bars"])
+    current_price = float(df["Close"].iloc[-1])
+    zones = cluster_levels(
+        pivot_lows, current_price, PARAMS["zone_width_pct"], "Support", PARAMS["min_touches"]
+    ) + cluster_levels(
+        pivot_highs, current_price, PARAMS["zone_width_pct"], "Resistance", PARAMS["min_touches"]
+    )
+    nearest_support, nearest_resistance = nearest_zones(zones, current_price)
+    market_structure = detect_market_structure(pivot_highs, pivot_lows)
+    trade_confirmation = evaluate_trade_confirmation(
+        df=df,
+        trendlines=detect_trendlines(df, pivot_highs, pivot_lows, tolerance_pct=PARAMS["trendline_tolerance_pct"]),
+        market_structure=market_structure,
+        nearest_support=nearest_support,
+        nearest_resistance=nearest_resistance,
+        require_trendline_confirmation=PARAMS["require_trendline_confirmation"],
+        use_retest_bonus=PARAMS["use_retest_bonus"],
+        breakout_buffer_pct=PARAMS["breakout_buffer_pct"],
+    )
+    levels = get_trade_levels(trade_confirmation, df) or {}
+    return {
+        "Buy_Score": trade_confirmation.buy_score,
+        "Sell_Score": trade_confirmation.sell_score,
+        "Signal": trade_confirmation.signal,
+        "Confidence": trade_confirmation.confidence,
+        "Quality": trade_confirmation.quality,
+        "Trend_Bias": market_structure.trend_bias,
+        "Nearest_Support": nearest_support.center if nearest_support else np.nan,
+        "Nearest_Resistance": nearest_resistance.center if nearest_resistance else np.nan,
+        "Side": levels.get("side", ""),
+        "Entry": levels.get("entry", np.nan),
+        "Safe_Entry": levels.get("safe_entry", np.nan),
+        "Stop_Loss": levels.get("stop_loss", np.nan),
+        "Target_1": levels.get("target_1", np.nan),
+        "Target_2": levels.get("target_2", np.nan),
+    }
+
+
+def make_universe(symbols: int, bars: int) -> dict[str, pd.DataFrame]:
+    """Random walks with uneven history lengths, as with recent listings."""
+    rng = np.random.default_rng(11)
+    frames = {}
+    for i in range(symbols):
+        n = int(rng.integers(bars // 4, bars + 1)) if i % 10 == 0 else bars
+        start = rng.uniform(50, 3_000)
+        close = np.round((start + rng.normal(0, start / 250, n).cumsum()) * 20) / 20
+        open_ = close + np.round(rng.normal(0, start / 500, n), 2)
+        index = pd.date_range(end="2024-06-28 15:30", periods=n, freq="B", tz="Asia/Kolkata", name="Date")
+        frames[f"SYM{i:04d}"] = pd.DataFrame(
+            {
+                "Open": open_,
+                "High": np.maximum(open_, close) + rng.random(n) * start / 300,
+                "Low": np.minimum(open_, close) - rng.random(n) * start / 300,
+                "Close": close,
+                "Volume": rng.integers(0, 90_000, n).astype(float),
+            },
+            index=index,
+        )
+    return frames
+
+
+def main():
+    frames = make_universe(SYMBOLS, BARS)
+    sample = list(frames)[:LEGACY_MAX_SYMBOLS]
+
+    start = time.perf_counter()
+    expected = pd.DataFrame([per_symbol_row(frames[symbol]) for symbol in sample], index=sample)
+    legacy = (time.perf_counter() - start) * SYMBOLS / len(sample)
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        scored = score_candle_panel(build_candle_panel(frames), volume_ma_window=VOLUME_MA_WINDOW, **PARAMS)
+        timings.append(time.perf_counter() - start)
+    vectorized = min(timings)
+
+    got = scored.loc[sample, expected.columns]
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_names=False, check_exact=True)
+
+    signals = scored["Signal"].value_counts().to_dict()
+    print(f"{'symbols':>8} {'bars':>6} {'per-symbol (s)':>15} {'panel (s)':>10} {'speedup':>9}")
+    print(
+        f"{SYMBOLS:>8,} {BARS:>6} {legacy:>15.2f} {vectorized:>10.3f} {legacy / vectorized:>8.0f}x"
+        f"  (per-symbol extrapolated from {len(sample)} symbols)"
+    )
+    print("signals:", signals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for parse_upstox_candles.
+
+Compares the columnar parser in technical_analysis_core with the previous
+row-by-row implementation on synthetic Upstox candle payloads.
+
+Run from the repository root:
+    python -m benchmarks.bench_parse_upstox_candles
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from technical_analysis_core import parse_upstox_candles, to_india_time
+
+SIZES = [1_000, 50_000, 500_000]
+
+
+def legacy_parse_upstox_candles(candles: list) -> pd.DataFrame:
+    rows = []
+    for c in candles:
+        if len(c) < 6:
+            continue
+        rows.append(
+            {
+                "Date": pd.to_datetime(c[0]),
+                "Open": float(c[1]),
+                "High": float(c[2]),
+                "Low": float(c[3]),
+                "Close": float(c[4]),
+                "Volume": float(c[5]) if c[5] is not None else 0.0,
+                "Open Interest": float(c[6]) if len(c) > 6 and c[6] is not None else 0.0,
+            }
+        )
+
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+
+    df["Date"] = pd.to_datetime(df["Date"])
+    df["Date"] = df["Date"].apply(to_india_time)
+    df = df.sort_values("Date").drop_duplicates(subset=["Date"], keep="last")
+    df = df.set_index("Date")
+    return df
+
+
+def make_candles(n: int) -> list:
+    rng = np.random.default_rng(7)
+    stamps = pd.date_range("2015-01-01 09:15", periods=n, freq="5min", tz="Asia/Kolkata")
+    close = 1000 + rng.standard_normal(n).cumsum()
+    # Upstox returns newest-first with ISO timestamps carrying the +05:30 offset.
+    return [
+        [ts.isoformat(), c - 0.5, c + 1.0, c - 1.0, c, int(v), 0]
+        for ts, c, v in zip(stamps[::-1], close[::-1], rng.integers(1_000, 100_000, n))
+    ]
+
+
+def check_same_result(candles: list) -> None:
+    new = parse_upstox_candles(candles)
+    old = legacy_parse_upstox_candles(candles)
+    assert (new.index.as_unit("ns") == old.index.as_unit("ns")).all()
+    pd.testing.assert_frame_equal(new.reset_index(drop=True), old.reset_index(drop=True))
+
+
+def best_of(fn, candles, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(candles)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'candles':>10} {'legacy (s)':>12} {'columnar (s)':>14} {'speedup':>9}")
+    for n in SIZES:
+        candles = make_candles(n)
+        repeat = 3 if n <= 50_000 else 1
+
+        check_same_result(candles[:1_000])
+
+        legacy = best_of(legacy_parse_upstox_candles, candles, repeat)
+        columnar = best_of(parse_upstox_candles, candles, repeat)
+        print(f"{n:>10,} {legacy:>12.4f} {columnar:>14.4f} {legacy / columnar:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
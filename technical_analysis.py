@@ -1,8 +1,7 @@
-import gzip
-import io
-import json
-from dataclasses import dataclass
-from typing import List, Tuple, Optional
+import time
+import uuid
+from functools import partial
+from typing import List
 
 import numpy as np
 import pandas as pd
@@ -12,6 +11,61 @@ import streamlit as st
 from plotly.subplots import make_subplots
 from streamlit_autorefresh import st_autorefresh
 
+from technical_analysis_core import (
+    INSTRUMENTS_REFRESH_SECONDS,
+    MULTI_TIMEFRAME_INTERVALS,
+    PROFILE_OUTPUT,
+    SCAN_UNIVERSES,
+    SWEEP_METRICS,
+    SWEEP_PARAMETER_GRID,
+    SWEEP_WORKERS,
+    WARMUP_SERIES,
+    WARMUP_WINDOW,
+    CandleStore,
+    ReplayFeed,
+    StreamFeeds,
+    SweepSettings,
+    Telemetry,
+    Trendline,
+    UpstoxMarketFeed,
+    WarmupJob,
+    WatchlistRescanCache,
+    Zone,
+    activate_telemetry,
+    analyze_single_symbol,
+    analyze_timeframes,
+    compute_indicator_frame,
+    compute_option_chain_summary,
+    fetch_option_chain_v2,
+    filter_instruments,
+    finest_interval,
+    format_display_timestamp,
+    frame_fingerprint,
+    get_available_option_expiries,
+    get_http_metrics,
+    get_indicator_engine,
+    get_volatility_label,
+    interpret_pcr,
+    load_upstox_data,
+    load_upstox_instruments,
+    merge_stream_candles,
+    panel_scanner_rows,
+    resample_candles,
+    resolve_instrument_keys,
+    run_analysis_pipeline,
+    run_parameter_sweep,
+    scan_universe,
+    scan_watchlist_concurrently,
+    stage_timer,
+    start_metrics_export,
+    sweep_grid_size,
+    telemetry_label,
+    timed_stage,
+    universe_symbols,
+    validate_period_interval,
+    zones_to_dataframe,
+)
+
 
 # ============================================================
 # CONFIG
@@ -26,291 +80,70 @@ st.title("📈 Technical Analysis App - Live API")
 st.caption("Support/Resistance zones + trendlines + market structure + volume analysis + buy/sell confirmation")
 
 
-INDIA_TZ = "Asia/Kolkata"
-INDIAN_DATE_FMT = "%d-%m-%Y"
-INDIAN_DATETIME_FMT = "%d-%m-%Y %H:%M:%S"
-INTRADAY_INTERVALS = {"1h", "30m", "15m", "5m"}
-EMPTY_PIVOT_COLUMNS = ["Date", "Price", "Type"]
-
-UPSTOX_BASE_URL = "https://api.upstox.com"
-UPSTOX_HIST_V3 = f"{UPSTOX_BASE_URL}/v3/historical-candle"
-UPSTOX_INTRADAY_V3 = f"{UPSTOX_BASE_URL}/v3/historical-candle/intraday"
-UPSTOX_OHLC_V3 = f"{UPSTOX_BASE_URL}/v3/market-quote/ohlc"
-
-# Option APIs
-UPSTOX_OPTION_CONTRACTS_V2 = f"{UPSTOX_BASE_URL}/v2/option/contract"
-UPSTOX_OPTION_CHAIN_V2 = f"{UPSTOX_BASE_URL}/v2/option/chain"
-
-# Instruments lookup files
-UPSTOX_INSTRUMENTS_NSE_URL = "https://assets.upstox.com/market-quote/instruments/exchange/NSE.json.gz"
-UPSTOX_INSTRUMENTS_BSE_URL = "https://assets.upstox.com/market-quote/instruments/exchange/BSE.json.gz"
-
-
 # ============================================================
-# DATA CLASSES
+# LOCAL CANDLE STORE
 # ============================================================
-@dataclass
-class Zone:
-    zone_type: str
-    center: float
-    lower: float
-    upper: float
-    touches: int
-    last_touch: pd.Timestamp
-
-
-@dataclass
-class Trendline:
-    line_type: str
-    x0: pd.Timestamp
-    y0: float
-    x1: pd.Timestamp
-    y1: float
-    slope_per_bar: float
-    touches: int
-    status: str
-
-
-@dataclass
-class MarketStructure:
-    structure: str
-    trend_bias: str
-    latest_swing_high: float | None
-    previous_swing_high: float | None
-    latest_swing_low: float | None
-    previous_swing_low: float | None
-    summary: str
-
-
-@dataclass
-class TradeConfirmation:
-    signal: str
-    confidence: int
-    buy_score: int
-    sell_score: int
-    quality: str
-    reasons: List[str]
-    breakout_confirmed: bool
-    breakdown_confirmed: bool
-    retest_buy_ready: bool
-    retest_sell_ready: bool
+@st.cache_resource(show_spinner=False)
+def get_candle_store() -> CandleStore:
+    return CandleStore()
 
 
 # ============================================================
-# TIME / DISPLAY HELPERS
+# WATCHLIST RESCAN CACHE
 # ============================================================
-def to_india_time(ts):
-    if pd.isna(ts):
-        return pd.NaT
-
-    ts = pd.Timestamp(ts)
-    if ts.tzinfo is None:
-        return ts.tz_localize(INDIA_TZ)
-    return ts.tz_convert(INDIA_TZ)
-
-
-def format_indian_date(ts) -> str:
-    ts = to_india_time(ts)
-    if pd.isna(ts):
-        return ""
-    return ts.strftime(INDIAN_DATE_FMT)
-
-
-def format_indian_datetime(ts) -> str:
-    ts = to_india_time(ts)
-    if pd.isna(ts):
-        return ""
-    return ts.strftime(INDIAN_DATETIME_FMT)
-
-
-def format_display_timestamp(ts, interval: str) -> str:
-    return format_indian_datetime(ts) if interval in INTRADAY_INTERVALS else format_indian_date(ts)
-
-
-def now_ist() -> pd.Timestamp:
-    return pd.Timestamp.now(tz=INDIA_TZ)
-
-
-def is_market_hours_india() -> bool:
-    current = now_ist()
-    if current.weekday() >= 5:
-        return False
-
-    market_open = current.replace(hour=9, minute=15, second=0, microsecond=0)
-    market_close = current.replace(hour=15, minute=30, second=0, microsecond=0)
-    return market_open <= current <= market_close
+@st.cache_resource(show_spinner=False)
+def get_rescan_cache() -> WatchlistRescanCache:
+    return WatchlistRescanCache()
 
 
 # ============================================================
-# UPSTOX AUTH / API HELPERS
+# HTTP METRICS EXPORT
 # ============================================================
-def get_auth_headers(access_token: str) -> dict:
-    return {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+@st.cache_resource(show_spinner=False)
+def get_metrics_export():
+    """Prometheus file / endpoint exports configured by the TA_METRICS_* variables, started once."""
+    return start_metrics_export()
 
 
-def interval_to_upstox(interval: str) -> tuple[str, str]:
-    mapping = {
-        "5m": ("minutes", "5"),
-        "15m": ("minutes", "15"),
-        "30m": ("minutes", "30"),
-        "1h": ("hours", "1"),
-        "1d": ("days", "1"),
-    }
-    if interval not in mapping:
-        raise ValueError(f"Unsupported interval: {interval}")
-    return mapping[interval]
-
-
-def ohlc_quote_interval(interval: str) -> Optional[str]:
-    mapping = {
-        "1d": "1d",
-        "30m": "I30",
-    }
-    return mapping.get(interval)
-
-
-def period_to_from_date(period: str, to_date: pd.Timestamp) -> pd.Timestamp:
-    if period == "5d":
-        return to_date - pd.Timedelta(days=7)
-    if period == "1mo":
-        return to_date - pd.DateOffset(months=1)
-    if period == "3mo":
-        return to_date - pd.DateOffset(months=3)
-    if period == "6mo":
-        return to_date - pd.DateOffset(months=6)
-    if period == "1y":
-        return to_date - pd.DateOffset(years=1)
-    if period == "2y":
-        return to_date - pd.DateOffset(years=2)
-    if period == "5y":
-        return to_date - pd.DateOffset(years=5)
-    raise ValueError(f"Unsupported period: {period}")
-
-
-def validate_period_interval(period: str, interval: str) -> Optional[str]:
-    if interval in {"5m", "15m"} and period not in {"5d", "1mo"}:
-        return "For 5m and 15m, keep lookback to 5d or 1mo."
-    if interval in {"30m", "1h"} and period not in {"5d", "1mo", "3mo"}:
-        return "For 30m and 1h, keep lookback to 5d, 1mo, or 3mo."
-    return None
+# ============================================================
+# PRE-MARKET WARM-UP
+# ============================================================
+@st.cache_resource(show_spinner=False)
+def get_warmup_job() -> WarmupJob:
+    return WarmupJob().start()
 
 
 # ============================================================
-# UPSTOX INSTRUMENT LOOKUP
+# STREAMING FEED
 # ============================================================
-@st.cache_data(show_spinner=False, ttl=60 * 60 * 6)
-def load_upstox_instruments(exchange: str = "NSE") -> pd.DataFrame:
-    exchange = exchange.upper().strip()
-    if exchange == "NSE":
-        url = UPSTOX_INSTRUMENTS_NSE_URL
-    elif exchange == "BSE":
-        url = UPSTOX_INSTRUMENTS_BSE_URL
-    else:
-        raise ValueError("Only NSE and BSE are supported in this lookup.")
-
-    response = requests.get(url, timeout=60)
-    response.raise_for_status()
-
-    with gzip.GzipFile(fileobj=io.BytesIO(response.content)) as gz:
-        payload = json.loads(gz.read().decode("utf-8"))
-
-    df = pd.DataFrame(payload)
-
-    useful_cols = [
-        "segment",
-        "name",
-        "exchange",
-        "instrument_type",
-        "instrument_key",
-        "trading_symbol",
-        "short_name",
-        "isin",
-        "underlying_symbol",
-        "strike_price",
-        "expiry",
-    ]
-    keep_cols = [c for c in useful_cols if c in df.columns]
-    df = df[keep_cols].copy()
-
-    for col in [
-        "segment",
-        "exchange",
-        "instrument_type",
-        "instrument_key",
-        "trading_symbol",
-        "short_name",
-        "name",
-        "underlying_symbol",
-    ]:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-
-    if "expiry" in df.columns:
-        df["expiry_dt"] = pd.to_datetime(df["expiry"], unit="ms", errors="coerce")
-    else:
-        df["expiry_dt"] = pd.NaT
-
-    return df
-
-
-def filter_instruments(
-    instruments_df: pd.DataFrame,
-    query: str,
-    mode: str = "Equity",
-    exchange: str = "NSE",
-) -> pd.DataFrame:
-    df = instruments_df.copy()
-    exchange = exchange.upper().strip()
-
-    if exchange == "NSE":
-        if mode == "Equity":
-            df = df[(df["segment"] == "NSE_EQ") & (df["instrument_type"] == "EQ")]
-        elif mode == "Index":
-            df = df[df["segment"] == "NSE_INDEX"]
-        elif mode == "Futures":
-            df = df[(df["segment"] == "NSE_FO") & (df["instrument_type"] == "FUT")]
-        elif mode == "Call Option":
-            df = df[(df["segment"] == "NSE_FO") & (df["instrument_type"] == "CE")]
-        elif mode == "Put Option":
-            df = df[(df["segment"] == "NSE_FO") & (df["instrument_type"] == "PE")]
-    elif exchange == "BSE":
-        if mode == "Equity":
-            df = df[(df["segment"] == "BSE_EQ") & (df["instrument_type"] == "EQ")]
-        elif mode == "Index":
-            df = df[df["segment"] == "BSE_INDEX"]
-        else:
-            df = df[df["exchange"] == "BSE"]
-
-    query = str(query).strip().upper()
-    if not query:
-        return df.head(100)
+@st.cache_resource(show_spinner=False)
+def get_stream_feeds() -> StreamFeeds:
+    return StreamFeeds()
 
-    mask = pd.Series(False, index=df.index)
 
-    for col in ["trading_symbol", "short_name", "name", "underlying_symbol"]:
-        if col in df.columns:
-            mask = mask | df[col].astype(str).str.upper().str.contains(query, na=False)
+def stream_holder_id() -> str:
+    if "stream_holder_id" not in st.session_state:
+        st.session_state["stream_holder_id"] = uuid.uuid4().hex
+    return st.session_state["stream_holder_id"]
 
-    df = df[mask].copy()
 
-    if "trading_symbol" in df.columns:
-        df["exact_match"] = (df["trading_symbol"].str.upper() == query).astype(int)
+def get_stream_feed(source: str, access_token: str, instrument_key: str, replay_address: str):
+    """The running tick feed for this subscription, shared with other sessions watching the same one."""
+    if source == "Local replay":
+        key = (source, instrument_key, replay_address)
+        factory = partial(ReplayFeed, replay_address)
     else:
-        df["exact_match"] = 0
+        key = (source, instrument_key, None)
+        factory = partial(UpstoxMarketFeed, access_token, [instrument_key])
+    return get_stream_feeds().acquire(stream_holder_id(), key, factory)
 
-    sort_cols = ["exact_match"]
-    ascending = [False]
 
-    if "trading_symbol" in df.columns:
-        sort_cols.append("trading_symbol")
-        ascending.append(True)
-
-    df = df.sort_values(sort_cols, ascending=ascending).reset_index(drop=True)
-    return df.head(200)
+# ============================================================
+# UPSTOX INSTRUMENT LOOKUP
+# ============================================================
+@st.cache_resource(show_spinner=False, ttl=INSTRUMENTS_REFRESH_SECONDS)
+def get_upstox_instruments(exchange: str = "NSE") -> pd.DataFrame:
+    return load_upstox_instruments(exchange)
 
 
 def build_instrument_label(row: pd.Series) -> str:
@@ -339,1239 +172,131 @@ def build_instrument_label(row: pd.Series) -> str:
 
 
 # ============================================================
-# UPSTOX MARKET DATA FETCH
+# SCANNER TABLE
 # ============================================================
-def parse_upstox_candles(candles: list) -> pd.DataFrame:
+SCANNER_SIGNAL_MARKERS = {
+    "Strong Buy": "🟢",
+    "Buy": "🟢",
+    "BUY": "🟢",
+    "Strong Sell": "🔴",
+    "Sell": "🔴",
+    "SELL": "🔴",
+    "HOLD": "🟡",
+}
+SCANNER_NUMERIC_COLUMNS = [
+    "Current Price",
+    "Nearest Support",
+    "Nearest Resistance",
+    "Buy Score",
+    "Sell Score",
+    "Buy Price",
+    "Safe Buy Above",
+    "Stop Loss",
+    "Target 1",
+]
+
+
+@timed_stage
+def show_scanner_table(target, scanner_df: pd.DataFrame) -> None:
     """
-    Expected candle format:
-    [timestamp, open, high, low, close, volume, open_interest]
+    Render scanner results in Streamlit's virtualized grid. Numbers are
+    formatted per column through column_config instead of a Styler, so the
+    browser only formats rows in view; signal colours become markers.
     """
-    if not candles:
-        return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume", "Open Interest"])
-
-    rows = []
-    for c in candles:
-        if len(c) < 6:
-            continue
-        rows.append(
-            {
-                "Date": pd.to_datetime(c[0]),
-                "Open": float(c[1]),
-                "High": float(c[2]),
-                "Low": float(c[3]),
-                "Close": float(c[4]),
-                "Volume": float(c[5]) if c[5] is not None else 0.0,
-                "Open Interest": float(c[6]) if len(c) > 6 and c[6] is not None else 0.0,
-            }
-        )
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-
-    df["Date"] = pd.to_datetime(df["Date"])
-    df["Date"] = df["Date"].apply(to_india_time)
-    df = df.sort_values("Date").drop_duplicates(subset=["Date"], keep="last")
-    df = df.set_index("Date")
-    return df
-
-
-def fetch_historical_v3(access_token: str, instrument_key: str, period: str, interval: str) -> pd.DataFrame:
-    unit, intv = interval_to_upstox(interval)
-
-    to_date = now_ist().normalize()
-    from_date = period_to_from_date(period, to_date)
-
-    url = f"{UPSTOX_HIST_V3}/{instrument_key}/{unit}/{intv}/{to_date.strftime('%Y-%m-%d')}/{from_date.strftime('%Y-%m-%d')}"
-    response = requests.get(url, headers=get_auth_headers(access_token), timeout=30)
-    response.raise_for_status()
-
-    payload = response.json()
-    candles = payload.get("data", {}).get("candles", [])
-    return parse_upstox_candles(candles)
-
-
-def fetch_intraday_v3(access_token: str, instrument_key: str, interval: str) -> pd.DataFrame:
-    unit, intv = interval_to_upstox(interval)
-
-    url = f"{UPSTOX_INTRADAY_V3}/{instrument_key}/{unit}/{intv}"
-    response = requests.get(url, headers=get_auth_headers(access_token), timeout=30)
-    response.raise_for_status()
-
-    payload = response.json()
-    candles = payload.get("data", {}).get("candles", [])
-    return parse_upstox_candles(candles)
-
-
-def fetch_live_ohlc_v3(access_token: str, instrument_key: str, interval: str) -> pd.DataFrame:
-    quote_int = ohlc_quote_interval(interval)
-    if not quote_int:
-        return pd.DataFrame()
-
-    params = {
-        "instrument_key": instrument_key,
-        "interval": quote_int,
-    }
-    response = requests.get(UPSTOX_OHLC_V3, headers=get_auth_headers(access_token), params=params, timeout=30)
-    response.raise_for_status()
-
-    payload = response.json()
-    data = payload.get("data", {})
-    if not data:
-        return pd.DataFrame()
-
-    item = next(iter(data.values()))
-    live = item.get("live_ohlc", {})
-    if not live or "ts" not in live:
-        return pd.DataFrame()
-
-    ts = pd.to_datetime(int(live["ts"]), unit="ms", utc=True).tz_convert(INDIA_TZ)
-
-    df = pd.DataFrame(
-        [
-            {
-                "Date": ts,
-                "Open": float(live.get("open", 0)),
-                "High": float(live.get("high", 0)),
-                "Low": float(live.get("low", 0)),
-                "Close": float(live.get("close", 0)),
-                "Volume": float(live.get("volume", 0)),
-                "Open Interest": 0.0,
-            }
-        ]
-    )
-    return df.set_index("Date")
-
-
-def load_upstox_data(access_token: str, instrument_key: str, period: str, interval: str, include_live: bool = True) -> pd.DataFrame:
-    hist = fetch_historical_v3(access_token, instrument_key, period, interval)
-
-    parts = [hist] if not hist.empty else []
-
-    if include_live and is_market_hours_india():
-        try:
-            if interval in INTRADAY_INTERVALS:
-                intraday = fetch_intraday_v3(access_token, instrument_key, interval)
-                if not intraday.empty:
-                    parts.append(intraday)
-            elif interval == "1d":
-                live_daily = fetch_live_ohlc_v3(access_token, instrument_key, interval)
-                if not live_daily.empty:
-                    parts.append(live_daily)
-        except Exception:
-            pass
-
-    if not parts:
-        return pd.DataFrame()
-
-    df = pd.concat(parts)
-    df = df[~df.index.duplicated(keep="last")].sort_index()
-    return df
+    display = scanner_df.copy()
+    for col in ["Signal", "Recommended Action"]:
+        if col in display.columns:
+            markers = display[col].map(SCANNER_SIGNAL_MARKERS)
+            display[col] = (markers + " " + display[col].astype(str)).where(markers.notna(), display[col])
+
+    column_config = {}
+    for col in SCANNER_NUMERIC_COLUMNS:
+        if col in display.columns:
+            values = pd.to_numeric(display[col], errors="coerce")
+            display[col] = values
+            # Whole numbers, or two decimals for columns with sub-rupee values
+            fractional = ((values.abs() < 1) & (values != 0)).any()
+            column_config[col] = st.column_config.NumberColumn(format="%.2f" if fractional else "%.0f")
+    if "Confidence" in display.columns:
+        display["Confidence"] = pd.to_numeric(display["Confidence"], errors="coerce")
+        column_config["Confidence"] = st.column_config.ProgressColumn(format="%d%%", min_value=0, max_value=100)
+
+    target.dataframe(display, column_config=column_config, use_container_width=True, hide_index=True)
 
 
 # ============================================================
-# OPTION CHAIN / OI / PCR
+# DIAGNOSTICS
 # ============================================================
-def fetch_option_contracts_v2(access_token: str, instrument_key: str, expiry_date: str | None = None) -> pd.DataFrame:
-    params = {"instrument_key": instrument_key}
-    if expiry_date:
-        params["expiry_date"] = expiry_date
-
-    response = requests.get(
-        UPSTOX_OPTION_CONTRACTS_V2,
-        headers=get_auth_headers(access_token),
-        params=params,
-        timeout=30,
-    )
-    response.raise_for_status()
-
-    payload = response.json()
-    data = payload.get("data", [])
-    if not data:
-        return pd.DataFrame()
-
-    df = pd.DataFrame(data)
-    if "expiry" in df.columns:
-        df["expiry"] = pd.to_datetime(df["expiry"], errors="coerce").dt.strftime("%Y-%m-%d")
-    return df
-
-
-def get_available_option_expiries(access_token: str, instrument_key: str) -> list[str]:
-    df = fetch_option_contracts_v2(access_token, instrument_key)
-    if df.empty or "expiry" not in df.columns:
-        return []
-
-    expiries = (
-        df["expiry"]
-        .dropna()
-        .astype(str)
-        .sort_values()
-        .unique()
-        .tolist()
-    )
-    return expiries
-
-
-def fetch_option_chain_v2(access_token: str, instrument_key: str, expiry_date: str) -> pd.DataFrame:
-    params = {
-        "instrument_key": instrument_key,
-        "expiry_date": expiry_date,
-    }
-
-    response = requests.get(
-        UPSTOX_OPTION_CHAIN_V2,
-        headers=get_auth_headers(access_token),
-        params=params,
-        timeout=30,
-    )
-    response.raise_for_status()
-
-    payload = response.json()
-    data = payload.get("data", [])
-    if not data:
-        return pd.DataFrame()
-
-    rows = []
-    for item in data:
-        call_md = item.get("call_options", {}).get("market_data", {}) or {}
-        put_md = item.get("put_options", {}).get("market_data", {}) or {}
-        call_greeks = item.get("call_options", {}).get("option_greeks", {}) or {}
-        put_greeks = item.get("put_options", {}).get("option_greeks", {}) or {}
-
-        rows.append(
-            {
-                "Expiry": item.get("expiry"),
-                "Strike": item.get("strike_price"),
-                "Underlying Spot": item.get("underlying_spot_price"),
-                "PCR": item.get("pcr"),
-
-                "Call Instrument Key": item.get("call_options", {}).get("instrument_key"),
-                "Call LTP": call_md.get("ltp"),
-                "Call Volume": call_md.get("volume"),
-                "Call OI": call_md.get("oi"),
-                "Call Prev OI": call_md.get("prev_oi"),
-                "Call Bid": call_md.get("bid_price"),
-                "Call Ask": call_md.get("ask_price"),
-                "Call IV": call_greeks.get("iv"),
-                "Call Delta": call_greeks.get("delta"),
-
-                "Put Instrument Key": item.get("put_options", {}).get("instrument_key"),
-                "Put LTP": put_md.get("ltp"),
-                "Put Volume": put_md.get("volume"),
-                "Put OI": put_md.get("oi"),
-                "Put Prev OI": put_md.get("prev_oi"),
-                "Put Bid": put_md.get("bid_price"),
-                "Put Ask": put_md.get("ask_price"),
-                "Put IV": put_greeks.get("iv"),
-                "Put Delta": put_greeks.get("delta"),
-            }
+def show_stage_timings(target, telemetry: Telemetry) -> None:
+    """Per-stage and per-symbol wall time, rows and bytes of the finished run, with a JSON export."""
+    with target.expander(f"Stage Timings ({telemetry.seconds:.2f}s)", expanded=True):
+        st.dataframe(
+            telemetry.stage_summary(),
+            column_config={
+                "seconds": st.column_config.NumberColumn(format="%.3f"),
+                "mean_ms": st.column_config.NumberColumn(format="%.1f"),
+                "max_ms": st.column_config.NumberColumn(format="%.1f"),
+            },
+            use_container_width=True,
+            hide_index=True,
         )
-
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df = df.sort_values("Strike").reset_index(drop=True)
-    return df
-
-
-def compute_option_chain_summary(option_chain_df: pd.DataFrame) -> dict:
-    if option_chain_df is None or option_chain_df.empty:
-        return {
-            "total_call_oi": np.nan,
-            "total_put_oi": np.nan,
-            "overall_pcr": np.nan,
-            "spot_price": np.nan,
-        }
-
-    total_call_oi = pd.to_numeric(option_chain_df["Call OI"], errors="coerce").fillna(0).sum()
-    total_put_oi = pd.to_numeric(option_chain_df["Put OI"], errors="coerce").fillna(0).sum()
-
-    overall_pcr = np.nan
-    if total_call_oi and total_call_oi != 0:
-        overall_pcr = total_put_oi / total_call_oi
-
-    spot_price = pd.to_numeric(option_chain_df["Underlying Spot"], errors="coerce").dropna()
-    spot_price = spot_price.iloc[0] if not spot_price.empty else np.nan
-
-    return {
-        "total_call_oi": total_call_oi,
-        "total_put_oi": total_put_oi,
-        "overall_pcr": overall_pcr,
-        "spot_price": spot_price,
-    }
-
-
-def interpret_pcr(overall_pcr: float) -> str:
-    if pd.isna(overall_pcr):
-        return "PCR unavailable"
-    if overall_pcr > 1.0:
-        return "Put-heavy positioning"
-    if overall_pcr < 1.0:
-        return "Call-heavy positioning"
-    return "Balanced positioning"
-
-
-# ============================================================
-# INDICATORS
-# ============================================================
-def compute_rsi(series: pd.Series, period: int = 14) -> pd.Series:
-    delta = series.diff()
-    gain = delta.clip(lower=0)
-    loss = -delta.clip(upper=0)
-
-    avg_gain = gain.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
-    avg_loss = loss.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
-
-    rs = avg_gain / avg_loss.replace(0, np.nan)
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-
-def compute_macd(series: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9):
-    ema_fast = series.ewm(span=fast, adjust=False).mean()
-    ema_slow = series.ewm(span=slow, adjust=False).mean()
-    macd = ema_fast - ema_slow
-    macd_signal = macd.ewm(span=signal, adjust=False).mean()
-    macd_hist = macd - macd_signal
-    return macd, macd_signal, macd_hist
-
-
-def compute_atr(df: pd.DataFrame, period: int = 14) -> pd.Series:
-    high_low = df["High"] - df["Low"]
-    high_close = (df["High"] - df["Close"].shift(1)).abs()
-    low_close = (df["Low"] - df["Close"].shift(1)).abs()
-
-    tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    atr = tr.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
-    return atr
-
-
-def compute_vwap(df: pd.DataFrame) -> pd.Series:
-    typical_price = (df["High"] + df["Low"] + df["Close"]) / 3.0
-    cum_tpv = (typical_price * df["Volume"]).cumsum()
-    cum_vol = df["Volume"].replace(0, np.nan).cumsum()
-    vwap = cum_tpv / cum_vol
-    return vwap
-
-
-# ============================================================
-# ANALYSIS HELPERS
-# ============================================================
-@st.cache_data(show_spinner=False)
-def compute_volume_metrics(df: pd.DataFrame, volume_ma_window: int) -> pd.DataFrame:
-    out = df.copy()
-    out["Vol_MA"] = out["Volume"].rolling(volume_ma_window, min_periods=1).mean()
-    out["Vol_Ratio"] = np.where(out["Vol_MA"] > 0, out["Volume"] / out["Vol_MA"], np.nan)
-    out["Price_Change_%"] = out["Close"].pct_change() * 100
-    out["Candle_Range"] = out["High"] - out["Low"]
-    out["Body_Size"] = (out["Close"] - out["Open"]).abs()
-
-    out["RSI"] = compute_rsi(out["Close"], 14)
-    out["MACD"], out["MACD_Signal"], out["MACD_Hist"] = compute_macd(out["Close"])
-    out["ATR"] = compute_atr(out, 14)
-    out["VWAP"] = compute_vwap(out)
-
-    return out
-
-
-def find_pivots(
-    df: pd.DataFrame,
-    left_bars: int = 3,
-    right_bars: int = 3,
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    highs = []
-    lows = []
-
-    if len(df) < (left_bars + right_bars + 1):
-        return (
-            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
-            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
-        )
-
-    for i in range(left_bars, len(df) - right_bars):
-        high_slice = df["High"].iloc[i - left_bars: i + right_bars + 1]
-        low_slice = df["Low"].iloc[i - left_bars: i + right_bars + 1]
-        cur_high = df["High"].iloc[i]
-        cur_low = df["Low"].iloc[i]
-
-        if cur_high == high_slice.max():
-            highs.append({"Date": df.index[i], "Price": float(cur_high), "Type": "Resistance"})
-        if cur_low == low_slice.min():
-            lows.append({"Date": df.index[i], "Price": float(cur_low), "Type": "Support"})
-
-    highs_df = pd.DataFrame(highs, columns=EMPTY_PIVOT_COLUMNS)
-    lows_df = pd.DataFrame(lows, columns=EMPTY_PIVOT_COLUMNS)
-    return highs_df, lows_df
-
-
-def cluster_levels(
-    pivots: pd.DataFrame,
-    current_price: float,
-    zone_width_pct: float,
-    zone_type: str,
-    min_touches: int,
-) -> List[Zone]:
-    if pivots is None or pivots.empty or "Price" not in pivots.columns or "Date" not in pivots.columns:
-        return []
-
-    working = pivots.sort_values("Price").reset_index(drop=True).copy()
-    zones: List[Zone] = []
-
-    band = current_price * zone_width_pct / 100.0
-    if band <= 0:
-        return []
-
-    cluster_prices = [float(working.loc[0, "Price"])]
-    cluster_dates = [pd.Timestamp(working.loc[0, "Date"])]
-
-    for i in range(1, len(working)):
-        price = float(working.loc[i, "Price"])
-        date = pd.Timestamp(working.loc[i, "Date"])
-        cluster_center = float(np.mean(cluster_prices))
-
-        if abs(price - cluster_center) <= band:
-            cluster_prices.append(price)
-            cluster_dates.append(date)
-        else:
-            if len(cluster_prices) >= min_touches:
-                center = float(np.mean(cluster_prices))
-                zones.append(
-                    Zone(
-                        zone_type=zone_type,
-                        center=center,
-                        lower=center - band,
-                        upper=center + band,
-                        touches=len(cluster_prices),
-                        last_touch=max(cluster_dates),
-                    )
-                )
-            cluster_prices = [price]
-            cluster_dates = [date]
-
-    if len(cluster_prices) >= min_touches:
-        center = float(np.mean(cluster_prices))
-        zones.append(
-            Zone(
-                zone_type=zone_type,
-                center=center,
-                lower=center - band,
-                upper=center + band,
-                touches=len(cluster_prices),
-                last_touch=max(cluster_dates),
+        labels = telemetry.label_summary()
+        if len(labels) > 1:
+            st.caption("Slowest symbols")
+            st.dataframe(
+                labels[["label", "seconds", "rows", "nbytes"]].head(20),
+                column_config={"seconds": st.column_config.NumberColumn(format="%.3f")},
+                use_container_width=True,
+                hide_index=True,
             )
+        if telemetry.profile_file is not None:
+            st.caption(f"cProfile written to {telemetry.profile_file}")
+        st.download_button(
+            "Download JSON",
+            telemetry.to_json(),
+            file_name=f"stage_timings_{telemetry.started_at:%Y%m%d_%H%M%S}.json",
+            mime="application/json",
         )
 
-    return zones
 
-
-def detect_trendlines(
-    df: pd.DataFrame,
-    pivot_highs: pd.DataFrame,
-    pivot_lows: pd.DataFrame,
-    tolerance_pct: float = 1.0,
-) -> List[Trendline]:
-    trendlines: List[Trendline] = []
-    index_lookup = {ts: i for i, ts in enumerate(df.index)}
-
-    def _build(points: pd.DataFrame, line_type: str, direction: str):
-        if points is None or len(points) < 2 or "Date" not in points.columns or "Price" not in points.columns:
-            return None
-
-        pts = points.sort_values("Date").copy()
-
-        for i in range(len(pts) - 1, 0, -1):
-            p2 = pts.iloc[i]
-            p1 = pts.iloc[i - 1]
-            y1, y2 = float(p1["Price"]), float(p2["Price"])
-
-            if direction == "up" and y2 <= y1:
-                continue
-            if direction == "down" and y2 >= y1:
-                continue
-
-            x0 = pd.Timestamp(p1["Date"])
-            x_mid = pd.Timestamp(p2["Date"])
-            i0 = index_lookup.get(x0)
-            i1 = index_lookup.get(x_mid)
-            if i0 is None or i1 is None or i1 == i0:
-                continue
-
-            slope = (y2 - y1) / (i1 - i0)
-            touches = 0
-
-            for _, row in pts.iterrows():
-                xi = index_lookup.get(pd.Timestamp(row["Date"]))
-                if xi is None:
-                    continue
-                projected = y1 + slope * (xi - i0)
-                diff_pct = abs(float(row["Price"]) - projected) / max(abs(projected), 1e-9) * 100
-                if diff_pct <= tolerance_pct:
-                    touches += 1
-
-            last_idx = len(df) - 1
-            projected_now = y1 + slope * (last_idx - i0)
-            last_close = float(df["Close"].iloc[-1])
-
-            if line_type == "Support Trendline":
-                status = "Holding" if last_close >= projected_now * (1 - tolerance_pct / 100) else "Broken"
+def show_http_metrics(target, key: str) -> None:
+    """Upstox request counts, rolling latency percentiles, sizes, retries, 429s and cache hit ratios."""
+    metrics = get_http_metrics()
+    with target.container():
+        with st.expander("HTTP Metrics", expanded=True):
+            endpoints = metrics.endpoint_summary()
+            if endpoints.empty:
+                st.caption("No Upstox requests yet.")
             else:
-                status = "Holding" if last_close <= projected_now * (1 + tolerance_pct / 100) else "Broken"
-
-            return Trendline(
-                line_type=line_type,
-                x0=x0,
-                y0=y1,
-                x1=df.index[-1],
-                y1=float(projected_now),
-                slope_per_bar=float(slope),
-                touches=int(touches),
-                status=status,
-            )
-        return None
-
-    support_line = _build(pivot_lows, "Support Trendline", "up")
-    resistance_line = _build(pivot_highs, "Resistance Trendline", "down")
-
-    if support_line:
-        trendlines.append(support_line)
-    if resistance_line:
-        trendlines.append(resistance_line)
-
-    return trendlines
-
-
-def detect_market_structure(pivot_highs: pd.DataFrame, pivot_lows: pd.DataFrame) -> MarketStructure:
-    highs = pivot_highs.copy() if pivot_highs is not None else pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
-    lows = pivot_lows.copy() if pivot_lows is not None else pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
-
-    if "Date" not in highs.columns:
-        highs = pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
-    if "Date" not in lows.columns:
-        lows = pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
-
-    highs = highs.sort_values("Date").copy()
-    lows = lows.sort_values("Date").copy()
-
-    latest_h = prev_h = latest_l = prev_l = None
-
-    if len(highs) >= 2:
-        prev_h = float(highs.iloc[-2]["Price"])
-        latest_h = float(highs.iloc[-1]["Price"])
-    if len(lows) >= 2:
-        prev_l = float(lows.iloc[-2]["Price"])
-        latest_l = float(lows.iloc[-1]["Price"])
-
-    if latest_h is not None and prev_h is not None and latest_l is not None and prev_l is not None:
-        hh = latest_h > prev_h
-        hl = latest_l > prev_l
-        lh = latest_h < prev_h
-        ll = latest_l < prev_l
-
-        if hh and hl:
-            return MarketStructure(
-                "Higher Highs / Higher Lows",
-                "Bullish",
-                latest_h,
-                prev_h,
-                latest_l,
-                prev_l,
-                "Price structure remains bullish with both the latest swing high and swing low above the previous ones.",
-            )
-        if lh and ll:
-            return MarketStructure(
-                "Lower Highs / Lower Lows",
-                "Bearish",
-                latest_h,
-                prev_h,
-                latest_l,
-                prev_l,
-                "Price structure remains bearish with both the latest swing high and swing low below the previous ones.",
-            )
-        if hh and ll:
-            return MarketStructure(
-                "Expansion / Volatile Mixed Structure",
-                "Neutral",
-                latest_h,
-                prev_h,
-                latest_l,
-                prev_l,
-                "The chart is making a higher high but also a lower low, which suggests expansion and unstable structure.",
+                st.dataframe(
+                    endpoints,
+                    column_config={
+                        col: st.column_config.NumberColumn(format="%.1f")
+                        for col in ["p50_ms", "p90_ms", "p99_ms", "mean_kb", "limiter_wait_s"]
+                    },
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                st.caption(f"Percentiles and sizes over the last {metrics.window_seconds:.0f}s")
+            st.dataframe(
+                metrics.cache_summary(),
+                column_config={"hit_ratio": st.column_config.ProgressColumn(format="%.2f", min_value=0, max_value=1)},
+                use_container_width=True,
+                hide_index=True,
             )
-        if lh and hl:
-            return MarketStructure(
-                "Compression / Range Structure",
-                "Neutral",
-                latest_h,
-                prev_h,
-                latest_l,
-                prev_l,
-                "The chart is making a lower high and a higher low, which suggests compression or range behaviour.",
+            st.download_button(
+                "Download Prometheus metrics",
+                metrics.prometheus_text(),
+                file_name="upstox_metrics.prom",
+                mime="text/plain",
+                key=key,
             )
 
-    return MarketStructure(
-        "Insufficient swing structure",
-        "Neutral",
-        latest_h,
-        prev_h,
-        latest_l,
-        prev_l,
-        "There are not enough clear swing highs and swing lows yet to classify market structure confidently.",
-    )
-
-
-def summarize_volume(df: pd.DataFrame) -> dict:
-    latest = df.iloc[-1]
-    recent = df.tail(min(10, len(df))).copy()
-
-    vol_ratio = float(latest["Vol_Ratio"]) if pd.notna(latest["Vol_Ratio"]) else np.nan
-    price_change = float(latest["Price_Change_%"]) if pd.notna(latest["Price_Change_%"]) else 0.0
-
-    if pd.isna(vol_ratio):
-        latest_signal = "Not enough data"
-    elif vol_ratio >= 2.0:
-        latest_signal = "Very high volume spike"
-    elif vol_ratio >= 1.5:
-        latest_signal = "High volume"
-    elif vol_ratio >= 1.1:
-        latest_signal = "Slightly above average volume"
-    elif vol_ratio >= 0.8:
-        latest_signal = "Normal volume"
-    else:
-        latest_signal = "Below-average volume"
-
-    avg_recent_vol_ratio = float(recent["Vol_Ratio"].replace([np.inf, -np.inf], np.nan).dropna().mean()) if len(recent) else np.nan
-    recent_up_days = recent[recent["Close"] > recent["Open"]]
-    recent_down_days = recent[recent["Close"] < recent["Open"]]
-
-    up_vol = float(recent_up_days["Volume"].mean()) if not recent_up_days.empty else np.nan
-    down_vol = float(recent_down_days["Volume"].mean()) if not recent_down_days.empty else np.nan
-
-    if not np.isnan(up_vol) and not np.isnan(down_vol):
-        if up_vol > down_vol * 1.15:
-            pressure = "Buying pressure is stronger than selling pressure"
-        elif down_vol > up_vol * 1.15:
-            pressure = "Selling pressure is stronger than buying pressure"
-        else:
-            pressure = "Buying and selling pressure look balanced"
-    else:
-        pressure = "Not enough directional candles to compare buying vs selling pressure"
-
-    if price_change > 0 and vol_ratio >= 1.2:
-        conviction = "Price rose with volume support"
-    elif price_change > 0 and vol_ratio < 1.0:
-        conviction = "Price rose, but volume confirmation is weak"
-    elif price_change < 0 and vol_ratio >= 1.2:
-        conviction = "Price fell with strong participation"
-    elif price_change < 0 and vol_ratio < 1.0:
-        conviction = "Price fell on lighter participation"
-    else:
-        conviction = "Price and volume are neutral"
-
-    return {
-        "latest_signal": latest_signal,
-        "pressure": pressure,
-        "conviction": conviction,
-        "latest_vol_ratio": vol_ratio,
-        "avg_recent_vol_ratio": avg_recent_vol_ratio,
-    }
-
-
-def zones_to_dataframe(zones: List[Zone], current_price: float) -> pd.DataFrame:
-    if not zones:
-        return pd.DataFrame(columns=["Type", "Zone Range", "Center", "Touches", "Distance %", "Last Touch"])
-
-    rows = []
-    for z in zones:
-        distance_pct = ((z.center - current_price) / current_price) * 100 if current_price else np.nan
-        rows.append(
-            {
-                "Type": z.zone_type,
-                "Zone Range": f"{z.lower:,.2f} - {z.upper:,.2f}",
-                "Center": round(z.center, 2),
-                "Touches": z.touches,
-                "Distance %": round(distance_pct, 2),
-                "Last Touch": format_indian_date(z.last_touch),
-            }
-        )
-
-    out = pd.DataFrame(rows)
-    return out.sort_values(["Type", "Center"], ascending=[True, True]).reset_index(drop=True)
-
-
-def nearest_zones(zones: List[Zone], current_price: float) -> Tuple[Zone | None, Zone | None]:
-    supports = [z for z in zones if z.zone_type == "Support" and z.center <= current_price]
-    resistances = [z for z in zones if z.zone_type == "Resistance" and z.center >= current_price]
-
-    nearest_support = max(supports, key=lambda x: x.center) if supports else None
-    nearest_resistance = min(resistances, key=lambda x: x.center) if resistances else None
-    return nearest_support, nearest_resistance
-
-
-def get_volatility_label(price: float, atr: float) -> str:
-    if pd.isna(price) or pd.isna(atr):
-        return "N/A"
-
-    if price <= 500:
-        if atr < 1.5:
-            return "Low Volatility"
-        elif atr < 3:
-            return "Medium Volatility"
-        else:
-            return "High Volatility"
-
-    elif price <= 1500:
-        if atr < 5:
-            return "Low Volatility"
-        elif atr < 15:
-            return "Medium Volatility"
-        else:
-            return "High Volatility"
-
-    else:
-        if atr < 10:
-            return "Low Volatility"
-        elif atr < 30:
-            return "Medium Volatility"
-        else:
-            return "High Volatility"
-
-
-# ============================================================
-# TRADE CONFIRMATION ENGINE
-# ============================================================
-def get_trendline_status(trendlines: List[Trendline], line_type: str) -> Optional[str]:
-    for tl in trendlines:
-        if tl.line_type == line_type:
-            return tl.status
-    return None
-
-
-def get_projected_trendline_price(trendlines: List[Trendline], line_type: str) -> Optional[float]:
-    for tl in trendlines:
-        if tl.line_type == line_type:
-            return tl.y1
-    return None
-
-
-def detect_breakout_breakdown(
-    df: pd.DataFrame,
-    nearest_support: Zone | None,
-    nearest_resistance: Zone | None,
-    breakout_buffer_pct: float = 0.15,
-):
-    if len(df) < 2:
-        return False, False
-
-    latest = df.iloc[-1]
-    prev = df.iloc[-2]
-
-    breakout_confirmed = False
-    breakdown_confirmed = False
-
-    if nearest_resistance is not None:
-        res_level = nearest_resistance.upper
-        breakout_level = res_level * (1 + breakout_buffer_pct / 100)
-        breakout_confirmed = (
-            float(prev["Close"]) <= breakout_level and
-            float(latest["Close"]) > breakout_level and
-            float(latest["Close"]) > float(latest["Open"])
-        )
-
-    if nearest_support is not None:
-        sup_level = nearest_support.lower
-        breakdown_level = sup_level * (1 - breakout_buffer_pct / 100)
-        breakdown_confirmed = (
-            float(prev["Close"]) >= breakdown_level and
-            float(latest["Close"]) < breakdown_level and
-            float(latest["Close"]) < float(latest["Open"])
-        )
-
-    return breakout_confirmed, breakdown_confirmed
-
-
-def detect_retest_logic(
-    df: pd.DataFrame,
-    nearest_support: Zone | None,
-    nearest_resistance: Zone | None,
-    atr_multiplier: float = 0.35,
-):
-    if len(df) < 3:
-        return False, False
-
-    latest = df.iloc[-1]
-    latest_close = float(latest["Close"])
-    latest_low = float(latest["Low"])
-    latest_high = float(latest["High"])
-    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
-
-    retest_buy_ready = False
-    retest_sell_ready = False
-
-    if nearest_resistance is not None and pd.notna(atr):
-        resistance_test_zone = nearest_resistance.upper
-        if latest_close > resistance_test_zone and latest_low <= resistance_test_zone + atr * atr_multiplier:
-            retest_buy_ready = True
-
-    if nearest_support is not None and pd.notna(atr):
-        support_test_zone = nearest_support.lower
-        if latest_close < support_test_zone and latest_high >= support_test_zone - atr * atr_multiplier:
-            retest_sell_ready = True
-
-    return retest_buy_ready, retest_sell_ready
-
-
-def evaluate_trade_confirmation(
-    df: pd.DataFrame,
-    trendlines: List[Trendline],
-    market_structure: MarketStructure,
-    nearest_support: Zone | None,
-    nearest_resistance: Zone | None,
-    require_trendline_confirmation: bool = False,
-    use_retest_bonus: bool = True,
-    breakout_buffer_pct: float = 0.15,
-) -> TradeConfirmation:
-    latest = df.iloc[-1]
-
-    close_price = float(latest["Close"])
-    open_price = float(latest["Open"])
-    high_price = float(latest["High"])
-    low_price = float(latest["Low"])
-    volume = float(latest["Volume"])
-    avg_volume = float(latest["Vol_MA"]) if pd.notna(latest["Vol_MA"]) else np.nan
-    vol_ratio = float(latest["Vol_Ratio"]) if pd.notna(latest["Vol_Ratio"]) else np.nan
-    rsi = float(latest["RSI"]) if pd.notna(latest["RSI"]) else np.nan
-    macd = float(latest["MACD"]) if pd.notna(latest["MACD"]) else np.nan
-    macd_signal = float(latest["MACD_Signal"]) if pd.notna(latest["MACD_Signal"]) else np.nan
-    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
-    vwap = float(latest["VWAP"]) if pd.notna(latest["VWAP"]) else np.nan
-
-    support_status = get_trendline_status(trendlines, "Support Trendline")
-    resistance_status = get_trendline_status(trendlines, "Resistance Trendline")
-
-    breakout_confirmed, breakdown_confirmed = detect_breakout_breakdown(
-        df=df,
-        nearest_support=nearest_support,
-        nearest_resistance=nearest_resistance,
-        breakout_buffer_pct=breakout_buffer_pct,
-    )
-
-    retest_buy_ready, retest_sell_ready = detect_retest_logic(
-        df=df,
-        nearest_support=nearest_support,
-        nearest_resistance=nearest_resistance,
-    )
-
-    buy_score = 0
-    sell_score = 0
-    buy_reasons = []
-    sell_reasons = []
-
-    # VWAP
-    if pd.notna(vwap):
-        if close_price > vwap:
-            buy_score += 2
-            buy_reasons.append("Price is above VWAP")
-        elif close_price < vwap:
-            sell_score += 2
-            sell_reasons.append("Price is below VWAP")
-
-    # RSI
-    if pd.notna(rsi):
-        if 55 <= rsi <= 70:
-            buy_score += 1
-            buy_reasons.append("RSI is in bullish range")
-        elif 30 <= rsi <= 45:
-            sell_score += 1
-            sell_reasons.append("RSI is in bearish range")
-        elif rsi > 75:
-            sell_score += 1
-            sell_reasons.append("RSI is overbought")
-        elif rsi < 25:
-            buy_score += 1
-            buy_reasons.append("RSI is in oversold bounce zone")
-
-    # MACD
-    if pd.notna(macd) and pd.notna(macd_signal):
-        if macd > macd_signal:
-            buy_score += 2
-            buy_reasons.append("MACD is above signal line")
-        elif macd < macd_signal:
-            sell_score += 2
-            sell_reasons.append("MACD is below signal line")
-
-    # Volume
-    if pd.notna(vol_ratio):
-        if vol_ratio >= 1.2 and close_price > open_price:
-            buy_score += 1
-            buy_reasons.append("Bullish candle has above-average volume")
-        elif vol_ratio >= 1.2 and close_price < open_price:
-            sell_score += 1
-            sell_reasons.append("Bearish candle has above-average volume")
-
-    # Trendline
-    if support_status == "Holding":
-        buy_score += 2
-        buy_reasons.append("Support trendline is holding")
-    elif support_status == "Broken":
-        sell_score += 2
-        sell_reasons.append("Support trendline is broken")
-
-    if resistance_status == "Broken":
-        buy_score += 2
-        buy_reasons.append("Resistance trendline is broken")
-    elif resistance_status == "Holding":
-        sell_score += 2
-        sell_reasons.append("Resistance trendline is still holding")
-
-    # Market structure
-    if market_structure.trend_bias == "Bullish":
-        buy_score += 2
-        buy_reasons.append("Market structure is bullish")
-    elif market_structure.trend_bias == "Bearish":
-        sell_score += 2
-        sell_reasons.append("Market structure is bearish")
-
-    # Breakout / breakdown
-    if breakout_confirmed:
-        buy_score += 2
-        buy_reasons.append("Resistance breakout candle is confirmed")
-
-    if breakdown_confirmed:
-        sell_score += 2
-        sell_reasons.append("Support breakdown candle is confirmed")
-
-    # Retest logic
-    if use_retest_bonus and retest_buy_ready:
-        buy_score += 1
-        buy_reasons.append("Price is retesting breakout zone constructively")
-
-    if use_retest_bonus and retest_sell_ready:
-        sell_score += 1
-        sell_reasons.append("Price is retesting breakdown zone weakly")
-
-    # Zone distance filter
-    if nearest_resistance is not None:
-        upside_room_pct = ((nearest_resistance.center - close_price) / close_price) * 100
-        if 0 <= upside_room_pct <= 0.4:
-            buy_score -= 1
-            buy_reasons.append("Upside room is limited due to nearby resistance")
-
-    if nearest_support is not None:
-        downside_room_pct = ((close_price - nearest_support.center) / close_price) * 100
-        if 0 <= downside_room_pct <= 0.4:
-            sell_score -= 1
-            sell_reasons.append("Downside room is limited due to nearby support")
-
-    # ATR chop filter
-    if pd.notna(atr) and close_price > 0:
-        atr_pct = (atr / close_price) * 100
-        if atr_pct < 0.35:
-            buy_score -= 1
-            sell_score -= 1
-
-    if require_trendline_confirmation:
-        if support_status is None and resistance_status is None:
-            buy_score -= 1
-            sell_score -= 1
-
-    # Final signal
-    reasons = []
-    signal = "Hold / Neutral"
-    confidence = 50
-    quality = "Low"
-
-    if buy_score >= 10 and buy_score > sell_score:
-        signal = "Strong Buy"
-        confidence = min(95, 55 + buy_score * 4)
-        quality = "High"
-        reasons = buy_reasons
-    elif buy_score >= 7 and buy_score > sell_score:
-        signal = "Buy"
-        confidence = min(90, 48 + buy_score * 4)
-        quality = "Medium" if buy_score < 9 else "High"
-        reasons = buy_reasons
-    elif sell_score >= 10 and sell_score > buy_score:
-        signal = "Strong Sell"
-        confidence = min(95, 55 + sell_score * 4)
-        quality = "High"
-        reasons = sell_reasons
-    elif sell_score >= 7 and sell_score > buy_score:
-        signal = "Sell"
-        confidence = min(90, 48 + sell_score * 4)
-        quality = "Medium" if sell_score < 9 else "High"
-        reasons = sell_reasons
-    else:
-        signal = "Hold / Neutral"
-        confidence = 50
-        quality = "Low"
-        reasons = ["No strong multi-indicator confirmation"]
-
-    return TradeConfirmation(
-        signal=signal,
-        confidence=int(confidence),
-        buy_score=int(buy_score),
-        sell_score=int(sell_score),
-        quality=quality,
-        reasons=reasons,
-        breakout_confirmed=breakout_confirmed,
-        breakdown_confirmed=breakdown_confirmed,
-        retest_buy_ready=retest_buy_ready,
-        retest_sell_ready=retest_sell_ready,
-    )
-
-
-def get_trade_levels(trade_confirmation: TradeConfirmation, df: pd.DataFrame):
-    latest = df.iloc[-1]
-
-    close_price = float(latest["Close"])
-    high_price = float(latest["High"])
-    low_price = float(latest["Low"])
-    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
-
-    if pd.isna(atr) or atr <= 0:
-        return None
-
-    signal = trade_confirmation.signal
-
-    if signal in ["Buy", "Strong Buy"]:
-        entry = close_price
-        safe_entry = high_price + (0.2 * atr)
-        stop_loss = entry - (1.5 * atr)
-        target_1 = entry + (1.5 * atr)
-        target_2 = entry + (2.5 * atr)
-
-        return {
-            "side": "BUY",
-            "entry": round(entry, 2),
-            "safe_entry": round(safe_entry, 2),
-            "stop_loss": round(stop_loss, 2),
-            "target_1": round(target_1, 2),
-            "target_2": round(target_2, 2),
-        }
-
-    elif signal in ["Sell", "Strong Sell"]:
-        entry = close_price
-        safe_entry = low_price - (0.2 * atr)
-        stop_loss = entry + (1.5 * atr)
-        target_1 = entry - (1.5 * atr)
-        target_2 = entry - (2.5 * atr)
-
-        return {
-            "side": "SELL",
-            "entry": round(entry, 2),
-            "safe_entry": round(safe_entry, 2),
-            "stop_loss": round(stop_loss, 2),
-            "target_1": round(target_1, 2),
-            "target_2": round(target_2, 2),
-        }
-
-    return None
-
-# ============================================================
-# VOLUME STRENGTH LABEL
-# ============================================================
-def get_volume_strength_label(vol_ratio):
-
-    if pd.isna(vol_ratio):
-        return ""
-
-    if vol_ratio < 0.5:
-        return "Very weak participation"
-
-    elif vol_ratio < 1.0:
-        return "Below average volume"
-
-    elif vol_ratio < 1.5:
-        return "Good volume support"
-
-    elif vol_ratio < 2.0:
-        return "Strong participation"
-
-    else:
-        return "Major volume spike"
-
-# ============================================================
-# WATCHLIST ANALYSIS FUNCTION
-# ============================================================
-def analyze_single_symbol(
-    access_token,
-    symbol,
-    instruments_df,
-    period,
-    interval,
-    lookup_exchange,
-    volume_ma_window,
-    left_bars,
-    right_bars,
-    zone_width_pct,
-    min_touches,
-    trendline_tolerance_pct,
-    include_live,
-    require_trendline_confirmation,
-    use_retest_bonus,
-    breakout_buffer_pct,
-):
-    try:
-
-        matched = filter_instruments(
-            instruments_df=instruments_df,
-            query=symbol,
-            mode="Equity",
-            exchange=lookup_exchange,
-        )
-
-        if matched.empty:
-            return {
-                "Stock": symbol,
-                "Recommended Action": "Not Found",
-            }
-
-        row = matched.iloc[0]
-        instrument_key = row["instrument_key"]
-
-        raw = load_upstox_data(
-            access_token=access_token,
-            instrument_key=instrument_key,
-            period=period,
-            interval=interval,
-            include_live=include_live,
-        )
-
-        if raw.empty:
-            return {
-                "Stock": symbol,
-                "Recommended Action": "No Data",
-            }
-
-        df = compute_volume_metrics(raw, volume_ma_window)
-
-        pivot_highs, pivot_lows = find_pivots(
-            df,
-            left_bars=left_bars,
-            right_bars=right_bars,
-        )
-
-        current_price = float(df["Close"].iloc[-1])
-
-        support_zones = cluster_levels(
-            pivots=pivot_lows,
-            current_price=current_price,
-            zone_width_pct=zone_width_pct,
-            zone_type="Support",
-            min_touches=min_touches,
-        )
-
-        resistance_zones = cluster_levels(
-            pivots=pivot_highs,
-            current_price=current_price,
-            zone_width_pct=zone_width_pct,
-            zone_type="Resistance",
-            min_touches=min_touches,
-        )
-
-        all_zones = support_zones + resistance_zones
-
-        nearest_support, nearest_resistance = nearest_zones(
-            all_zones,
-            current_price,
-        )
-
-        trendlines = detect_trendlines(
-            df=df,
-            pivot_highs=pivot_highs,
-            pivot_lows=pivot_lows,
-            tolerance_pct=trendline_tolerance_pct,
-        )
-
-        market_structure = detect_market_structure(
-            pivot_highs=pivot_highs,
-            pivot_lows=pivot_lows,
-        )
-
-        vol_summary = summarize_volume(df)
-
-        trade_confirmation = evaluate_trade_confirmation(
-            df=df,
-            trendlines=trendlines,
-            market_structure=market_structure,
-            nearest_support=nearest_support,
-            nearest_resistance=nearest_resistance,
-            require_trendline_confirmation=require_trendline_confirmation,
-            use_retest_bonus=use_retest_bonus,
-            breakout_buffer_pct=breakout_buffer_pct,
-        )
-
-        trade_levels = get_trade_levels(
-            trade_confirmation,
-            df,
-        )
-
-        return {
-            "Stock": symbol,
-            "Current Price": round(current_price, 2),
-
-            "Nearest Support":
-                round(nearest_support.center, 2)
-                if nearest_support else None,
-
-            "Nearest Resistance":
-                round(nearest_resistance.center, 2)
-                if nearest_resistance else None,
-
-            "Volume vs MA":
-                (
-                    f"{vol_summary['latest_vol_ratio']:.2f} "
-                    f"({get_volume_strength_label(vol_summary['latest_vol_ratio'])})"
-                )
-                if pd.notna(vol_summary["latest_vol_ratio"])
-                else "",
-
-            "Structure": market_structure.trend_bias,
-
-            "Signal": trade_confirmation.signal,
-
-            "Confidence": trade_confirmation.confidence,
-
-            "Buy Score": trade_confirmation.buy_score,
-
-            "Sell Score": trade_confirmation.sell_score,
-
-            "Recommended Action":
-                trade_levels["side"]
-                if trade_levels
-                else "HOLD",
-
-            "Buy Price":
-                trade_levels["entry"]
-                if trade_levels and trade_levels["side"] == "BUY"
-                else None,
-
-            "Safe Buy Above":
-                trade_levels["safe_entry"]
-                if trade_levels and trade_levels["side"] == "BUY"
-                else None,
-
-            "Stop Loss":
-                trade_levels["stop_loss"]
-                if trade_levels
-                else None,
-
-            "Target 1":
-                trade_levels["target_1"]
-                if trade_levels
-                else None,
-        }
-
-    except Exception as e:
-        return {
-            "Stock": symbol,
-            "Recommended Action": "Error",
-            "Error": str(e),
-        }
-
 
 # ============================================================
 # CHART
 # ============================================================
+@timed_stage
 def build_chart(
     df: pd.DataFrame,
     support_zones: List[Zone],
@@ -1673,7 +398,7 @@ def build_chart(
                 y=[tl.y0, tl.y1],
                 mode="lines",
                 name=f"{tl.line_type} ({tl.status})",
-                line=dict(width=2, dash="dot"),
+                line=dict(width=2, dash="dash" if "Channel" in tl.line_type else "dot"),
             ),
             row=1,
             col=1,
@@ -1746,7 +471,7 @@ selected_row = None
 filtered_df = pd.DataFrame()
 
 try:
-    instruments_df = load_upstox_instruments(lookup_exchange)
+    instruments_df = get_upstox_instruments(lookup_exchange)
     filtered_df = filter_instruments(
         instruments_df=instruments_df,
         query=instrument_search,
@@ -1802,13 +527,27 @@ min_touches = st.sidebar.slider("Minimum Touches per Zone", min_value=1, max_val
 volume_ma_window = st.sidebar.slider("Volume MA Window", min_value=5, max_value=50, value=20)
 show_pivots = st.sidebar.checkbox("Show Pivot Markers", value=True)
 trendline_tolerance_pct = st.sidebar.slider("Trendline Tolerance %", min_value=0.3, max_value=3.0, value=1.0, step=0.1)
+trendlines_per_side = st.sidebar.slider("Trendlines per Side", min_value=1, max_value=5, value=1)
+show_channels = st.sidebar.checkbox("Show Trendline Channels", value=False)
 include_live = st.sidebar.checkbox("Append live/current-session data", value=True)
+use_candle_store = st.sidebar.checkbox(
+    "Use local candle cache",
+    value=True,
+    help="Keep completed candles on disk and fetch only the missing range from Upstox on later runs.",
+)
+candle_store = get_candle_store() if use_candle_store else None
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Trade Confirmation Settings")
 require_trendline_confirmation = st.sidebar.checkbox("Require trendline confirmation", value=False)
 use_retest_bonus = st.sidebar.checkbox("Use retest bonus", value=True)
 breakout_buffer_pct = st.sidebar.slider("Breakout / Breakdown Buffer %", min_value=0.05, max_value=1.00, value=0.15, step=0.05)
+show_backtest = st.sidebar.checkbox(
+    "Backtest signals on loaded history",
+    value=False,
+    help="Score every candle of the loaded period the same way, without lookahead, and simulate the stop/target exits.",
+)
+backtest_max_hold_bars = st.sidebar.slider("Backtest Max Bars in Trade", min_value=5, max_value=200, value=50, step=5)
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Option Chain / OI")
@@ -1818,8 +557,107 @@ show_option_chain = st.sidebar.checkbox(
     help="Fetch option-chain OI data for the selected underlying if options are available.",
 )
 
+st.sidebar.markdown("---")
+st.sidebar.subheader("Multi-Timeframe")
+multi_timeframe = st.sidebar.checkbox(
+    "Multi-timeframe confluence",
+    value=False,
+    help="Fetch the finest selected interval once and resample it locally into the others.",
+)
+mtf_timeframes = st.sidebar.multiselect(
+    "Timeframes",
+    options=MULTI_TIMEFRAME_INTERVALS,
+    default=["15m", "1h", "1d"],
+)
+
+st.sidebar.markdown("---")
+st.sidebar.subheader("Streaming")
+stream_mode = st.sidebar.checkbox(
+    "Streaming mode (live ticks)",
+    value=False,
+    help="Subscribe to live ticks, build candles in memory and refresh the analysis without refetching history.",
+)
+stream_source = st.sidebar.selectbox("Tick Source", options=["Upstox feed", "Local replay"], index=0)
+replay_address = st.sidebar.text_input(
+    "Replay Server",
+    value="127.0.0.1:8765",
+    help="Address of tick_replay_server.py when the tick source is Local replay.",
+)
+stream_refresh_ms = st.sidebar.slider("Streaming Refresh (ms)", min_value=500, max_value=5000, value=1000, step=250)
+
 run_btn = st.sidebar.button("Run Analysis", type="primary")
 
+if stream_mode and run_btn:
+    st.session_state["streaming_active"] = True
+if not stream_mode or st.sidebar.button("Stop Streaming", disabled=not st.session_state.get("streaming_active", False)):
+    st.session_state["streaming_active"] = False
+streaming_active = bool(st.session_state.get("streaming_active", False))
+if not streaming_active:
+    get_stream_feeds().release(stream_holder_id())
+
+# ============================================================
+# PARAMETER SWEEP
+# ============================================================
+st.sidebar.markdown("---")
+st.sidebar.subheader("Parameter Sweep")
+
+SWEEP_METHODS = {"Random sample": "random", "Bayesian (TPE)": "bayesian", "Full grid": "grid"}
+sweep_method = SWEEP_METHODS[st.sidebar.selectbox("Sweep Sampling", options=list(SWEEP_METHODS), index=0)]
+sweep_metric = st.sidebar.selectbox(
+    "Rank Parameter Sets By",
+    options=list(SWEEP_METRICS),
+    format_func=SWEEP_METRICS.get,
+)
+sweep_samples = st.sidebar.slider(
+    "Parameter Sets to Score",
+    min_value=8,
+    max_value=256,
+    value=48,
+    step=8,
+    disabled=sweep_method == "grid",
+)
+sweep_max_hold_bars = st.sidebar.slider(
+    "Sweep Max Bars in Trade",
+    min_value=5,
+    max_value=100,
+    value=20,
+    help="Historical signals are traded like the signal backtest, with a time exit after this many candles. "
+    "Zones are judged over as many candles.",
+)
+sweep_workers = st.sidebar.slider("Sweep Worker Processes", min_value=1, max_value=32, value=SWEEP_WORKERS)
+
+with st.sidebar.expander("Sweep Grid"):
+    sweep_grid = {
+        "left_bars": st.multiselect(
+            "Pivot Left Bars", options=list(range(2, 11)), default=SWEEP_PARAMETER_GRID["left_bars"]
+        ),
+        "right_bars": st.multiselect(
+            "Pivot Right Bars", options=list(range(2, 11)), default=SWEEP_PARAMETER_GRID["right_bars"]
+        ),
+        "zone_width_pct": st.multiselect(
+            "Zone Width %",
+            options=[round(0.2 * i, 1) for i in range(1, 16)],
+            default=SWEEP_PARAMETER_GRID["zone_width_pct"],
+        ),
+        "min_touches": st.multiselect(
+            "Minimum Touches per Zone", options=list(range(1, 6)), default=SWEEP_PARAMETER_GRID["min_touches"]
+        ),
+        "trendline_tolerance_pct": st.multiselect(
+            "Trendline Tolerance %",
+            options=[0.3, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0],
+            default=SWEEP_PARAMETER_GRID["trendline_tolerance_pct"],
+        ),
+        "breakout_buffer_pct": st.multiselect(
+            "Breakout / Breakdown Buffer %",
+            options=[0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0],
+            default=SWEEP_PARAMETER_GRID["breakout_buffer_pct"],
+        ),
+    }
+    sweep_grid = {name: sorted(values) for name, values in sweep_grid.items()}
+    st.caption(f"{sweep_grid_size(sweep_grid):,} combinations")
+
+run_sweep_btn = st.sidebar.button("Run Parameter Sweep", type="secondary")
+
 # ============================================================
 # WATCHLIST SCANNER
 # ============================================================
@@ -1854,12 +692,148 @@ NH
 LICI""", height=200,
 )
 
+scan_scope = st.sidebar.radio(
+    "Scan",
+    options=["Watchlist", "Entire segment"],
+    horizontal=True,
+    help="Entire segment scans every instrument of the chosen NSE segment instead of the list above.",
+)
+scan_universe_name = st.sidebar.selectbox(
+    "Segment",
+    options=SCAN_UNIVERSES,
+    index=0,
+    disabled=scan_scope != "Entire segment",
+)
+
+concurrent_scan = st.sidebar.checkbox(
+    "Concurrent scan",
+    value=True,
+    help="Overlap Upstox fetches and run the analysis on a worker pool. Results stream in as symbols finish.",
+)
+scan_fetch_workers = st.sidebar.slider("Scanner Fetch Workers", min_value=2, max_value=32, value=8)
+incremental_rescan = st.sidebar.checkbox(
+    "Reuse unchanged symbols",
+    value=True,
+    help=(
+        "Concurrent scans keep each symbol's last result. Symbols whose candles cannot have changed "
+        "(market closed since) or did not change are not fetched or analyzed again."
+    ),
+)
+
 run_watchlist_btn = st.sidebar.button(
     "Run Watchlist Scanner",
     type="secondary",
 )
 
 
+# ============================================================
+# PRE-MARKET WARM-UP
+# ============================================================
+st.sidebar.markdown("---")
+st.sidebar.subheader("Pre-market Warm-up")
+
+warmup_enabled = st.sidebar.checkbox(
+    "Warm caches before the open",
+    value=True,
+    help=(
+        f"Between {WARMUP_WINDOW[0]} and {WARMUP_WINDOW[1]} IST on trading days, preload the instrument master, "
+        "history and indicators for the watchlist and the selected instrument, "
+        "so the first run after the open only fetches new candles."
+    ),
+)
+
+if warmup_enabled:
+    warmup_token = access_token_sidebar
+    if not warmup_token:
+        try:
+            warmup_token = st.secrets["UPSTOX_ACCESS_TOKEN"]
+        except Exception:
+            warmup_token = ""
+
+    warmup_job = get_warmup_job()
+    if warmup_token:
+        warmup_symbols = [s.strip().upper() for s in watchlist_text.splitlines() if s.strip()]
+        if selected_row is not None and lookup_mode == "Equity":
+            warmup_symbols.append(str(selected_row.get("trading_symbol", "")).upper())
+        warmup_job.configure(
+            access_token=warmup_token,
+            symbols=list(dict.fromkeys(s for s in warmup_symbols if s)),
+            series=list(dict.fromkeys(WARMUP_SERIES + [(interval, period)])),
+            volume_ma_window=volume_ma_window,
+            store=candle_store,
+            exchange=lookup_exchange,
+            load_instruments=get_upstox_instruments,
+        )
+    else:
+        warmup_job.configure()
+        st.sidebar.caption("Needs an access token (sidebar or secrets) to run.")
+
+    if warmup_job.error is not None:
+        st.sidebar.warning(f"Last warm-up failed: {warmup_job.error}")
+    elif warmup_job.last_summary is not None:
+        summary = warmup_job.last_summary
+        st.sidebar.caption(
+            f"Warmed {summary['series_warmed']} series for {summary['symbols']} symbols at "
+            f"{summary['finished_at']:%H:%M} in {summary['seconds']:.1f}s"
+            + (f" | {len(summary['failed'])} failed" if summary["failed"] else "")
+        )
+else:
+    get_warmup_job().configure()
+
+
+# ============================================================
+# DIAGNOSTICS
+# ============================================================
+st.sidebar.markdown("---")
+st.sidebar.subheader("Diagnostics")
+stage_timings_enabled = st.sidebar.checkbox(
+    "Show stage timings",
+    value=False,
+    help=(
+        "Record wall time, rows and bytes per stage (fetch, parse, indicators, pivots, trendlines, "
+        "rendering) and per symbol for each run. Set TA_PROFILE_OUTPUT to also capture cProfile."
+    ),
+)
+stage_timings_panel = st.sidebar.container()
+http_metrics_enabled = st.sidebar.checkbox(
+    "Show HTTP metrics",
+    value=False,
+    help=(
+        "Upstox requests per endpoint with latency percentiles, response sizes, retries, 429s and "
+        "cache hit ratios. Set TA_METRICS_FILE / TA_METRICS_PORT to export them for Prometheus; "
+        "the port listens on localhost unless TA_METRICS_HOST is set."
+    ),
+)
+http_metrics_panel = st.sidebar.empty()
+if http_metrics_enabled:
+    show_http_metrics(http_metrics_panel, key="http_metrics_before_run")
+
+try:
+    get_metrics_export()
+except OSError as e:
+    st.sidebar.warning(f"Metrics export not started: {e}")
+
+# Every rerun replaces the script thread's telemetry, so nothing leaks into the next run.
+telemetry = activate_telemetry(
+    Telemetry(PROFILE_OUTPUT)
+    if (run_btn or run_watchlist_btn or streaming_active) and (stage_timings_enabled or PROFILE_OUTPUT)
+    else None,
+    label=None if run_watchlist_btn else (
+        selected_row.get("trading_symbol", instrument_search) if selected_row is not None else instrument_search
+    ),
+)
+
+
+def finish_run_diagnostics() -> None:
+    if http_metrics_enabled:
+        show_http_metrics(http_metrics_panel, key="http_metrics_after_run")
+    if telemetry is None:
+        return
+    telemetry.finish()
+    if stage_timings_enabled:
+        show_stage_timings(stage_timings_panel, telemetry)
+
+
 # ============================================================
         # WATCHLIST SCANNER RUN
         # ============================================================
@@ -1889,6 +863,68 @@ if run_watchlist_btn:
                 st.error(validation_error)
                 st.stop()
 
+            analysis_params = dict(
+                volume_ma_window=volume_ma_window,
+                left_bars=left_bars,
+                right_bars=right_bars,
+                zone_width_pct=zone_width_pct,
+                min_touches=min_touches,
+                trendline_tolerance_pct=trendline_tolerance_pct,
+                require_trendline_confirmation=require_trendline_confirmation,
+                use_retest_bonus=use_retest_bonus,
+                breakout_buffer_pct=breakout_buffer_pct,
+            )
+
+            if scan_scope == "Entire segment":
+                # Universe scans always go through the candle store so that
+                # rescans only fetch the sessions it has not stored yet.
+                instruments_df = get_upstox_instruments("NSE")
+                symbols = universe_symbols(instruments_df, scan_universe_name)
+                if not symbols:
+                    st.error(f"No {scan_universe_name} instruments found in the instrument master.")
+                    st.stop()
+                instrument_keys = resolve_instrument_keys(instruments_df, symbols, mode="Equity", exchange="NSE")
+
+                progress_bar = st.progress(0, text=f"Scanning {len(symbols)} {scan_universe_name} symbols")
+                partial_placeholder = st.empty()
+                scan_started = time.monotonic()
+                chunks = []
+                last_render = 0.0
+
+                for done_count, rows in scan_universe(
+                    access_token=access_token,
+                    instrument_keys=instrument_keys,
+                    period=period,
+                    interval=interval,
+                    analysis_params=analysis_params,
+                    store=candle_store or get_candle_store(),
+                    include_live=include_live,
+                    fetch_workers=scan_fetch_workers,
+                ):
+                    chunks.append(rows)
+                    progress_bar.progress(
+                        done_count / max(len(symbols), 1),
+                        text=f"{done_count}/{len(symbols)} symbols scanned",
+                    )
+                    if time.monotonic() - last_render >= 2.0:
+                        show_scanner_table(partial_placeholder, panel_scanner_rows(pd.concat(chunks)))
+                        last_render = time.monotonic()
+
+                partial_placeholder.empty()
+                scanner_df = panel_scanner_rows(pd.concat(chunks).reindex(symbols))
+
+                st.markdown(f"## {scan_universe_name} Scanner")
+                st.caption(f"{len(symbols)} symbols scanned in {time.monotonic() - scan_started:.1f}s")
+                show_scanner_table(st, scanner_df)
+                st.download_button(
+                    "Download CSV",
+                    scanner_df.to_csv(index=False),
+                    file_name=f"{scan_universe_name.replace(' ', '_').replace('&', '')}_scanner.csv",
+                    mime="text/csv",
+                )
+                finish_run_diagnostics()
+                st.stop()
+
             symbols = [
                 s.strip().upper()
                 for s in watchlist_text.splitlines()
@@ -1899,134 +935,219 @@ if run_watchlist_btn:
                 st.error("Please enter stock symbols.")
                 st.stop()
 
-            instruments_df = load_upstox_instruments(
+            instruments_df = get_upstox_instruments(
                 lookup_exchange
             )
 
             results = []
+            reused_count = None
 
             progress_bar = st.progress(0)
 
-            for idx, symbol in enumerate(symbols):
+            if concurrent_scan:
+                partial_placeholder = st.empty()
+                ordered_results = [None] * len(symbols)
+                last_render = 0.0
+                rescan_cache = get_rescan_cache() if incremental_rescan else None
+                reused_before = rescan_cache.stats()["reused"] if rescan_cache is not None else 0
 
-                result = analyze_single_symbol(
-                    access_token=access_token,
-                    symbol=symbol,
-                    instruments_df=instruments_df,
-                    period=period,
-                    interval=interval,
-                    lookup_exchange=lookup_exchange,
-                    volume_ma_window=volume_ma_window,
-                    left_bars=left_bars,
-                    right_bars=right_bars,
-                    zone_width_pct=zone_width_pct,
-                    min_touches=min_touches,
-                    trendline_tolerance_pct=trendline_tolerance_pct,
-                    include_live=include_live,
-                    require_trendline_confirmation=require_trendline_confirmation,
-                    use_retest_bonus=use_retest_bonus,
-                    breakout_buffer_pct=breakout_buffer_pct,
-                )
+                for done_count, (position, result) in enumerate(
+                    scan_watchlist_concurrently(
+                        access_token=access_token,
+                        symbols=symbols,
+                        instruments_df=instruments_df,
+                        period=period,
+                        interval=interval,
+                        lookup_exchange=lookup_exchange,
+                        analysis_params=analysis_params,
+                        include_live=include_live,
+                        candle_store=candle_store,
+                        fetch_workers=scan_fetch_workers,
+                        rescan_cache=rescan_cache,
+                    ),
+                    start=1,
+                ):
+                    ordered_results[position] = result
+                    progress_bar.progress(
+                        done_count / len(symbols),
+                        text=f"{done_count}/{len(symbols)} symbols scanned",
+                    )
 
-                results.append(result)
+                    if time.monotonic() - last_render >= 0.5 or done_count == len(symbols):
+                        show_scanner_table(
+                            partial_placeholder,
+                            pd.DataFrame([r for r in ordered_results if r is not None]),
+                        )
+                        last_render = time.monotonic()
 
-                progress_bar.progress(
-                    (idx + 1) / len(symbols)
-                )
+                partial_placeholder.empty()
+                results = [r for r in ordered_results if r is not None]
+                if rescan_cache is not None:
+                    reused_count = rescan_cache.stats()["reused"] - reused_before
+
+            else:
+                for idx, symbol in enumerate(symbols):
+
+                    with telemetry_label(symbol):
+                        result = analyze_single_symbol(
+                            access_token=access_token,
+                            symbol=symbol,
+                            instruments_df=instruments_df,
+                            period=period,
+                            interval=interval,
+                            lookup_exchange=lookup_exchange,
+                            volume_ma_window=volume_ma_window,
+                            left_bars=left_bars,
+                            right_bars=right_bars,
+                            zone_width_pct=zone_width_pct,
+                            min_touches=min_touches,
+                            trendline_tolerance_pct=trendline_tolerance_pct,
+                            include_live=include_live,
+                            require_trendline_confirmation=require_trendline_confirmation,
+                            use_retest_bonus=use_retest_bonus,
+                            breakout_buffer_pct=breakout_buffer_pct,
+                            candle_store=candle_store,
+                        )
+
+                    results.append(result)
+
+                    progress_bar.progress(
+                        (idx + 1) / len(symbols)
+                    )
 
             scanner_df = pd.DataFrame(results)
 
             st.markdown("## Watchlist Scanner")
+            if reused_count:
+                st.caption(f"{reused_count} of {len(symbols)} symbols unchanged since the last scan, results reused")
 
-            def color_signal(val):
-
-                if val in ["Strong Buy", "BUY", "Buy"]:
-                    return "color: #00C853; font-weight: bold;"
-
-                elif val in ["Strong Sell", "SELL", "Sell"]:
-                    return "color: #FF1744; font-weight: bold;"
-
-                elif val == "HOLD":
-                    return "color: #FFD600; font-weight: bold;"
-
-                return ""
-            
-            # Remove decimals from numeric columns
-            # ============================================================
-            # SMART DISPLAY FORMATTING
-            # ============================================================
-            numeric_cols = [
-                "Current Price",
-                "Nearest Support",
-                "Nearest Resistance",
-                "Confidence",
-                "Buy Score",
-                "Sell Score",
-                "Buy Price",
-                "Safe Buy Above",
-                "Stop Loss",
-                "Target 1",
-            ]
-
-            def smart_format(x):
+            show_scanner_table(st, scanner_df)
 
-                if pd.isna(x):
-                    return ""
+            csv = scanner_df.to_csv(index=False)
 
-                x = float(x)
+            st.download_button(
+                "Download CSV",
+                csv,
+                file_name="watchlist_scanner.csv",
+                mime="text/csv",
+            )
 
-                # Less than 1 → keep max 2 decimals
-                if abs(x) < 1:
-                    return f"{x:.2f}".rstrip("0").rstrip(".")
+            finish_run_diagnostics()
+            st.stop()
 
-                # Greater than or equal to 1 → no decimals
-                return int(round(x))
 
+# ============================================================
+# PARAMETER SWEEP RUN
+# ============================================================
+if run_sweep_btn:
+    try:
+        access_token = access_token_sidebar
 
-            for col in numeric_cols:
+        if not access_token:
+            try:
+                access_token = st.secrets["UPSTOX_ACCESS_TOKEN"]
+            except Exception:
+                access_token = ""
 
-                if col in scanner_df.columns:
+        if not access_token:
+            st.error("Please provide Upstox access token.")
+            st.stop()
 
-                    scanner_df[col] = pd.to_numeric(
-                        scanner_df[col],
-                        errors="coerce"
-                    )
+        if not instrument_key:
+            st.error("Please select a valid instrument from the lookup.")
+            st.stop()
 
-                    scanner_df[col] = scanner_df[col].apply(
-                        smart_format
-                    )
+        if not all(sweep_grid.values()):
+            st.error("Pick at least one value for every parameter in the sweep grid.")
+            st.stop()
 
+        validation_error = validate_period_interval(period, interval)
+        if validation_error:
+            st.error(validation_error)
+            st.stop()
 
-            styled_df = scanner_df.style.map(
-                color_signal,
-                subset=[
-                    "Signal",
-                    "Recommended Action",
-                ]
+        # Completed candles only: a forming candle would change the history
+        # fingerprint on every run and defeat the sweep cache.
+        with st.spinner("Loading stored history..."):
+            raw = load_upstox_data(
+                access_token=access_token,
+                instrument_key=instrument_key,
+                period=period,
+                interval=interval,
+                include_live=False,
+                store=candle_store,
             )
+        if raw.empty:
+            st.error("No candle data returned for the selected instrument.")
+            st.stop()
 
-            st.dataframe(
-                styled_df,
-                use_container_width=True,
-                hide_index=True,
-            )
+        sweep_settings = SweepSettings(
+            volume_ma_window=volume_ma_window,
+            require_trendline_confirmation=require_trendline_confirmation,
+            use_retest_bonus=use_retest_bonus,
+            max_hold_bars=sweep_max_hold_bars,
+        )
+        progress_bar = st.progress(0)
+        sweep_df = run_parameter_sweep(
+            df=compute_indicator_frame(raw, volume_ma_window),
+            grid=sweep_grid,
+            settings=sweep_settings,
+            method=sweep_method,
+            samples=sweep_samples,
+            metric=sweep_metric,
+            workers=sweep_workers,
+            history_key=frame_fingerprint(raw, instrument_key, interval),
+            progress=lambda done, total: progress_bar.progress(
+                done / total,
+                text=f"{done}/{total} parameter sets scored",
+            ),
+        )
+        progress_bar.empty()
 
-            csv = scanner_df.to_csv(index=False)
+        st.markdown("## Parameter Sweep")
+        st.caption(
+            f"{len(sweep_df)} parameter sets on {len(raw):,} {interval} candles | "
+            f"{int(sweep_df['cached'].sum())} read from earlier sweeps | "
+            f"Every candle after the first {sweep_settings.warmup_bars} scored without lookahead, "
+            f"trades held {sweep_max_hold_bars} candles at most"
+        )
 
-            st.download_button(
-                "Download CSV",
-                csv,
-                file_name="watchlist_scanner.csv",
-                mime="text/csv",
+        if not sweep_df.empty and pd.notna(sweep_df[sweep_metric].iloc[0]):
+            best = sweep_df.iloc[0]
+            st.success(
+                f"Best {SWEEP_METRICS[sweep_metric]}: {best[sweep_metric]:.2f} with "
+                + ", ".join(f"{name} = {best[name]}" for name in sweep_grid)
             )
 
-            st.stop()
+        sweep_display = sweep_df.drop(columns=["cached"]).rename(
+            columns={name: label for name, label in SWEEP_METRICS.items()}
+        )
+        st.dataframe(sweep_display.round(3), use_container_width=True, hide_index=True)
+
+        st.download_button(
+            "Download CSV",
+            sweep_df.to_csv(index=False),
+            file_name="parameter_sweep.csv",
+            mime="text/csv",
+        )
+
+    except requests.HTTPError as e:
+        try:
+            api_error = e.response.json()
+        except Exception:
+            api_error = e.response.text if e.response is not None else str(e)
+        st.error("Upstox API error")
+        st.code(str(api_error))
+    except Exception as e:
+        st.exception(e)
+
+    st.stop()
 
 
 # ============================================================
 # MAIN APP
 # ============================================================
-if run_btn:
+if run_btn or streaming_active:
     try:
         access_token = access_token_sidebar
 
@@ -2044,26 +1165,87 @@ if run_btn:
             st.error("Please select a valid instrument from the lookup.")
             st.stop()
 
-        validation_error = validate_period_interval(period, interval)
+        # Multi-timeframe runs fetch the finest interval once; streaming stays on the chart interval.
+        multi_timeframe_enabled = multi_timeframe and bool(mtf_timeframes) and not streaming_active
+        fetch_interval = finest_interval(mtf_timeframes + [interval]) if multi_timeframe_enabled else interval
+
+        validation_error = validate_period_interval(period, fetch_interval)
         if validation_error:
             st.error(validation_error)
             st.stop()
 
+        # Option chain requests are skipped while streaming, since every refresh reruns the page.
+        option_chain_enabled = show_option_chain and not streaming_active
+
         available_expiries = []
-        if show_option_chain:
+        if option_chain_enabled:
             try:
                 available_expiries = get_available_option_expiries(access_token, instrument_key)
             except Exception:
                 available_expiries = []
 
-        with st.spinner("Downloading Upstox market data and analyzing chart..."):
-            raw = load_upstox_data(
-                access_token=access_token,
+        if streaming_active:
+            st_autorefresh(interval=stream_refresh_ms, key="streaming_autorefresh")
+
+            history_key = (instrument_key, period, interval)
+            if st.session_state.get("stream_history_key") != history_key:
+                with st.spinner("Downloading Upstox history for streaming..."):
+                    st.session_state["stream_history"] = load_upstox_data(
+                        access_token=access_token,
+                        instrument_key=instrument_key,
+                        period=period,
+                        interval=interval,
+                        include_live=include_live,
+                        store=candle_store,
+                    )
+                st.session_state["stream_history_key"] = history_key
+
+            feed = get_stream_feed(stream_source, access_token, instrument_key, replay_address)
+            if feed.error is not None:
+                st.warning(f"Tick feed error: {feed.error}")
+
+            raw = merge_stream_candles(
+                st.session_state["stream_history"],
+                feed.aggregator.frame(instrument_key, interval),
+            )
+
+            last_tick_at = feed.aggregator.last_tick_at.get(instrument_key)
+            st.caption(
+                f"Streaming from {stream_source} | Ticks received: {feed.aggregator.version:,} | "
+                + (f"Last tick {time.time() - last_tick_at:.1f}s ago" if last_tick_at else "Waiting for first tick")
+                + (f" | Malformed lines skipped: {feed.bad_lines:,}" if getattr(feed, "bad_lines", 0) else "")
+            )
+        else:
+            with st.spinner("Downloading Upstox market data and analyzing chart..."):
+                raw = load_upstox_data(
+                    access_token=access_token,
+                    instrument_key=instrument_key,
+                    period=period,
+                    interval=fetch_interval,
+                    include_live=include_live,
+                    store=candle_store,
+                )
+
+        confluence_df = None
+        if multi_timeframe_enabled and not raw.empty:
+            timeframe_frames, confluence_df = analyze_timeframes(
                 instrument_key=instrument_key,
-                period=period,
-                interval=interval,
-                include_live=include_live,
+                base=raw,
+                base_interval=fetch_interval,
+                timeframes=mtf_timeframes,
+                analysis_params=dict(
+                    volume_ma_window=volume_ma_window,
+                    left_bars=left_bars,
+                    right_bars=right_bars,
+                    zone_width_pct=zone_width_pct,
+                    min_touches=min_touches,
+                    trendline_tolerance_pct=trendline_tolerance_pct,
+                    require_trendline_confirmation=require_trendline_confirmation,
+                    use_retest_bonus=use_retest_bonus,
+                    breakout_buffer_pct=breakout_buffer_pct,
+                ),
             )
+            raw = timeframe_frames[interval] if interval in timeframe_frames else resample_candles(raw, interval)
 
         if raw.empty:
             st.error("No data returned from Upstox for this instrument/period/interval combination.")
@@ -2072,52 +1254,41 @@ if run_btn:
         display_title = selected_row.get("trading_symbol", instrument_search) if selected_row is not None else instrument_search
         st.caption(f"Selected: {display_title} | Instrument Key: {instrument_key} | Interval: {interval} | Period: {period}")
 
-        df = compute_volume_metrics(raw, volume_ma_window)
+        indicator_source = None
+        if streaming_active:
+            # Only the forming candle changes between refreshes, so keep indicator state across reruns.
+            indicator_source = partial(get_indicator_engine(instrument_key, interval, volume_ma_window).update, raw)
 
-        pivot_highs, pivot_lows = find_pivots(df, left_bars=left_bars, right_bars=right_bars)
-
-        current_price = float(df["Close"].iloc[-1])
-
-        support_zones = cluster_levels(
-            pivots=pivot_lows,
-            current_price=current_price,
-            zone_width_pct=zone_width_pct,
-            zone_type="Support",
-            min_touches=min_touches,
-        )
-        resistance_zones = cluster_levels(
-            pivots=pivot_highs,
-            current_price=current_price,
+        analysis = run_analysis_pipeline(
+            raw=raw,
+            series_id=(instrument_key, interval),
+            volume_ma_window=volume_ma_window,
+            left_bars=left_bars,
+            right_bars=right_bars,
             zone_width_pct=zone_width_pct,
-            zone_type="Resistance",
             min_touches=min_touches,
-        )
-
-        all_zones = support_zones + resistance_zones
-        nearest_support, nearest_resistance = nearest_zones(all_zones, current_price)
-
-        trendlines = detect_trendlines(
-            df=df,
-            pivot_highs=pivot_highs,
-            pivot_lows=pivot_lows,
-            tolerance_pct=trendline_tolerance_pct,
-        )
-
-        market_structure = detect_market_structure(pivot_highs=pivot_highs, pivot_lows=pivot_lows)
-        vol_summary = summarize_volume(df)
-
-        trade_confirmation = evaluate_trade_confirmation(
-            df=df,
-            trendlines=trendlines,
-            market_structure=market_structure,
-            nearest_support=nearest_support,
-            nearest_resistance=nearest_resistance,
+            trendline_tolerance_pct=trendline_tolerance_pct,
             require_trendline_confirmation=require_trendline_confirmation,
             use_retest_bonus=use_retest_bonus,
             breakout_buffer_pct=breakout_buffer_pct,
+            max_trendlines=trendlines_per_side,
+            include_channels=show_channels,
+            indicator_source=indicator_source,
+            run_backtest=show_backtest,
+            backtest_max_hold_bars=backtest_max_hold_bars,
         )
 
-        trade_levels = get_trade_levels(trade_confirmation, df)
+        df = analysis["df"]
+        pivot_highs, pivot_lows = analysis["pivot_highs"], analysis["pivot_lows"]
+        current_price = analysis["current_price"]
+        support_zones, resistance_zones = analysis["support_zones"], analysis["resistance_zones"]
+        all_zones = analysis["all_zones"]
+        nearest_support, nearest_resistance = analysis["nearest_support"], analysis["nearest_resistance"]
+        trendlines = analysis["trendlines"]
+        market_structure = analysis["market_structure"]
+        vol_summary = analysis["vol_summary"]
+        trade_confirmation = analysis["trade_confirmation"]
+        trade_levels = analysis["trade_levels"]
 
         c1, c2, c3, c4, c5 = st.columns(5)
         last_vol_ratio = vol_summary["latest_vol_ratio"]
@@ -2167,7 +1338,47 @@ if run_btn:
                 t5.metric("Target 1", f"{trade_levels['target_1']:,.2f}")
                 st.caption(f"Extended Target 2: {trade_levels['target_2']:,.2f}")
 
+        backtest = analysis["backtest"]
+        if backtest is not None:
+            st.markdown("### Signal Backtest")
+            summary = backtest.summary
+            b1, b2, b3, b4, b5 = st.columns(5)
+            b1.metric("Trades", summary["trades"])
+            b2.metric("Hit Rate (Target 1)", f"{summary['hit_rate']:.1f}%" if pd.notna(summary["hit_rate"]) else "N/A")
+            b3.metric("Win Rate", f"{summary['win_rate']:.1f}%" if pd.notna(summary["win_rate"]) else "N/A")
+            b4.metric(
+                "Expectancy",
+                f"{summary['expectancy_pct']:.2f}%" if pd.notna(summary["expectancy_pct"]) else "N/A",
+                delta=f"{summary['expectancy_r']:.2f}R" if pd.notna(summary["expectancy_r"]) else None,
+            )
+            b5.metric("Max Drawdown", f"{summary['max_drawdown_pct']:.1f}%")
+            st.caption(
+                f"{summary['signal_bars']:,} signal candles out of {len(df):,} | "
+                f"Total return {summary['total_return_pct']:.1f}% compounding one trade at a time | "
+                f"Half booked at Target 1, half at Target 2, stop on the rest, "
+                f"time exit after {backtest_max_hold_bars} candles"
+            )
 
+            if not backtest.trades.empty:
+                with st.expander("Backtest Trades"):
+                    trades_display = backtest.trades.copy()
+                    for col in ["Entry Time", "Exit Time"]:
+                        trades_display[col] = trades_display[col].apply(lambda x: format_display_timestamp(x, interval))
+                    st.dataframe(trades_display.round(2), use_container_width=True, hide_index=True)
+
+        if confluence_df is not None:
+            st.markdown("### Multi-Timeframe Confluence")
+            buy_count = int(confluence_df["Signal"].isin(["Buy", "Strong Buy"]).sum())
+            sell_count = int(confluence_df["Signal"].isin(["Sell", "Strong Sell"]).sum())
+            bullish_count = int((confluence_df["Structure"] == "Bullish").sum())
+            bearish_count = int((confluence_df["Structure"] == "Bearish").sum())
+            st.dataframe(confluence_df, use_container_width=True, hide_index=True)
+            st.caption(
+                f"Buy signals on {buy_count}/{len(confluence_df)} timeframes | "
+                f"Sell signals on {sell_count}/{len(confluence_df)} | "
+                f"Bullish structure on {bullish_count}, bearish on {bearish_count} | "
+                f"Fetched once at {fetch_interval} and resampled locally"
+            )
 
         fig = build_chart(
             df=df,
@@ -2178,7 +1389,8 @@ if run_btn:
             trendlines=trendlines,
             show_pivots=show_pivots,
         )
-        st.plotly_chart(fig, use_container_width=True)
+        with stage_timer("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
 
         left_col, right_col = st.columns([1.1, 0.9])
 
@@ -2320,7 +1532,7 @@ if run_btn:
         # ============================================================
         # OPTION CHAIN / OI / PCR
         # ============================================================
-        if show_option_chain:
+        if option_chain_enabled:
             st.markdown("---")
             st.subheader("Option OI / Put-Call Ratio")
 
@@ -2434,6 +1646,8 @@ if run_btn:
 
         st.dataframe(raw_display, use_container_width=True, hide_index=True)
 
+        finish_run_diagnostics()
+
     except requests.HTTPError as e:
         try:
             api_error = e.response.json()
@@ -0,0 +1,5800 @@
+"""
+Streamlit-free data and analysis engine for technical_analysis.py.
+
+Everything in here can be imported by a worker process, a scheduled job or a
+benchmark without building any page; technical_analysis_scanner.py runs the
+watchlist and universe scans headless on top of it.
+"""
+import bisect
+import cProfile
+import gzip
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import asdict, dataclass, fields, is_dataclass
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypeVar
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional, only used to decode large candle payloads faster
+    orjson = None
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+INDIA_TZ = "Asia/Kolkata"
+INDIAN_DATE_FMT = "%d-%m-%Y"
+INDIAN_DATETIME_FMT = "%d-%m-%Y %H:%M:%S"
+INTRADAY_INTERVALS = {"1h", "30m", "15m", "5m"}
+EMPTY_PIVOT_COLUMNS = ["Date", "Price", "Type"]
+
+UPSTOX_BASE_URL = "https://api.upstox.com"
+UPSTOX_HIST_V3 = f"{UPSTOX_BASE_URL}/v3/historical-candle"
+UPSTOX_INTRADAY_V3 = f"{UPSTOX_BASE_URL}/v3/historical-candle/intraday"
+UPSTOX_OHLC_V3 = f"{UPSTOX_BASE_URL}/v3/market-quote/ohlc"
+
+# Option APIs
+UPSTOX_OPTION_CONTRACTS_V2 = f"{UPSTOX_BASE_URL}/v2/option/contract"
+UPSTOX_OPTION_CHAIN_V2 = f"{UPSTOX_BASE_URL}/v2/option/chain"
+
+# Instruments lookup files
+UPSTOX_INSTRUMENTS_NSE_URL = "https://assets.upstox.com/market-quote/instruments/exchange/NSE.json.gz"
+UPSTOX_INSTRUMENTS_BSE_URL = "https://assets.upstox.com/market-quote/instruments/exchange/BSE.json.gz"
+
+# HTTP client: Upstox standard API limits are 50/s, 500/min and 2000/30min
+UPSTOX_RATE_LIMITS = [(50, 1.0), (500, 60.0), (2000, 1800.0)]
+UPSTOX_HTTP_POOL_SIZE = 32
+UPSTOX_HTTP_MAX_RETRIES = 4
+UPSTOX_HTTP_BACKOFF_SECONDS = 0.5
+UPSTOX_HTTP_MAX_RETRY_AFTER_SECONDS = 30.0
+UPSTOX_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest range a single v3 historical-candle request may span, per interval
+UPSTOX_HISTORY_MAX_SPAN = {
+    "5m": pd.DateOffset(months=1),
+    "15m": pd.DateOffset(months=1),
+    "30m": pd.DateOffset(months=3),
+    "1h": pd.DateOffset(months=3),
+    "1d": pd.DateOffset(years=10),
+}
+HISTORY_FETCH_WORKERS = 4
+
+# HTTP client metrics: histogram buckets, the window the rolling percentiles
+# cover, and the optional Prometheus exports (a text file rewritten every
+# METRICS_FILE_SECONDS and/or an HTTP endpoint serving /metrics, local-only
+# unless TA_METRICS_HOST names another interface)
+HTTP_LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HTTP_SIZE_BUCKETS = (1_024, 8_192, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216)
+HTTP_METRICS_WINDOW_SECONDS = 300
+METRICS_FILE = os.environ.get("TA_METRICS_FILE", "")
+METRICS_FILE_SECONDS = 15
+METRICS_PORT = int(os.environ.get("TA_METRICS_PORT", "0") or 0)
+METRICS_HOST = os.environ.get("TA_METRICS_HOST", "127.0.0.1")
+
+# Market quote endpoints accept up to 500 comma-separated instrument keys
+UPSTOX_OHLC_MAX_KEYS = 500
+
+# Instrument master disk cache
+INSTRUMENTS_CACHE_DIR = os.environ.get(
+    "TA_INSTRUMENTS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "technical_analysis", "instruments"),
+)
+INSTRUMENTS_REFRESH_SECONDS = 60 * 60 * 6
+INSTRUMENT_CATEGORY_COLUMNS = ["segment", "exchange", "instrument_type"]
+
+# Streaming feed: candle widths in minutes, aligned to the 09:15 IST session open
+STREAM_INTERVAL_MINUTES = {"1m": 1, "5m": 5, "15m": 15, "30m": 30, "1h": 60}
+IST_OFFSET_NS = (5 * 60 + 30) * 60 * 1_000_000_000
+SESSION_OPEN_NS = (9 * 60 + 15) * 60 * 1_000_000_000
+DAY_NS = 24 * 60 * 60 * 1_000_000_000
+# A feed no page session has asked for in this long is stopped
+STREAM_FEED_IDLE_SECONDS = 300
+# Replay feed reconnects: first retry delay, doubled up to the maximum
+STREAM_RECONNECT_SECONDS = 1.0
+STREAM_RECONNECT_MAX_SECONDS = 30.0
+
+# Local candle store
+CANDLE_STORE_DIR = os.environ.get(
+    "TA_CANDLE_STORE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "technical_analysis", "candles"),
+)
+CANDLE_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Open Interest"]
+
+# Multi-timeframe analysis, finest first; coarser frames are resampled locally
+MULTI_TIMEFRAME_INTERVALS = ["5m", "15m", "30m", "1h", "1d"]
+
+# Trendline search: lines through any two of the most recent pivots are scored
+TRENDLINE_MAX_ANCHORS = 150
+
+# Universe scan: every NSE equity, or the equities with NSE futures (F&O list).
+# Fetches share the client's rate limiter; scoring runs on chunks of symbols.
+SCAN_UNIVERSES = ["NSE_EQ", "NSE F&O"]
+UNIVERSE_FETCH_WORKERS = 16
+UNIVERSE_SCORE_CHUNK = 250
+
+# Pre-market warm-up: caches are filled once per trading day inside this IST
+# window, for the watchlist at these (interval, period) series
+WARMUP_WINDOW = tuple(os.environ.get("TA_WARMUP_WINDOW", "08:30-09:15").split("-"))
+WARMUP_SERIES = [("1d", "1y"), ("5m", "1mo")]
+WARMUP_POLL_SECONDS = 60
+
+# Stage timing: when set, each timed run is also captured with cProfile and
+# the pstats file written here ({timestamp} is filled in per run)
+PROFILE_OUTPUT = os.environ.get("TA_PROFILE_OUTPUT", "")
+
+# Watchlist rescans: last row per symbol and settings, least recently used evicted first
+WATCHLIST_RESCAN_MAX_ENTRIES = 5_000
+
+# Incremental indicator engines per (instrument, interval, volume MA window),
+# least recently used evicted first
+INDICATOR_ENGINE_MAX_ENTRIES = 256
+
+# Analysis stage results kept in memory, least recently used evicted first
+PIPELINE_CACHE_MAX_BYTES = int(os.environ.get("TA_PIPELINE_CACHE_MB", "256")) * 1024 * 1024
+
+# Parameter sweep: candidate values per detection setting, scored on stored history
+SWEEP_PARAMETER_GRID = {
+    "left_bars": [2, 3, 5, 8],
+    "right_bars": [2, 3, 5, 8],
+    "zone_width_pct": [0.4, 0.8, 1.2, 1.6],
+    "min_touches": [1, 2, 3],
+    "trendline_tolerance_pct": [0.5, 1.0, 1.5, 2.0],
+    "breakout_buffer_pct": [0.05, 0.15, 0.3, 0.5],
+}
+SWEEP_METRICS = {
+    "expectancy_pct": "Signal P&L per trade %",
+    "total_return_pct": "Signal P&L total %",
+    "win_rate": "Signal win rate %",
+    "zone_hit_rate": "Zone hit rate %",
+}
+SWEEP_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+SWEEP_CACHE_DIR = os.environ.get(
+    "TA_SWEEP_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "technical_analysis", "sweeps"),
+)
+
+
+# ============================================================
+# TIME / DISPLAY HELPERS
+# ============================================================
+def to_india_time(ts):
+    if pd.isna(ts):
+        return pd.NaT
+
+    ts = pd.Timestamp(ts)
+    if ts.tzinfo is None:
+        return ts.tz_localize(INDIA_TZ)
+    return ts.tz_convert(INDIA_TZ)
+
+
+def format_indian_date(ts) -> str:
+    ts = to_india_time(ts)
+    if pd.isna(ts):
+        return ""
+    return ts.strftime(INDIAN_DATE_FMT)
+
+
+def format_indian_datetime(ts) -> str:
+    ts = to_india_time(ts)
+    if pd.isna(ts):
+        return ""
+    return ts.strftime(INDIAN_DATETIME_FMT)
+
+
+def format_display_timestamp(ts, interval: str) -> str:
+    return format_indian_datetime(ts) if interval in INTRADAY_INTERVALS else format_indian_date(ts)
+
+
+def now_ist() -> pd.Timestamp:
+    return pd.Timestamp.now(tz=INDIA_TZ)
+
+
+def is_market_hours_india() -> bool:
+    current = now_ist()
+    if current.weekday() >= 5:
+        return False
+
+    market_open = current.replace(hour=9, minute=15, second=0, microsecond=0)
+    market_close = current.replace(hour=15, minute=30, second=0, microsecond=0)
+    return market_open <= current <= market_close
+
+
+# ============================================================
+# STAGE TELEMETRY
+# ============================================================
+T = TypeVar("T")
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    label: Optional[str]
+    seconds: float = 0.0
+    rows: int = 0
+    nbytes: int = 0
+
+
+class Telemetry:
+    """
+    Wall time, rows and bytes of every stage call made while this is the
+    active telemetry of the thread (activate_telemetry) or of a pool task
+    submitted with submit_traced. Records carry the label (usually the
+    symbol) active when the stage ran. A stage's time includes any stage
+    nested inside it, and stages running concurrently on pool threads can
+    add up to more than the run's wall time.
+
+    With profile_path the run is also captured with cProfile, pool threads
+    included, and finish() writes the combined pstats file there.
+    """
+
+    def __init__(self, profile_path: Optional[str] = None):
+        self.profile_path = profile_path or None
+        self.records: list[StageRecord] = []
+        self.started_at = now_ist()
+        self.seconds: Optional[float] = None
+        self.profile_file: Optional[Path] = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._profile: Optional[cProfile.Profile] = None
+        self._worker_profiles: list[cProfile.Profile] = []
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def start_profile(self) -> None:
+        if self.profile_path and self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def profile_call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run fn on a pool thread under its own profiler, merged by finish()."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Python 3.12+: the run's profiler already sees every thread
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self._worker_profiles.append(profile)
+
+    def finish(self) -> Optional[Path]:
+        """Stop the clock (and profiler); returns the pstats path if one was written."""
+        if self.seconds is not None:
+            return None
+        self.seconds = time.perf_counter() - self._started
+        if self._profile is None:
+            return None
+
+        self._profile.disable()
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._worker_profiles:
+                stats.add(profile)
+        path = Path(self.profile_path.replace("{timestamp}", self.started_at.strftime("%Y%m%d_%H%M%S")))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(path)
+        self.profile_file = path
+        return path
+
+    def frame(self) -> pd.DataFrame:
+        with self._lock:
+            rows = [asdict(record) for record in self.records]
+        return pd.DataFrame(rows, columns=[f.name for f in fields(StageRecord)])
+
+    def stage_summary(self) -> pd.DataFrame:
+        """One row per stage, slowest total first."""
+        records = self.frame()
+        summary = records.groupby("stage").agg(
+            calls=("seconds", "size"),
+            seconds=("seconds", "sum"),
+            max_ms=("seconds", "max"),
+            rows=("rows", "sum"),
+            nbytes=("nbytes", "sum"),
+        )
+        summary["mean_ms"] = summary["seconds"] / summary["calls"] * 1000
+        summary["max_ms"] *= 1000
+        summary = summary[["calls", "seconds", "mean_ms", "max_ms", "rows", "nbytes"]]
+        return summary.sort_values("seconds", ascending=False).reset_index()
+
+    def label_summary(self) -> pd.DataFrame:
+        """Seconds per label and stage, plus totals, slowest label first."""
+        records = self.frame()
+        records["label"] = records["label"].fillna("")
+        by_stage = records.pivot_table(index="label", columns="stage", values="seconds", aggfunc="sum", fill_value=0.0)
+        totals = records.groupby("label")[["seconds", "rows", "nbytes"]].sum()
+        summary = totals.join(by_stage).sort_values("seconds", ascending=False)
+        summary.columns.name = None
+        return summary.reset_index()
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "started_at": self.started_at.isoformat(),
+                "seconds": self.seconds,
+                "profile": str(self.profile_file) if self.profile_file else None,
+                "stages": self.stage_summary().to_dict(orient="records"),
+                "labels": self.label_summary().to_dict(orient="records"),
+                "records": self.frame().to_dict(orient="records"),
+            },
+            indent=2,
+        )
+
+
+_ACTIVE_TELEMETRY: ContextVar[Optional[Telemetry]] = ContextVar("active_telemetry", default=None)
+_TELEMETRY_LABEL: ContextVar[Optional[str]] = ContextVar("telemetry_label", default=None)
+
+
+def activate_telemetry(telemetry: Optional[Telemetry], label: Optional[str] = None) -> Optional[Telemetry]:
+    """
+    Make telemetry (None switches recording off) the one the current thread
+    records into, under label. A previously active telemetry is finished.
+    """
+    previous = _ACTIVE_TELEMETRY.get()
+    if previous is not None and previous is not telemetry:
+        previous.finish()
+    _ACTIVE_TELEMETRY.set(telemetry)
+    _TELEMETRY_LABEL.set(label)
+    if telemetry is not None:
+        telemetry.start_profile()
+    return telemetry
+
+
+@contextmanager
+def telemetry_label(label: Optional[str]):
+    token = _TELEMETRY_LABEL.set(label)
+    try:
+        yield
+    finally:
+        _TELEMETRY_LABEL.reset(token)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Time the enclosed block as one call of stage. Yields the StageRecord so
+    the block can fill in rows / nbytes; nothing is kept when no telemetry
+    is active.
+    """
+    record = StageRecord(stage, _TELEMETRY_LABEL.get())
+    telemetry = _ACTIVE_TELEMETRY.get()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        if telemetry is not None:
+            record.seconds = time.perf_counter() - started
+            telemetry.add(record)
+
+
+def _stage_rows(result, args, kwargs) -> int:
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    for value in (*args, *kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return 0
+
+
+def timed_stage(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Record every call of func as a stage named after it. Rows are the
+    length of the returned frame, or else of the first frame argument.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE_TELEMETRY.get() is None:
+            return func(*args, **kwargs)
+        with stage_timer(func.__qualname__) as record:
+            result = func(*args, **kwargs)
+            record.rows = _stage_rows(result, args, kwargs)
+        return result
+
+    return wrapper
+
+
+def submit_traced(pool: Executor, label: Optional[str], fn: Callable[..., T], *args, **kwargs) -> Future:
+    """
+    pool.submit that runs fn with the caller's active telemetry, under label
+    if one is given (otherwise the caller's), and profiled when the
+    telemetry is profiling.
+    """
+    context = copy_context()
+    if label is not None:
+        context.run(_TELEMETRY_LABEL.set, label)
+    telemetry = context.get(_ACTIVE_TELEMETRY)
+    if telemetry is not None and telemetry.profile_path:
+        return pool.submit(context.run, telemetry.profile_call, fn, *args, **kwargs)
+    return pool.submit(context.run, fn, *args, **kwargs)
+
+
+# ============================================================
+# UPSTOX AUTH / API HELPERS
+# ============================================================
+def get_auth_headers(access_token: str) -> dict:
+    return {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {access_token}",
+    }
+
+
+def interval_to_upstox(interval: str) -> tuple[str, str]:
+    mapping = {
+        "5m": ("minutes", "5"),
+        "15m": ("minutes", "15"),
+        "30m": ("minutes", "30"),
+        "1h": ("hours", "1"),
+        "1d": ("days", "1"),
+    }
+    if interval not in mapping:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return mapping[interval]
+
+
+def ohlc_quote_interval(interval: str) -> Optional[str]:
+    mapping = {
+        "1d": "1d",
+        "30m": "I30",
+    }
+    return mapping.get(interval)
+
+
+def period_to_from_date(period: str, to_date: pd.Timestamp) -> pd.Timestamp:
+    if period == "5d":
+        return to_date - pd.Timedelta(days=7)
+    if period == "1mo":
+        return to_date - pd.DateOffset(months=1)
+    if period == "3mo":
+        return to_date - pd.DateOffset(months=3)
+    if period == "6mo":
+        return to_date - pd.DateOffset(months=6)
+    if period == "1y":
+        return to_date - pd.DateOffset(years=1)
+    if period == "2y":
+        return to_date - pd.DateOffset(years=2)
+    if period == "5y":
+        return to_date - pd.DateOffset(years=5)
+    raise ValueError(f"Unsupported period: {period}")
+
+
+def validate_period_interval(period: str, interval: str) -> Optional[str]:
+    if interval in {"5m", "15m"} and period not in {"5d", "1mo", "3mo", "6mo", "1y"}:
+        return "For 5m and 15m, keep lookback to 1y or less."
+    if interval in {"30m", "1h"} and period not in {"5d", "1mo", "3mo", "6mo", "1y", "2y"}:
+        return "For 30m and 1h, keep lookback to 2y or less."
+    return None
+
+
+def historical_request_windows(
+    interval: str,
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """Split from_date..to_date (inclusive) into ranges one historical request may cover."""
+    span = UPSTOX_HISTORY_MAX_SPAN[interval]
+    windows = []
+    start = from_date
+    while start <= to_date:
+        end = min(start + span - pd.Timedelta(days=1), to_date)
+        windows.append((start, end))
+        start = end + pd.Timedelta(days=1)
+    return windows
+
+
+# ============================================================
+# HTTP CLIENT METRICS
+# ============================================================
+class Histogram:
+    """
+    Prometheus-style histogram (bucket counts, sum, count since start) that
+    also keeps the samples of the last window_seconds for rolling
+    percentiles. Not thread-safe on its own; HttpMetrics holds the lock.
+    """
+
+    def __init__(self, buckets: tuple, window_seconds: float = HTTP_METRICS_WINDOW_SECONDS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.window_seconds = window_seconds
+        self._recent: deque[tuple[float, float]] = deque()
+
+    def observe(self, value: float, now: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self._recent.append((now, value))
+        self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+
+    def recent(self, now: float) -> np.ndarray:
+        self._expire(now)
+        return np.fromiter((value for _, value in self._recent), dtype=np.float64, count=len(self._recent))
+
+    def prometheus_lines(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.bucket_counts):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:g}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def _endpoint_name(url: str) -> str:
+    """Metrics label for a URL the caller did not name: its path, without query."""
+    return urlsplit(url).path or url
+
+
+class HttpMetrics:
+    """
+    In-memory metrics of the Upstox HTTP client and the caches in front of
+    it: per endpoint, responses by status code, latency and response size
+    histograms, retries, 429s, connection errors and time spent waiting on
+    the client-side rate limiter; per cache, hits and misses (the analysis
+    stage cache is read from its own counters).
+    """
+
+    def __init__(self, window_seconds: float = HTTP_METRICS_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._responses: Counter[tuple[str, int]] = Counter()
+        self._errors: Counter[tuple[str, str]] = Counter()
+        self._retries: Counter[tuple[str, str]] = Counter()
+        self._limiter_wait: Counter[str] = Counter()
+        self._cache: Counter[tuple[str, str]] = Counter()
+        self._latency: dict[str, Histogram] = {}
+        self._sizes: dict[str, Histogram] = {}
+
+    def observe_response(self, endpoint: str, status: int, seconds: float, nbytes: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._responses[endpoint, status] += 1
+            if endpoint not in self._latency:
+                self._latency[endpoint] = Histogram(HTTP_LATENCY_BUCKETS, self.window_seconds)
+                self._sizes[endpoint] = Histogram(HTTP_SIZE_BUCKETS, self.window_seconds)
+            self._latency[endpoint].observe(seconds, now)
+            self._sizes[endpoint].observe(nbytes, now)
+
+    def observe_error(self, endpoint: str, error: str) -> None:
+        with self._lock:
+            self._errors[endpoint, error] += 1
+
+    def observe_retry(self, endpoint: str, reason: str) -> None:
+        with self._lock:
+            self._retries[endpoint, reason] += 1
+
+    def observe_limiter_wait(self, endpoint: str, seconds: float) -> None:
+        if seconds > 0:
+            with self._lock:
+                self._limiter_wait[endpoint] += seconds
+
+    def observe_cache(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            self._cache[cache, "hit" if hit else "miss"] += 1
+
+    def _cache_counts(self) -> Counter:
+        counts = Counter(self._cache)
+        pipeline = get_pipeline_cache().stats()
+        counts["pipeline", "hit"] += pipeline["hits"]
+        counts["pipeline", "miss"] += pipeline["misses"]
+        return counts
+
+    def endpoint_summary(self) -> pd.DataFrame:
+        """One row per endpoint; percentiles and mean size cover the rolling window."""
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for endpoint in sorted({e for e, _ in self._responses} | {e for e, _ in self._errors}):
+                latency = self._latency[endpoint].recent(now) if endpoint in self._latency else np.array([])
+                sizes = self._sizes[endpoint].recent(now) if endpoint in self._sizes else np.array([])
+                p50, p90, p99 = np.quantile(latency, [0.5, 0.9, 0.99]) * 1000 if len(latency) else (np.nan,) * 3
+                failed = sum(n for (e, _), n in self._errors.items() if e == endpoint)
+                rows.append(
+                    {
+                        "endpoint": endpoint,
+                        "requests": sum(n for (e, _), n in self._responses.items() if e == endpoint) + failed,
+                        "errors": sum(n for (e, status), n in self._responses.items() if e == endpoint and status >= 400)
+                        + failed,
+                        "rate_limited": self._responses[endpoint, 429],
+                        "retries": sum(n for (e, _), n in self._retries.items() if e == endpoint),
+                        "p50_ms": p50,
+                        "p90_ms": p90,
+                        "p99_ms": p99,
+                        "mean_kb": sizes.mean() / 1024 if len(sizes) else np.nan,
+                        "limiter_wait_s": self._limiter_wait[endpoint],
+                    }
+                )
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "endpoint", "requests", "errors", "rate_limited", "retries",
+                "p50_ms", "p90_ms", "p99_ms", "mean_kb", "limiter_wait_s",
+            ],
+        )
+
+    def cache_summary(self) -> pd.DataFrame:
+        with self._lock:
+            counts = self._cache_counts()
+        caches = sorted({cache for cache, _ in counts})
+        summary = pd.DataFrame(
+            {
+                "cache": caches,
+                "hits": [counts[cache, "hit"] for cache in caches],
+                "misses": [counts[cache, "miss"] for cache in caches],
+            }
+        )
+        lookups = summary["hits"] + summary["misses"]
+        summary["hit_ratio"] = (summary["hits"] / lookups).where(lookups > 0)
+        return summary
+
+    def prometheus_text(self) -> str:
+        """Everything in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        now = time.monotonic()
+        with self._lock:
+            family("upstox_http_responses_total", "counter", "HTTP responses from Upstox by endpoint and status code.")
+            for (endpoint, status), count in sorted(self._responses.items()):
+                lines.append(f'upstox_http_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            family("upstox_http_rate_limited_total", "counter", "HTTP 429 responses from Upstox by endpoint.")
+            for endpoint in sorted(self._latency):
+                lines.append(f'upstox_http_rate_limited_total{{endpoint="{endpoint}"}} {self._responses[endpoint, 429]}')
+
+            family("upstox_http_errors_total", "counter", "Requests that got no response, by endpoint and error.")
+            for (endpoint, error), count in sorted(self._errors.items()):
+                lines.append(f'upstox_http_errors_total{{endpoint="{endpoint}",error="{error}"}} {count}')
+
+            family("upstox_http_retries_total", "counter", "Retried requests by endpoint and reason.")
+            for (endpoint, reason), count in sorted(self._retries.items()):
+                lines.append(f'upstox_http_retries_total{{endpoint="{endpoint}",reason="{reason}"}} {count}')
+
+            family("upstox_http_rate_limiter_wait_seconds_total", "counter", "Time spent waiting on the client-side rate limiter.")
+            for endpoint, seconds in sorted(self._limiter_wait.items()):
+                lines.append(f'upstox_http_rate_limiter_wait_seconds_total{{endpoint="{endpoint}"}} {seconds:g}')
+
+            family("upstox_http_request_duration_seconds", "histogram", "Upstox request latency, body download included.")
+            for endpoint, histogram in sorted(self._latency.items()):
+                lines.extend(histogram.prometheus_lines("upstox_http_request_duration_seconds", f'endpoint="{endpoint}"'))
+
+            family("upstox_http_response_size_bytes", "histogram", "Decoded Upstox response body size.")
+            for endpoint, histogram in sorted(self._sizes.items()):
+                lines.extend(histogram.prometheus_lines("upstox_http_response_size_bytes", f'endpoint="{endpoint}"'))
+
+            family(
+                "upstox_http_request_duration_recent_seconds",
+                "gauge",
+                f"Upstox request latency quantiles over the last {self.window_seconds:g}s.",
+            )
+            for endpoint, histogram in sorted(self._latency.items()):
+                recent = histogram.recent(now)
+                if len(recent):
+                    for quantile, value in zip((0.5, 0.9, 0.99), np.quantile(recent, [0.5, 0.9, 0.99])):
+                        lines.append(
+                            f'upstox_http_request_duration_recent_seconds{{endpoint="{endpoint}",quantile="{quantile}"}} {value:g}'
+                        )
+
+            family("technical_analysis_cache_lookups_total", "counter", "Cache lookups by cache and result.")
+            for (cache, result), count in sorted(self._cache_counts().items()):
+                lines.append(f'technical_analysis_cache_lookups_total{{cache="{cache}",result="{result}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+_HTTP_METRICS: HttpMetrics | None = None
+_HTTP_METRICS_LOCK = threading.Lock()
+
+
+def get_http_metrics() -> HttpMetrics:
+    global _HTTP_METRICS
+    if _HTTP_METRICS is None:
+        with _HTTP_METRICS_LOCK:
+            if _HTTP_METRICS is None:
+                _HTTP_METRICS = HttpMetrics()
+    return _HTTP_METRICS
+
+
+def write_metrics_file(path: str) -> Path:
+    """Write the Prometheus text to path through a temporary file (node_exporter textfile style)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(get_http_metrics().prometheus_text())
+    os.replace(tmp_path, path)
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = get_http_metrics().prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_export(
+    file_path: str = METRICS_FILE,
+    port: int = METRICS_PORT,
+    file_seconds: float = METRICS_FILE_SECONDS,
+    host: str = METRICS_HOST,
+) -> Optional[ThreadingHTTPServer]:
+    """
+    Start the configured Prometheus exports on daemon threads: an HTTP
+    endpoint serving /metrics on host:port, and file_path rewritten every
+    file_seconds. Returns the server if one was started.
+    """
+    if file_path:
+        def _write_loop():
+            while True:
+                try:
+                    write_metrics_file(file_path)
+                except OSError:
+                    pass
+                time.sleep(file_seconds)
+
+        threading.Thread(target=_write_loop, name="metrics-file", daemon=True).start()
+
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# ============================================================
+# UPSTOX HTTP CLIENT
+# ============================================================
+class TokenBucket:
+    """Thread-safe token bucket; reserve() returns how long the caller must wait."""
+
+    def __init__(self, capacity: float, per_seconds: float):
+        self.capacity = float(capacity)
+        self.rate = float(capacity) / float(per_seconds)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1.0
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits: list[tuple[float, float]] = UPSTOX_RATE_LIMITS):
+        self.buckets = [TokenBucket(capacity, per_seconds) for capacity, per_seconds in limits]
+
+    def acquire(self) -> float:
+        wait = max((bucket.reserve() for bucket in self.buckets), default=0.0)
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+
+class UpstoxClient:
+    """
+    Shared HTTP client for every Upstox endpoint.
+
+    One keep-alive session with a connection pool sized for concurrent
+    scanning, gzip negotiation, client-side rate limiting against the Upstox
+    per-second/minute/30-minute limits and jittered exponential retries on
+    429/5xx and connection errors. get() returns the final response; callers
+    still call raise_for_status() as before. Every attempt is recorded in
+    metrics under the endpoint name the caller passes (the URL path if none).
+    """
+
+    def __init__(
+        self,
+        rate_limits: list[tuple[float, float]] = UPSTOX_RATE_LIMITS,
+        pool_size: int = UPSTOX_HTTP_POOL_SIZE,
+        max_retries: int = UPSTOX_HTTP_MAX_RETRIES,
+        backoff_seconds: float = UPSTOX_HTTP_BACKOFF_SECONDS,
+        max_retry_after: float = UPSTOX_HTTP_MAX_RETRY_AFTER_SECONDS,
+        metrics: HttpMetrics | None = None,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self.limiter = RateLimiter(rate_limits)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_retry_after = max_retry_after
+        self.metrics = metrics or get_http_metrics()
+
+    def _retry_delay(self, attempt: int, response: requests.Response | None) -> float:
+        # A server-sent Retry-After is honoured up to max_retry_after, so one
+        # bad header cannot park a scan worker for minutes.
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(max(float(retry_after), 0.0), self.max_retry_after)
+                except ValueError:
+                    pass
+        return random.uniform(0, self.backoff_seconds * (2 ** attempt))
+
+    def get(
+        self,
+        url: str,
+        access_token: str | None = None,
+        params: dict | None = None,
+        timeout: float = 30,
+        rate_limited: bool = True,
+        headers: dict | None = None,
+        endpoint: str | None = None,
+    ) -> requests.Response:
+        headers = {**(get_auth_headers(access_token) if access_token else {}), **(headers or {})} or None
+        endpoint = endpoint or _endpoint_name(url)
+
+        for attempt in range(self.max_retries + 1):
+            if rate_limited:
+                self.metrics.observe_limiter_wait(endpoint, self.limiter.acquire())
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.observe_error(endpoint, type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                self.metrics.observe_retry(endpoint, type(e).__name__)
+                time.sleep(self._retry_delay(attempt, None))
+                continue
+            self.metrics.observe_response(endpoint, response.status_code, time.perf_counter() - started, len(response.content))
+
+            if response.status_code not in UPSTOX_RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            self.metrics.observe_retry(endpoint, str(response.status_code))
+            delay = self._retry_delay(attempt, response)
+            response.close()
+            time.sleep(delay)
+
+        return response
+
+
+_UPSTOX_CLIENT: UpstoxClient | None = None
+_UPSTOX_CLIENT_LOCK = threading.Lock()
+
+
+def get_upstox_client() -> UpstoxClient:
+    global _UPSTOX_CLIENT
+    if _UPSTOX_CLIENT is None:
+        with _UPSTOX_CLIENT_LOCK:
+            if _UPSTOX_CLIENT is None:
+                _UPSTOX_CLIENT = UpstoxClient()
+    return _UPSTOX_CLIENT
+
+
+def decode_json_response(response: requests.Response):
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+# ============================================================
+# UPSTOX INSTRUMENT MASTER
+# ============================================================
+def _instruments_url(exchange: str) -> str:
+    if exchange == "NSE":
+        return UPSTOX_INSTRUMENTS_NSE_URL
+    if exchange == "BSE":
+        return UPSTOX_INSTRUMENTS_BSE_URL
+    raise ValueError("Only NSE and BSE are supported in this lookup.")
+
+
+def build_instruments_frame(payload: list) -> pd.DataFrame:
+    df = pd.DataFrame(payload)
+
+    useful_cols = [
+        "segment",
+        "name",
+        "exchange",
+        "instrument_type",
+        "instrument_key",
+        "trading_symbol",
+        "short_name",
+        "isin",
+        "underlying_symbol",
+        "strike_price",
+        "expiry",
+    ]
+    keep_cols = [c for c in useful_cols if c in df.columns]
+    df = df[keep_cols].copy()
+
+    for col in [
+        "segment",
+        "exchange",
+        "instrument_type",
+        "instrument_key",
+        "trading_symbol",
+        "short_name",
+        "name",
+        "underlying_symbol",
+    ]:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+
+    for col in INSTRUMENT_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    if "expiry" in df.columns:
+        df["expiry_dt"] = pd.to_datetime(df["expiry"], unit="ms", errors="coerce")
+    else:
+        df["expiry_dt"] = pd.NaT
+
+    return df.reset_index(drop=True)
+
+
+def _read_instruments_file(path: Path) -> pd.DataFrame:
+    """
+    Read the master through a memory map. String columns stay pd.ArrowDtype
+    arrays over the mapped file instead of being copied into Python objects,
+    so processes reading the same file share those pages; only the numeric,
+    date and category-code columns are copied.
+    """
+    import pyarrow
+    from pyarrow import feather
+
+    def _keep_strings_mapped(arrow_type):
+        if pyarrow.types.is_string(arrow_type) or pyarrow.types.is_large_string(arrow_type):
+            return pd.ArrowDtype(arrow_type)
+        return None
+
+    return feather.read_table(path, memory_map=True).to_pandas(types_mapper=_keep_strings_mapped)
+
+
+def load_upstox_instruments(
+    exchange: str = "NSE",
+    cache_dir: str | Path = INSTRUMENTS_CACHE_DIR,
+    max_age_seconds: int = INSTRUMENTS_REFRESH_SECONDS,
+) -> pd.DataFrame:
+    """
+    Return the Upstox instrument master for an exchange from a shared disk copy.
+
+    The master is kept as an uncompressed Feather (Arrow IPC) file with
+    categorical segment/exchange/instrument_type columns and read back
+    memory-mapped, with the text columns left Arrow-backed, so several app
+    processes share one page-cached copy of the bulk of it. Once
+    the copy is older than max_age_seconds it is revalidated with a
+    conditional GET (ETag / Last-Modified); a 304 just renews the timestamp.
+    If the refresh fails the existing copy is used.
+    """
+    exchange = exchange.upper().strip()
+    url = _instruments_url(exchange)
+
+    cache_dir = Path(cache_dir)
+    data_path = cache_dir / f"{exchange}.feather"
+    meta_path = cache_dir / f"{exchange}.json"
+
+    meta = {}
+    if data_path.exists() and meta_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text())
+        except Exception:
+            meta = {}
+
+    if meta and time.time() - float(meta.get("checked_at", 0)) < max_age_seconds:
+        get_http_metrics().observe_cache("instrument_master", hit=True)
+        return _read_instruments_file(data_path)
+
+    conditional = {}
+    if meta.get("etag"):
+        conditional["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        conditional["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = get_upstox_client().get(url, timeout=60, rate_limited=False, headers=conditional, endpoint="instruments")
+        if response.status_code != 304:
+            response.raise_for_status()
+    except requests.RequestException:
+        if meta:
+            get_http_metrics().observe_cache("instrument_master", hit=True)
+            return _read_instruments_file(data_path)
+        raise
+
+    # A 304 revalidation still serves the file on disk.
+    get_http_metrics().observe_cache("instrument_master", hit=response.status_code == 304)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    if response.status_code != 304:
+        with gzip.GzipFile(fileobj=io.BytesIO(response.content)) as gz:
+            payload = json.loads(gz.read().decode("utf-8"))
+
+        df = build_instruments_frame(payload)
+        tmp_path = cache_dir / f"{exchange}.feather.tmp"
+        df.to_feather(tmp_path, compression="uncompressed")
+        os.replace(tmp_path, data_path)
+
+        meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+    meta["checked_at"] = time.time()
+    tmp_meta = cache_dir / f"{exchange}.json.tmp"
+    tmp_meta.write_text(json.dumps(meta))
+    os.replace(tmp_meta, meta_path)
+
+    return _read_instruments_file(data_path)
+
+
+# ============================================================
+# INSTRUMENT SEARCH INDEX
+# ============================================================
+INSTRUMENT_SEARCH_COLUMNS = ["trading_symbol", "short_name", "name", "underlying_symbol"]
+INSTRUMENT_RESOLVE_COLUMNS = ["trading_symbol", "isin", "short_name", "name"]
+
+
+def _mode_matches(key: tuple[str, str, str], mode: str, exchange: str) -> bool:
+    key_exchange, segment, instrument_type = key
+
+    if exchange == "NSE":
+        if mode == "Equity":
+            return segment == "NSE_EQ" and instrument_type == "EQ"
+        if mode == "Index":
+            return segment == "NSE_INDEX"
+        if mode == "Futures":
+            return segment == "NSE_FO" and instrument_type == "FUT"
+        if mode == "Call Option":
+            return segment == "NSE_FO" and instrument_type == "CE"
+        if mode == "Put Option":
+            return segment == "NSE_FO" and instrument_type == "PE"
+        return True
+    if exchange == "BSE":
+        if mode == "Equity":
+            return segment == "BSE_EQ" and instrument_type == "EQ"
+        if mode == "Index":
+            return segment == "BSE_INDEX"
+        return key_exchange == "BSE"
+    return True
+
+
+class InstrumentIndex:
+    """
+    Search index over one instrument-master frame.
+
+    Built once per master load: row positions partitioned by
+    (exchange, segment, instrument_type) and a trigram inverted index over
+    the upper-cased trading_symbol / short_name / name / underlying_symbol
+    text of each row.
+    A query intersects the posting lists of its trigrams, confirms the
+    substring on the few surviving rows and ranks exact symbol matches first,
+    then trading_symbol prefix matches, then other matches.
+    """
+
+    def __init__(self, instruments_df: pd.DataFrame):
+        self.frame = instruments_df
+
+        def _col(name: str) -> pd.Series:
+            if name in instruments_df.columns:
+                return instruments_df[name].astype(object).fillna("").astype(str)
+            return pd.Series("", index=instruments_df.index)
+
+        keys = pd.MultiIndex.from_arrays([_col("exchange"), _col("segment"), _col("instrument_type")])
+        codes, uniques = pd.factorize(keys)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        self.partitions = {
+            tuple(uniques[i]): order[bounds[i]:bounds[i + 1]]
+            for i in range(len(uniques))
+        }
+        self._mode_rows: dict[tuple[str, str], np.ndarray] = {}
+        self._resolver_cache: dict[tuple[str, str], list[tuple[pd.Index, np.ndarray]]] = {}
+
+        self.symbols = _col("trading_symbol").str.upper().to_numpy(dtype=object)
+
+        haystack = pd.Series("", index=instruments_df.index)
+        for col in INSTRUMENT_SEARCH_COLUMNS:
+            if col in instruments_df.columns:
+                haystack = haystack + "\x01" + _col(col).str.upper()
+        self.haystack = haystack.to_numpy(dtype=object)
+
+        self._build_trigrams(self.haystack)
+
+    def _build_trigrams(self, haystack: np.ndarray) -> None:
+        n = len(haystack)
+        self.gram_keys = np.empty(0, dtype=np.int64)
+        self.gram_offsets = np.zeros(1, dtype=np.int64)
+        self.gram_rows = np.empty(0, dtype=np.int64)
+        if n == 0:
+            return
+
+        buf = np.frombuffer("\x02".join(haystack).encode("latin-1", "replace"), dtype=np.uint8)
+        lengths = np.fromiter((len(h) + 1 for h in haystack), dtype=np.int64, count=n)
+        row_of = np.repeat(np.arange(n, dtype=np.int64), lengths)[: len(buf)]
+        if len(buf) < 3:
+            return
+
+        grams = (
+            buf[:-2].astype(np.int64) << 16
+            | buf[1:-1].astype(np.int64) << 8
+            | buf[2:].astype(np.int64)
+        )
+        same_row = row_of[:-2] == row_of[2:]
+        pairs = np.sort(grams[same_row] * n + row_of[:-2][same_row])
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+
+        gram_of_pair = pairs // n
+        self.gram_rows = pairs % n
+        starts = np.flatnonzero(np.r_[True, gram_of_pair[1:] != gram_of_pair[:-1]])
+        self.gram_keys = gram_of_pair[starts]
+        self.gram_offsets = np.append(starts, len(pairs)).astype(np.int64)
+
+    def _postings(self, gram: bytes) -> np.ndarray:
+        key = gram[0] << 16 | gram[1] << 8 | gram[2]
+        pos = np.searchsorted(self.gram_keys, key)
+        if pos >= len(self.gram_keys) or self.gram_keys[pos] != key:
+            return np.empty(0, dtype=np.int64)
+        return self.gram_rows[self.gram_offsets[pos]:self.gram_offsets[pos + 1]]
+
+    def mode_rows(self, mode: str, exchange: str) -> np.ndarray:
+        cache_key = (mode, exchange)
+        if cache_key not in self._mode_rows:
+            parts = [rows for key, rows in self.partitions.items() if _mode_matches(key, mode, exchange)]
+            self._mode_rows[cache_key] = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        return self._mode_rows[cache_key]
+
+    def search(self, query: str, mode: str = "Equity", exchange: str = "NSE", limit: int = 200) -> np.ndarray:
+        """Return ranked row positions into self.frame."""
+        allowed = self.mode_rows(mode, exchange.upper().strip())
+        query = str(query).strip().upper()
+        if not query:
+            return allowed[:100]
+
+        if len(query) >= 3:
+            encoded = query.encode("latin-1", "replace")
+            candidates = None
+            for gram in sorted({encoded[i:i + 3] for i in range(len(encoded) - 2)}, key=lambda g: len(self._postings(g))):
+                rows = self._postings(gram)
+                candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+                if not len(candidates):
+                    break
+            candidates = np.intersect1d(candidates, allowed, assume_unique=True)
+            candidates = candidates[[query in self.haystack[i] for i in candidates]]
+        else:
+            candidates = allowed[[query in self.haystack[i] for i in allowed]]
+
+        if not len(candidates):
+            return candidates
+
+        symbols = self.symbols[candidates]
+        rank = np.where(symbols == query, 0, np.where([s.startswith(query) for s in symbols], 1, 2))
+        order = np.lexsort((symbols.astype(str), rank))
+        return candidates[order][:limit]
+
+    def _resolver_levels(self, mode: str, exchange: str) -> list[tuple[pd.Index, np.ndarray]]:
+        cache_key = (mode, exchange)
+        if cache_key not in self._resolver_cache:
+            allowed = self.mode_rows(mode, exchange)
+            levels = []
+            for col in INSTRUMENT_RESOLVE_COLUMNS:
+                if col not in self.frame.columns:
+                    continue
+                values = pd.Index(
+                    self.frame[col].astype(object).fillna("").astype(str).str.strip().str.upper().to_numpy(dtype=object)[allowed]
+                )
+                first = ~values.duplicated(keep="first") & (values != "")
+                levels.append((values[first], allowed[first]))
+            self._resolver_cache[cache_key] = levels
+        return self._resolver_cache[cache_key]
+
+    def resolve(self, symbols: list[str], mode: str = "Equity", exchange: str = "NSE") -> list[Optional[str]]:
+        """
+        Map symbols to instrument keys in one vectorized pass per lookup level:
+        exact trading_symbol, then ISIN, then short_name, then name.
+        """
+        exchange = exchange.upper().strip()
+        queries = pd.Index([str(s).strip().upper() for s in symbols], dtype=object)
+        positions = np.full(len(queries), -1, dtype=np.int64)
+
+        for values, rows in self._resolver_levels(mode, exchange):
+            unresolved = np.flatnonzero(positions < 0)
+            if not len(unresolved):
+                break
+            hits = values.get_indexer(queries[unresolved])
+            found = hits >= 0
+            positions[unresolved[found]] = rows[hits[found]]
+
+        keys = self.frame["instrument_key"].to_numpy(dtype=object)
+        return [str(keys[p]) if p >= 0 else None for p in positions]
+
+
+_INSTRUMENT_INDEXES: dict[int, tuple[weakref.ref, InstrumentIndex]] = {}
+_INSTRUMENT_INDEXES_LOCK = threading.Lock()
+
+
+def get_instrument_index(instruments_df: pd.DataFrame) -> InstrumentIndex:
+    """Return the search index for this master frame, building it on first use."""
+    with _INSTRUMENT_INDEXES_LOCK:
+        for key in [k for k, (ref, _) in _INSTRUMENT_INDEXES.items() if ref() is None]:
+            del _INSTRUMENT_INDEXES[key]
+
+        entry = _INSTRUMENT_INDEXES.get(id(instruments_df))
+        if entry is not None and entry[0]() is instruments_df:
+            return entry[1]
+
+        index = InstrumentIndex(instruments_df)
+        _INSTRUMENT_INDEXES[id(instruments_df)] = (weakref.ref(instruments_df), index)
+        return index
+
+
+def filter_instruments(
+    instruments_df: pd.DataFrame,
+    query: str,
+    mode: str = "Equity",
+    exchange: str = "NSE",
+) -> pd.DataFrame:
+    index = get_instrument_index(instruments_df)
+    positions = index.search(query, mode=mode, exchange=exchange)
+
+    df = instruments_df.iloc[positions].reset_index(drop=True)
+    if str(query).strip():
+        df["exact_match"] = (index.symbols[positions] == str(query).strip().upper()).astype(int)
+    return df
+
+
+def resolve_instrument_keys(
+    instruments_df: pd.DataFrame,
+    symbols: list[str],
+    mode: str = "Equity",
+    exchange: str = "NSE",
+) -> dict[str, Optional[str]]:
+    """
+    Batch symbol -> instrument_key lookup for the scanner. Lookup tables are
+    cached on the master's InstrumentIndex, i.e. per exchange and master load.
+    """
+    keys = get_instrument_index(instruments_df).resolve(symbols, mode=mode, exchange=exchange)
+    return dict(zip(symbols, keys))
+
+
+# ============================================================
+# UPSTOX MARKET DATA FETCH
+# ============================================================
+def parse_iso_timestamps(values) -> pd.DatetimeIndex:
+    """
+    Parse candle timestamps into an IST DatetimeIndex.
+
+    Upstox sends fixed-width "YYYY-MM-DDTHH:MM:SS+05:30" strings, which numpy
+    can parse directly once the shared offset is split off; anything else goes
+    through pd.to_datetime.
+    """
+    stamps = np.asarray(values)
+    if stamps.dtype.kind == "U" and len(stamps):
+        first = str(stamps[0])
+        suffix = first[19:]
+        offset = None
+        if suffix in {"", "Z"}:
+            offset = 0
+        elif len(suffix) == 6 and suffix[0] in "+-" and suffix[3] == ":" and (suffix[1:3] + suffix[4:]).isdigit():
+            offset = (1 if suffix[0] == "+" else -1) * (int(suffix[1:3]) * 60 + int(suffix[4:]))
+
+        if offset is not None and stamps.dtype.itemsize // 4 == len(first) and np.char.endswith(stamps, suffix).all():
+            try:
+                local = stamps.astype("U19").astype("datetime64[s]").astype("datetime64[ns]")
+            except ValueError:
+                local = None
+            if local is not None:
+                if suffix == "":
+                    return pd.DatetimeIndex(local).tz_localize(INDIA_TZ)
+                utc = local - np.timedelta64(offset, "m")
+                return pd.DatetimeIndex(utc).tz_localize("UTC").tz_convert(INDIA_TZ)
+
+    try:
+        dates = pd.to_datetime(pd.Index(values), format="ISO8601")
+    except (ValueError, TypeError):
+        dates = None
+    if not isinstance(dates, pd.DatetimeIndex):
+        dates = pd.to_datetime(pd.Index(values), utc=True)
+    return dates.tz_localize(INDIA_TZ) if dates.tz is None else dates.tz_convert(INDIA_TZ)
+
+
+@timed_stage
+def parse_upstox_candles(candles: list) -> pd.DataFrame:
+    """
+    Expected candle format:
+    [timestamp, open, high, low, close, volume, open_interest]
+
+    The candle list is transposed once into typed numpy columns and the
+    timestamps are parsed and converted to IST in a single vectorized call.
+    """
+    if not candles:
+        return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume", "Open Interest"])
+
+    if any(len(c) < 7 for c in candles):
+        candles = [list(c[:6]) + [c[6] if len(c) > 6 else None] for c in candles if len(c) >= 6]
+        if not candles:
+            return pd.DataFrame()
+
+    columns = list(zip(*candles))
+
+    dates = parse_iso_timestamps(columns[0])
+
+    values = {
+        "Open": np.asarray(columns[1], dtype=np.float64),
+        "High": np.asarray(columns[2], dtype=np.float64),
+        "Low": np.asarray(columns[3], dtype=np.float64),
+        "Close": np.asarray(columns[4], dtype=np.float64),
+        "Volume": np.nan_to_num(np.asarray(columns[5], dtype=np.float64), nan=0.0),
+        "Open Interest": np.nan_to_num(np.asarray(columns[6], dtype=np.float64), nan=0.0),
+    }
+
+    # Upstox returns newest-first; a stable sort keeps the last duplicate last.
+    order = np.argsort(dates.asi8, kind="stable")
+    stamps = dates.asi8[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = stamps[1:] != stamps[:-1]
+    order = order[keep]
+
+    df = pd.DataFrame(
+        {name: column[order] for name, column in values.items()},
+        index=dates[order].rename("Date"),
+    )
+    return df
+
+
+def fetch_historical_range_v3(
+    access_token: str,
+    instrument_key: str,
+    interval: str,
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+) -> pd.DataFrame:
+    unit, intv = interval_to_upstox(interval)
+
+    url = f"{UPSTOX_HIST_V3}/{instrument_key}/{unit}/{intv}/{to_date.strftime('%Y-%m-%d')}/{from_date.strftime('%Y-%m-%d')}"
+    with stage_timer("fetch_historical_v3") as stage:
+        response = get_upstox_client().get(url, access_token, timeout=30, endpoint="historical_candle_v3")
+        response.raise_for_status()
+
+        payload = decode_json_response(response)
+        candles = payload.get("data", {}).get("candles", [])
+        stage.rows, stage.nbytes = len(candles), len(response.content)
+    return parse_upstox_candles(candles)
+
+
+def fetch_historical_chunked_v3(
+    access_token: str,
+    instrument_key: str,
+    interval: str,
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+    max_workers: int = HISTORY_FETCH_WORKERS,
+) -> pd.DataFrame:
+    """
+    Fetch a range longer than one request allows by splitting it into
+    API-sized windows, fetching them concurrently (the shared client keeps
+    them under the rate limit) and stitching the results back together.
+    """
+    windows = historical_request_windows(interval, from_date, to_date)
+    if len(windows) == 1:
+        return fetch_historical_range_v3(access_token, instrument_key, interval, from_date, to_date)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as pool:
+        futures = [
+            submit_traced(pool, None, fetch_historical_range_v3, access_token, instrument_key, interval, *window)
+            for window in windows
+        ]
+        parts = [future.result() for future in futures]
+
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return parse_upstox_candles([])
+
+    df = pd.concat(parts)
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+def fetch_historical_v3(access_token: str, instrument_key: str, period: str, interval: str) -> pd.DataFrame:
+    to_date = now_ist().normalize()
+    from_date = period_to_from_date(period, to_date)
+    return fetch_historical_chunked_v3(access_token, instrument_key, interval, from_date, to_date)
+
+
+def fetch_intraday_v3(access_token: str, instrument_key: str, interval: str) -> pd.DataFrame:
+    unit, intv = interval_to_upstox(interval)
+
+    url = f"{UPSTOX_INTRADAY_V3}/{instrument_key}/{unit}/{intv}"
+    with stage_timer("fetch_intraday_v3") as stage:
+        response = get_upstox_client().get(url, access_token, timeout=30, endpoint="intraday_candle_v3")
+        response.raise_for_status()
+
+        payload = decode_json_response(response)
+        candles = payload.get("data", {}).get("candles", [])
+        stage.rows, stage.nbytes = len(candles), len(response.content)
+    return parse_upstox_candles(candles)
+
+
+def live_ohlc_to_frame(live: dict) -> pd.DataFrame:
+    if not live or "ts" not in live:
+        return pd.DataFrame()
+
+    ts = pd.to_datetime(int(live["ts"]), unit="ms", utc=True).tz_convert(INDIA_TZ)
+
+    df = pd.DataFrame(
+        [
+            {
+                "Date": ts,
+                "Open": float(live.get("open", 0)),
+                "High": float(live.get("high", 0)),
+                "Low": float(live.get("low", 0)),
+                "Close": float(live.get("close", 0)),
+                "Volume": float(live.get("volume", 0)),
+                "Open Interest": 0.0,
+            }
+        ]
+    )
+    return df.set_index("Date")
+
+
+def fetch_live_ohlc_batch_v3(access_token: str, instrument_keys: list[str], interval: str) -> dict[str, pd.DataFrame]:
+    """
+    Current-candle quotes for many instruments, UPSTOX_OHLC_MAX_KEYS per
+    request. Returns {instrument_key: one-row frame}; keys without a live
+    candle are left out.
+    """
+    quote_int = ohlc_quote_interval(interval)
+    if not quote_int or not instrument_keys:
+        return {}
+
+    keys = list(dict.fromkeys(instrument_keys))
+    quotes = {}
+
+    for i in range(0, len(keys), UPSTOX_OHLC_MAX_KEYS):
+        chunk = keys[i:i + UPSTOX_OHLC_MAX_KEYS]
+        params = {
+            "instrument_key": ",".join(chunk),
+            "interval": quote_int,
+        }
+        with stage_timer("fetch_live_ohlc_v3") as stage:
+            response = get_upstox_client().get(
+                UPSTOX_OHLC_V3, access_token, params=params, timeout=30, endpoint="market_quote_ohlc_v3"
+            )
+            response.raise_for_status()
+
+            payload = decode_json_response(response)
+            data = payload.get("data", {}) or {}
+            stage.rows, stage.nbytes = len(data), len(response.content)
+
+        # Response entries are keyed by trading symbol; instrument_token carries the key.
+        for item in data.values():
+            key = item.get("instrument_token") or (chunk[0] if len(chunk) == 1 else None)
+            frame = live_ohlc_to_frame(item.get("live_ohlc", {}))
+            if key and not frame.empty:
+                quotes[key] = frame
+
+    return quotes
+
+
+def fetch_live_ohlc_v3(access_token: str, instrument_key: str, interval: str) -> pd.DataFrame:
+    quotes = fetch_live_ohlc_batch_v3(access_token, [instrument_key], interval)
+    return quotes.get(instrument_key, pd.DataFrame())
+
+
+# ============================================================
+# LOCAL CANDLE STORE
+# ============================================================
+class CandleStore:
+    """
+    On-disk OHLCV store keyed by instrument_key and interval.
+
+    Candles are kept as Parquet files, one per day for intraday intervals and
+    one per year for daily candles, so an append only rewrites the partitions
+    it touches. A small coverage file remembers which calendar range has
+    already been fetched, which lets callers ask for just the missing head or
+    tail of a lookback window. Only candles from completed sessions are
+    written; the current session is always refetched.
+    """
+
+    def __init__(self, root: str | Path = CANDLE_STORE_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def _series_dir(self, instrument_key: str, interval: str) -> Path:
+        return self.root / quote(instrument_key, safe="") / interval
+
+    @staticmethod
+    def _partition_key(ts: pd.Timestamp, interval: str) -> str:
+        return ts.strftime("%Y-%m-%d") if interval in INTRADAY_INTERVALS else ts.strftime("%Y")
+
+    def coverage(self, instrument_key: str, interval: str) -> Optional[tuple[pd.Timestamp, pd.Timestamp]]:
+        path = self._series_dir(instrument_key, interval) / "_coverage.json"
+        if not path.exists():
+            return None
+        try:
+            meta = json.loads(path.read_text())
+            return (
+                pd.Timestamp(meta["from_date"]).tz_localize(INDIA_TZ),
+                pd.Timestamp(meta["to_date"]).tz_localize(INDIA_TZ),
+            )
+        except Exception:
+            return None
+
+    def _write_coverage(self, series_dir: Path, from_date: pd.Timestamp, to_date: pd.Timestamp) -> None:
+        meta = {
+            "from_date": from_date.strftime("%Y-%m-%d"),
+            "to_date": to_date.strftime("%Y-%m-%d"),
+        }
+        tmp_path = series_dir / "_coverage.json.tmp"
+        tmp_path.write_text(json.dumps(meta))
+        os.replace(tmp_path, series_dir / "_coverage.json")
+
+    @timed_stage
+    def read(
+        self,
+        instrument_key: str,
+        interval: str,
+        from_date: pd.Timestamp | None = None,
+        to_date: pd.Timestamp | None = None,
+    ) -> pd.DataFrame:
+        import pyarrow
+        from pyarrow import parquet
+
+        series_dir = self._series_dir(instrument_key, interval)
+        if not series_dir.exists():
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+
+        lo = self._partition_key(from_date, interval) if from_date is not None else None
+        hi = self._partition_key(to_date, interval) if to_date is not None else None
+
+        # Partitions are concatenated as Arrow tables and converted to pandas
+        # once; a universe scan reads thousands of series, and per-file
+        # pd.read_parquet overhead dominates for one year of daily candles.
+        parts = []
+        for path in sorted(series_dir.glob("*.parquet")):
+            key = path.stem
+            if lo is not None and key < lo:
+                continue
+            if hi is not None and key > hi:
+                continue
+            parts.append(parquet.ParquetFile(path).read(use_threads=False))
+
+        if not parts:
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+
+        df = pyarrow.concat_tables(parts).to_pandas().sort_index()
+        if from_date is not None:
+            df = df[df.index >= from_date]
+        if to_date is not None:
+            df = df[df.index < to_date + pd.Timedelta(days=1)]
+        return df
+
+    @timed_stage
+    def write(
+        self,
+        instrument_key: str,
+        interval: str,
+        candles: pd.DataFrame,
+        from_date: pd.Timestamp,
+        to_date: pd.Timestamp,
+    ) -> None:
+        """
+        Merge completed-session candles into the store and extend coverage to
+        from_date..to_date. Callers must not pass a range that leaves a gap
+        against the existing coverage.
+        """
+        series_dir = self._series_dir(instrument_key, interval)
+
+        with self._lock:
+            series_dir.mkdir(parents=True, exist_ok=True)
+
+            if candles is not None and not candles.empty:
+                keys = candles.index.strftime("%Y-%m-%d" if interval in INTRADAY_INTERVALS else "%Y")
+                for key, chunk in candles.groupby(keys):
+                    path = series_dir / f"{key}.parquet"
+                    if path.exists():
+                        chunk = pd.concat([pd.read_parquet(path), chunk])
+                        chunk = chunk[~chunk.index.duplicated(keep="last")]
+                    tmp_path = series_dir / f"{key}.parquet.tmp"
+                    chunk.sort_index()[CANDLE_COLUMNS].to_parquet(tmp_path)
+                    os.replace(tmp_path, path)
+
+            existing = self.coverage(instrument_key, interval)
+            if existing is not None:
+                from_date = min(from_date, existing[0])
+                to_date = max(to_date, existing[1])
+            self._write_coverage(series_dir, from_date, to_date)
+
+
+def load_cached_history(
+    access_token: str,
+    instrument_key: str,
+    interval: str,
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+    store: CandleStore | None,
+) -> pd.DataFrame:
+    """
+    Return historical candles for from_date..to_date, fetching from Upstox
+    only the part of the range the store does not already cover.
+    """
+    if store is None:
+        return fetch_historical_chunked_v3(access_token, instrument_key, interval, from_date, to_date)
+
+    last_complete_day = now_ist().normalize() - pd.Timedelta(days=1)
+    covered = store.coverage(instrument_key, interval)
+
+    if covered is None:
+        missing = [(from_date, to_date)]
+    else:
+        missing = []
+        if from_date < covered[0]:
+            missing.append((from_date, covered[0] - pd.Timedelta(days=1)))
+        if to_date > covered[1]:
+            missing.append((covered[1] + pd.Timedelta(days=1), to_date))
+    # A hit when every completed session came from the store; the open session is always fetched.
+    get_http_metrics().observe_cache("candle_store", hit=all(start > last_complete_day for start, _ in missing))
+
+    open_session = []
+    for start, end in missing:
+        fetched = fetch_historical_chunked_v3(access_token, instrument_key, interval, start, end)
+        complete_end = min(end, last_complete_day)
+        if not fetched.empty:
+            complete = fetched[fetched.index < complete_end + pd.Timedelta(days=1)]
+            open_session.append(fetched[fetched.index >= complete_end + pd.Timedelta(days=1)])
+        else:
+            complete = fetched
+        if complete_end >= start:
+            store.write(instrument_key, interval, complete, start, complete_end)
+
+    parts = [store.read(instrument_key, interval, from_date, to_date)] + open_session
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame()
+
+    df = pd.concat(parts)
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+def load_upstox_data(
+    access_token: str,
+    instrument_key: str,
+    period: str,
+    interval: str,
+    include_live: bool = True,
+    store: CandleStore | None = None,
+    live_quote: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    Historical candles for the lookback window plus, during market hours, the
+    current session. Pass live_quote (from fetch_live_ohlc_batch_v3) to reuse
+    an already fetched daily live candle instead of requesting it here.
+    """
+    to_date = now_ist().normalize()
+    from_date = period_to_from_date(period, to_date)
+    hist = load_cached_history(access_token, instrument_key, interval, from_date, to_date, store)
+
+    parts = [hist] if not hist.empty else []
+
+    if include_live and is_market_hours_india():
+        try:
+            if interval in INTRADAY_INTERVALS:
+                intraday = fetch_intraday_v3(access_token, instrument_key, interval)
+                if not intraday.empty:
+                    parts.append(intraday)
+            elif interval == "1d":
+                if live_quote is not None:
+                    live_daily = live_quote
+                else:
+                    live_daily = fetch_live_ohlc_v3(access_token, instrument_key, interval)
+                if not live_daily.empty:
+                    parts.append(live_daily)
+        except Exception:
+            pass
+
+    if not parts:
+        return pd.DataFrame()
+
+    df = pd.concat(parts)
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+# ============================================================
+# STREAMING MARKET DATA
+# ============================================================
+def session_bucket_starts(stamps_ns: np.ndarray, interval: str) -> np.ndarray:
+    """Vectorized CandleAggregator.bucket_start over UTC epoch nanoseconds."""
+    local = np.asarray(stamps_ns, dtype=np.int64) + IST_OFFSET_NS
+    day = local - local % DAY_NS
+    if interval == "1d":
+        return day - IST_OFFSET_NS
+    width = STREAM_INTERVAL_MINUTES[interval] * 60 * 1_000_000_000
+    session_open = day + SESSION_OPEN_NS
+    return session_open + ((local - session_open) // width) * width - IST_OFFSET_NS
+
+
+class CandleAggregator:
+    """
+    Builds OHLCV candles in memory from last-traded-price ticks.
+
+    Every tick updates the open candle of each configured interval in
+    constant time. Intraday buckets are aligned to the 09:15 IST session open
+    like Upstox candles, "1d" buckets to IST midnight. version increases on
+    every tick so readers can tell whether anything changed.
+    """
+
+    def __init__(self, intervals: tuple[str, ...] = ("1m", "5m", "15m", "30m", "1h", "1d")):
+        self.intervals = tuple(intervals)
+        self.version = 0
+        self.last_tick_at: dict[str, float] = {}
+        self._candles: dict[tuple[str, str], dict[int, list[float]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bucket_start(ts_ns: int, interval: str) -> int:
+        local = ts_ns + IST_OFFSET_NS
+        day = local - local % DAY_NS
+        if interval == "1d":
+            return day - IST_OFFSET_NS
+        width = STREAM_INTERVAL_MINUTES[interval] * 60 * 1_000_000_000
+        session_open = day + SESSION_OPEN_NS
+        return session_open + ((local - session_open) // width) * width - IST_OFFSET_NS
+
+    def on_tick(self, instrument_key: str, ts_ms: int, price: float, quantity: float = 0.0) -> None:
+        ts_ns = int(ts_ms) * 1_000_000
+        price = float(price)
+        quantity = float(quantity or 0.0)
+
+        with self._lock:
+            for interval in self.intervals:
+                book = self._candles.setdefault((instrument_key, interval), {})
+                bucket = self.bucket_start(ts_ns, interval)
+                candle = book.get(bucket)
+                if candle is None:
+                    book[bucket] = [price, price, price, price, quantity]
+                else:
+                    if price > candle[1]:
+                        candle[1] = price
+                    if price < candle[2]:
+                        candle[2] = price
+                    candle[3] = price
+                    candle[4] += quantity
+            self.version += 1
+            self.last_tick_at[instrument_key] = time.time()
+
+    def frame(self, instrument_key: str, interval: str) -> pd.DataFrame:
+        with self._lock:
+            book = {bucket: list(candle) for bucket, candle in self._candles.get((instrument_key, interval), {}).items()}
+
+        if not book:
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+
+        buckets = np.fromiter(sorted(book), dtype=np.int64, count=len(book))
+        values = np.array([book[b] for b in buckets], dtype=np.float64)
+        index = pd.DatetimeIndex(buckets.astype("datetime64[ns]")).tz_localize("UTC").tz_convert(INDIA_TZ).rename("Date")
+        df = pd.DataFrame(values, columns=CANDLE_COLUMNS[:5], index=index)
+        df["Open Interest"] = 0.0
+        return df
+
+
+def merge_stream_candles(history: pd.DataFrame, live: pd.DataFrame) -> pd.DataFrame:
+    """
+    Overlay streamed candles on fetched history. Where both have a candle for
+    the same bucket the fetched open is kept, highs/lows are widened, the
+    streamed close wins and the larger volume is used (the stream only sees
+    ticks since it connected).
+    """
+    if live is None or live.empty:
+        return history
+    if history is None or history.empty:
+        return live
+
+    overlap = live.index.intersection(history.index)
+    if len(overlap):
+        live = live.copy()
+        past = history.loc[overlap]
+        live.loc[overlap, "Open"] = past["Open"]
+        live.loc[overlap, "High"] = np.maximum(live.loc[overlap, "High"], past["High"])
+        live.loc[overlap, "Low"] = np.minimum(live.loc[overlap, "Low"], past["Low"])
+        live.loc[overlap, "Volume"] = np.maximum(live.loc[overlap, "Volume"], past["Volume"])
+        live.loc[overlap, "Open Interest"] = past["Open Interest"]
+
+    df = pd.concat([history, live])
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+class ReplayFeed:
+    """
+    Client for tick_replay_server.py: reads newline-delimited JSON ticks
+    ({"instrument_key", "ts", "ltp", "ltq"}) from a TCP socket on a
+    background thread and feeds them into a CandleAggregator.
+
+    Malformed lines are skipped and counted in bad_lines. When the
+    connection fails or closes, error is set and the feed reconnects with
+    exponential backoff until stop(). A server replaying from the start
+    resends ticks that were already aggregated, so a tick no newer than the
+    last one seen for its instrument is dropped.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        aggregator: CandleAggregator | None = None,
+        reconnect_seconds: float = STREAM_RECONNECT_SECONDS,
+        max_reconnect_seconds: float = STREAM_RECONNECT_MAX_SECONDS,
+    ):
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.aggregator = aggregator or CandleAggregator()
+        self.reconnect_seconds = reconnect_seconds
+        self.max_reconnect_seconds = max_reconnect_seconds
+        self.error: Exception | None = None
+        self.bad_lines = 0
+        self.reconnects = 0
+        self._last_ts: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="replay-feed", daemon=True)
+
+    def start(self) -> "ReplayFeed":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        delay = self.reconnect_seconds
+        while not self._stop.is_set():
+            try:
+                if self._read():
+                    delay = self.reconnect_seconds
+                raise ConnectionError("replay server closed the connection")
+            except OSError as e:
+                if self._stop.is_set():
+                    break
+                self.error = e
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, self.max_reconnect_seconds)
+            self.reconnects += 1
+
+    def _read(self) -> bool:
+        """Read ticks until the server closes the connection; True if any new tick arrived."""
+        import socket
+
+        received = False
+        with socket.create_connection((self.host, self.port), timeout=10) as sock:
+            sock.settimeout(1.0)
+            buffer = b""
+            while not self._stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip() and self._on_line(line):
+                        received = True
+                        self.error = None
+        return received
+
+    def _on_line(self, line: bytes) -> bool:
+        try:
+            tick = json.loads(line)
+            instrument_key, ts = tick["instrument_key"], int(tick["ts"])
+            price, quantity = float(tick["ltp"]), float(tick.get("ltq") or 0)
+        except (ValueError, TypeError, KeyError):
+            self.bad_lines += 1
+            return False
+
+        if instrument_key in self._last_ts and ts <= self._last_ts[instrument_key]:
+            return False
+        self._last_ts[instrument_key] = ts
+        self.aggregator.on_tick(instrument_key, ts, price, quantity)
+        return True
+
+
+class UpstoxMarketFeed:
+    """
+    Subscribes to the Upstox v3 market-data WebSocket in "ltpc" mode through
+    upstox-python-sdk (which handles authorization and protobuf decoding) and
+    feeds last-traded-price ticks into a CandleAggregator. With record_path
+    set, every tick is also appended to a JSONL file that
+    tick_replay_server.py can play back.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        instrument_keys: list[str],
+        aggregator: CandleAggregator | None = None,
+        record_path: str | None = None,
+    ):
+        self.access_token = access_token
+        self.instrument_keys = list(instrument_keys)
+        self.aggregator = aggregator or CandleAggregator()
+        self.record_path = record_path
+        self.error: Exception | None = None
+        self._streamer = None
+        self._record_lock = threading.Lock()
+
+    def start(self) -> "UpstoxMarketFeed":
+        try:
+            import upstox_client
+        except ImportError as e:
+            raise ImportError("Streaming from Upstox needs upstox-python-sdk (pip install upstox-python-sdk).") from e
+
+        configuration = upstox_client.Configuration()
+        configuration.access_token = self.access_token
+        self._streamer = upstox_client.MarketDataStreamerV3(
+            upstox_client.ApiClient(configuration),
+            self.instrument_keys,
+            "ltpc",
+        )
+        self._streamer.on("message", self._on_message)
+        self._streamer.on("error", self._on_error)
+        threading.Thread(target=self._streamer.connect, name="upstox-feed", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._streamer is not None:
+            try:
+                self._streamer.disconnect()
+            except Exception:
+                pass
+
+    def _on_error(self, error) -> None:
+        self.error = error if isinstance(error, Exception) else RuntimeError(str(error))
+
+    def _on_message(self, message: dict) -> None:
+        ticks = []
+        for instrument_key, feed in (message.get("feeds") or {}).items():
+            ltpc = feed.get("ltpc") or feed.get("fullFeed", {}).get("marketFF", {}).get("ltpc") or {}
+            if "ltp" not in ltpc or "ltt" not in ltpc:
+                continue
+            tick = {
+                "instrument_key": instrument_key,
+                "ts": int(ltpc["ltt"]),
+                "ltp": float(ltpc["ltp"]),
+                "ltq": float(ltpc.get("ltq") or 0),
+            }
+            self.aggregator.on_tick(tick["instrument_key"], tick["ts"], tick["ltp"], tick["ltq"])
+            ticks.append(tick)
+
+        if self.record_path and ticks:
+            with self._record_lock, open(self.record_path, "a") as fh:
+                fh.writelines(json.dumps(t) + "\n" for t in ticks)
+
+
+@dataclass
+class StreamFeedEntry:
+    feed: ReplayFeed | UpstoxMarketFeed
+    holders: dict[str, float]
+
+
+class StreamFeeds:
+    """
+    Running tick feeds shared by the page sessions of one server process,
+    one per subscription key. Each session holds at most one feed; a feed is
+    stopped once no session holds it, either because its last holder moved to
+    another subscription or stopped streaming, or because no holder has asked
+    for it for idle_seconds (a closed browser tab never releases its feed).
+    """
+
+    def __init__(self, idle_seconds: float = STREAM_FEED_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._entries: dict[tuple, StreamFeedEntry] = {}
+        self._held: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, holder: str, key: tuple, factory: Callable[[], ReplayFeed | UpstoxMarketFeed]):
+        """Return the running feed for key, starting it with factory() if none is running."""
+        now = time.monotonic()
+        with self._lock:
+            stopped = self._drop_idle(now)
+            previous = self._held.get(holder)
+            if previous is not None and previous != key:
+                stopped += self._drop_holder(holder)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = StreamFeedEntry(factory().start(), {})
+            entry.holders[holder] = now
+            self._held[holder] = key
+            feed = entry.feed
+
+        for old in stopped:
+            old.stop()
+        return feed
+
+    def release(self, holder: str) -> None:
+        with self._lock:
+            stopped = self._drop_holder(holder) if holder in self._held else []
+        for old in stopped:
+            old.stop()
+
+    def _drop_holder(self, holder: str) -> list:
+        key = self._held.pop(holder)
+        entry = self._entries[key]
+        entry.holders.pop(holder, None)
+        if entry.holders:
+            return []
+        del self._entries[key]
+        return [entry.feed]
+
+    def _drop_idle(self, now: float) -> list:
+        stale = [
+            holder
+            for entry in self._entries.values()
+            for holder, seen in entry.holders.items()
+            if now - seen > self.idle_seconds
+        ]
+        stopped = []
+        for holder in stale:
+            stopped += self._drop_holder(holder)
+        return stopped
+
+
+# ============================================================
+# OPTION CHAIN / OI / PCR
+# ============================================================
+def fetch_option_contracts_v2(access_token: str, instrument_key: str, expiry_date: str | None = None) -> pd.DataFrame:
+    params = {"instrument_key": instrument_key}
+    if expiry_date:
+        params["expiry_date"] = expiry_date
+
+    with stage_timer("fetch_option_contracts_v2") as stage:
+        response = get_upstox_client().get(
+            UPSTOX_OPTION_CONTRACTS_V2,
+            access_token=access_token,
+            params=params,
+            timeout=30,
+            endpoint="option_contract_v2",
+        )
+        response.raise_for_status()
+
+        payload = response.json()
+        data = payload.get("data", [])
+        stage.rows, stage.nbytes = len(data), len(response.content)
+    if not data:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(data)
+    if "expiry" in df.columns:
+        df["expiry"] = pd.to_datetime(df["expiry"], errors="coerce").dt.strftime("%Y-%m-%d")
+    return df
+
+
+def get_available_option_expiries(access_token: str, instrument_key: str) -> list[str]:
+    df = fetch_option_contracts_v2(access_token, instrument_key)
+    if df.empty or "expiry" not in df.columns:
+        return []
+
+    expiries = (
+        df["expiry"]
+        .dropna()
+        .astype(str)
+        .sort_values()
+        .unique()
+        .tolist()
+    )
+    return expiries
+
+
+def fetch_option_chain_v2(access_token: str, instrument_key: str, expiry_date: str) -> pd.DataFrame:
+    params = {
+        "instrument_key": instrument_key,
+        "expiry_date": expiry_date,
+    }
+
+    with stage_timer("fetch_option_chain_v2") as stage:
+        response = get_upstox_client().get(
+            UPSTOX_OPTION_CHAIN_V2,
+            access_token=access_token,
+            params=params,
+            timeout=30,
+            endpoint="option_chain_v2",
+        )
+        response.raise_for_status()
+
+        payload = response.json()
+        data = payload.get("data", [])
+        stage.rows, stage.nbytes = len(data), len(response.content)
+    if not data:
+        return pd.DataFrame()
+
+    rows = []
+    for item in data:
+        call_md = item.get("call_options", {}).get("market_data", {}) or {}
+        put_md = item.get("put_options", {}).get("market_data", {}) or {}
+        call_greeks = item.get("call_options", {}).get("option_greeks", {}) or {}
+        put_greeks = item.get("put_options", {}).get("option_greeks", {}) or {}
+
+        rows.append(
+            {
+                "Expiry": item.get("expiry"),
+                "Strike": item.get("strike_price"),
+                "Underlying Spot": item.get("underlying_spot_price"),
+                "PCR": item.get("pcr"),
+
+                "Call Instrument Key": item.get("call_options", {}).get("instrument_key"),
+                "Call LTP": call_md.get("ltp"),
+                "Call Volume": call_md.get("volume"),
+                "Call OI": call_md.get("oi"),
+                "Call Prev OI": call_md.get("prev_oi"),
+                "Call Bid": call_md.get("bid_price"),
+                "Call Ask": call_md.get("ask_price"),
+                "Call IV": call_greeks.get("iv"),
+                "Call Delta": call_greeks.get("delta"),
+
+                "Put Instrument Key": item.get("put_options", {}).get("instrument_key"),
+                "Put LTP": put_md.get("ltp"),
+                "Put Volume": put_md.get("volume"),
+                "Put OI": put_md.get("oi"),
+                "Put Prev OI": put_md.get("prev_oi"),
+                "Put Bid": put_md.get("bid_price"),
+                "Put Ask": put_md.get("ask_price"),
+                "Put IV": put_greeks.get("iv"),
+                "Put Delta": put_greeks.get("delta"),
+            }
+        )
+
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df = df.sort_values("Strike").reset_index(drop=True)
+    return df
+
+
+def compute_option_chain_summary(option_chain_df: pd.DataFrame) -> dict:
+    if option_chain_df is None or option_chain_df.empty:
+        return {
+            "total_call_oi": np.nan,
+            "total_put_oi": np.nan,
+            "overall_pcr": np.nan,
+            "spot_price": np.nan,
+        }
+
+    total_call_oi = pd.to_numeric(option_chain_df["Call OI"], errors="coerce").fillna(0).sum()
+    total_put_oi = pd.to_numeric(option_chain_df["Put OI"], errors="coerce").fillna(0).sum()
+
+    overall_pcr = np.nan
+    if total_call_oi and total_call_oi != 0:
+        overall_pcr = total_put_oi / total_call_oi
+
+    spot_price = pd.to_numeric(option_chain_df["Underlying Spot"], errors="coerce").dropna()
+    spot_price = spot_price.iloc[0] if not spot_price.empty else np.nan
+
+    return {
+        "total_call_oi": total_call_oi,
+        "total_put_oi": total_put_oi,
+        "overall_pcr": overall_pcr,
+        "spot_price": spot_price,
+    }
+
+
+def interpret_pcr(overall_pcr: float) -> str:
+    if pd.isna(overall_pcr):
+        return "PCR unavailable"
+    if overall_pcr > 1.0:
+        return "Put-heavy positioning"
+    if overall_pcr < 1.0:
+        return "Call-heavy positioning"
+    return "Balanced positioning"
+
+
+# ============================================================
+# INDICATORS
+# ============================================================
+INDICATOR_COLUMNS = [
+    "Vol_MA",
+    "Vol_Ratio",
+    "Price_Change_%",
+    "Candle_Range",
+    "Body_Size",
+    "RSI",
+    "MACD",
+    "MACD_Signal",
+    "MACD_Hist",
+    "ATR",
+    "VWAP",
+]
+
+
+def compute_rsi(series: pd.Series, period: int = 14) -> pd.Series:
+    delta = series.diff()
+    gain = delta.clip(lower=0)
+    loss = -delta.clip(upper=0)
+
+    avg_gain = gain.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    avg_loss = loss.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+
+    rs = avg_gain / avg_loss.replace(0, np.nan)
+    rsi = 100 - (100 / (1 + rs))
+    return rsi
+
+
+def compute_macd(series: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9):
+    ema_fast = series.ewm(span=fast, adjust=False).mean()
+    ema_slow = series.ewm(span=slow, adjust=False).mean()
+    macd = ema_fast - ema_slow
+    macd_signal = macd.ewm(span=signal, adjust=False).mean()
+    macd_hist = macd - macd_signal
+    return macd, macd_signal, macd_hist
+
+
+def compute_atr(df: pd.DataFrame, period: int = 14) -> pd.Series:
+    high_low = df["High"] - df["Low"]
+    high_close = (df["High"] - df["Close"].shift(1)).abs()
+    low_close = (df["Low"] - df["Close"].shift(1)).abs()
+
+    tr = np.fmax(np.fmax(high_low, high_close), low_close)
+    atr = tr.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    return atr
+
+
+def compute_vwap(df: pd.DataFrame) -> pd.Series:
+    typical_price = (df["High"] + df["Low"] + df["Close"]) / 3.0
+    cum_tpv = (typical_price * df["Volume"]).cumsum()
+    cum_vol = df["Volume"].replace(0, np.nan).cumsum()
+    vwap = cum_tpv / cum_vol
+    return vwap
+
+
+def compute_indicators(candles, volume_ma_window: int) -> dict:
+    """
+    INDICATOR_COLUMNS from candles["Open"] .. candles["Volume"], which are
+    either Series (one symbol) or DataFrames of bars x symbols. pandas runs
+    its window functions column by column, so a symbol gets the same numbers
+    either way.
+    """
+    volume = candles["Volume"]
+    close = candles["Close"]
+    vol_ma = volume.rolling(volume_ma_window, min_periods=1).mean()
+    macd, macd_signal, macd_hist = compute_macd(close)
+    return {
+        "Vol_MA": vol_ma,
+        "Vol_Ratio": (volume / vol_ma).where(vol_ma > 0),
+        "Price_Change_%": close.pct_change() * 100,
+        "Candle_Range": candles["High"] - candles["Low"],
+        "Body_Size": (close - candles["Open"]).abs(),
+        "RSI": compute_rsi(close, 14),
+        "MACD": macd,
+        "MACD_Signal": macd_signal,
+        "MACD_Hist": macd_hist,
+        "ATR": compute_atr(candles, 14),
+        "VWAP": compute_vwap(candles),
+    }
+
+
+@timed_stage
+def compute_indicator_frame(df: pd.DataFrame, volume_ma_window: int) -> pd.DataFrame:
+    out = df.copy()
+    for name, values in compute_indicators(df, volume_ma_window).items():
+        out[name] = values
+    return out
+
+
+# ============================================================
+# INCREMENTAL INDICATORS
+# ============================================================
+NAN = float("nan")
+
+
+def _divide(a: float, b: float) -> float:
+    """a / b with numpy's float semantics instead of ZeroDivisionError."""
+    if b == 0:
+        if a != a or a == 0:
+            return NAN
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+class EwmMean:
+    """
+    One-value-at-a-time ``Series.ewm(adjust=False).mean()``.
+
+    The update is pandas' own recurrence (weights renormalised on every
+    observation, NaN gaps decaying the old weight), written out operation for
+    operation so a series pushed through here matches the batch result bit
+    for bit. peek() returns the next value without consuming it, which is
+    how a still-forming candle is priced.
+    """
+
+    __slots__ = ("alpha", "old_wt_factor", "min_periods", "weighted", "old_wt", "nobs")
+
+    def __init__(self, com: float, min_periods: int = 0):
+        self.alpha = 1.0 / (1.0 + float(com))
+        self.old_wt_factor = 1.0 - self.alpha
+        self.min_periods = min_periods
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    @classmethod
+    def from_span(cls, span: float, min_periods: int = 0) -> "EwmMean":
+        return cls((span - 1) / 2, min_periods)
+
+    @classmethod
+    def from_alpha(cls, alpha: float, min_periods: int = 0) -> "EwmMean":
+        return cls((1 - alpha) / alpha, min_periods)
+
+    def _step(self, value: float) -> tuple[float, float, int]:
+        weighted, old_wt, nobs = self.weighted, self.old_wt, self.nobs
+        is_observation = value == value
+        nobs += is_observation
+        if weighted == weighted:
+            old_wt *= self.old_wt_factor
+            if is_observation:
+                if weighted != value:
+                    weighted = old_wt * weighted + self.alpha * value
+                    weighted /= old_wt + self.alpha
+                old_wt = 1.0
+        elif is_observation:
+            weighted = value
+        return weighted, old_wt, nobs
+
+    def push(self, value: float) -> float:
+        self.weighted, self.old_wt, self.nobs = self._step(value)
+        return self.weighted if self.nobs >= self.min_periods else NAN
+
+    def peek(self, value: float) -> float:
+        weighted, _, nobs = self._step(value)
+        return weighted if nobs >= self.min_periods else NAN
+
+
+class RollingMean:
+    """
+    One-value-at-a-time ``Series.rolling(window, min_periods).mean()``.
+
+    Keeps the same compensated running sum pandas carries across windows
+    (separate add/remove compensation, negative-value count, run of equal
+    values), so results match the batch rolling mean exactly.
+    """
+
+    __slots__ = (
+        "window",
+        "min_periods",
+        "values",
+        "sum_x",
+        "compensation_add",
+        "compensation_remove",
+        "nobs",
+        "neg_ct",
+        "same_ct",
+        "prev_value",
+    )
+
+    def __init__(self, window: int, min_periods: int | None = None):
+        self.window = int(window)
+        self.min_periods = max(self.window if min_periods is None else int(min_periods), 1)
+        self.values: deque[float] = deque()
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.nobs = 0
+        self.neg_ct = 0
+        self.same_ct = 0
+        self.prev_value: float | None = None
+
+    def _step(self, value: float) -> tuple[float, tuple]:
+        sum_x, comp_add, comp_remove = self.sum_x, self.compensation_add, self.compensation_remove
+        nobs, neg_ct, same_ct, prev_value = self.nobs, self.neg_ct, self.same_ct, self.prev_value
+
+        if prev_value is None or self.window <= 1:
+            # pandas starts from a clean sum whenever the window no longer
+            # overlaps the previous one, which for window=1 is every row.
+            sum_x = comp_add = comp_remove = 0.0
+            nobs = neg_ct = same_ct = 0
+            prev_value = value
+        elif len(self.values) >= self.window:
+            old = self.values[0]
+            if old == old:
+                nobs -= 1
+                y = -old - comp_remove
+                t = sum_x + y
+                comp_remove = t - sum_x - y
+                sum_x = t
+                if math.copysign(1.0, old) < 0:
+                    neg_ct -= 1
+
+        if value == value:
+            nobs += 1
+            y = value - comp_add
+            t = sum_x + y
+            comp_add = t - sum_x - y
+            sum_x = t
+            if math.copysign(1.0, value) < 0:
+                neg_ct += 1
+            same_ct = same_ct + 1 if value == prev_value else 1
+            prev_value = value
+
+        if nobs >= self.min_periods:
+            result = sum_x / nobs
+            if same_ct >= nobs:
+                result = prev_value
+            elif neg_ct == 0 and result < 0:
+                result = 0.0
+            elif neg_ct == nobs and result > 0:
+                result = 0.0
+        else:
+            result = NAN
+        return result, (sum_x, comp_add, comp_remove, nobs, neg_ct, same_ct, prev_value)
+
+    def push(self, value: float) -> float:
+        result, state = self._step(value)
+        (
+            self.sum_x,
+            self.compensation_add,
+            self.compensation_remove,
+            self.nobs,
+            self.neg_ct,
+            self.same_ct,
+            self.prev_value,
+        ) = state
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self.values.popleft()
+        return result
+
+    def peek(self, value: float) -> float:
+        return self._step(value)[0]
+
+
+class IndicatorEngine:
+    """
+    compute_indicator_frame kept current one candle at a time.
+
+    Every row except the last is folded into running Wilder/EMA/rolling-sum
+    state once; the last row is treated as a candle that may still change
+    and is priced from that state without being folded in. Appending a
+    candle or revising the live one therefore costs O(1) indicator work,
+    and the columns stay bit-identical to the batch functions. If the
+    already-folded history no longer matches (a reload, a different
+    series) the state is rebuilt from the first row.
+    """
+
+    CANDLE_FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+    def __init__(self, volume_ma_window: int):
+        self.volume_ma_window = int(volume_ma_window)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._vol_ma = RollingMean(self.volume_ma_window, min_periods=1)
+        self._avg_gain = EwmMean.from_alpha(1 / 14, min_periods=14)
+        self._avg_loss = EwmMean.from_alpha(1 / 14, min_periods=14)
+        self._ema_fast = EwmMean.from_span(12)
+        self._ema_slow = EwmMean.from_span(26)
+        self._macd_signal = EwmMean.from_span(9)
+        self._atr = EwmMean.from_alpha(1 / 14, min_periods=14)
+        self._cum_tpv = 0.0
+        self._cum_vol = 0.0
+        self._prev_close = NAN
+        self._committed = 0
+        self._anchor: tuple | None = None
+        self._out = np.empty((0, len(INDICATOR_COLUMNS)), dtype=np.float64)
+
+    def _resume_from(self, df: pd.DataFrame) -> Optional[int]:
+        """First row that still needs work, or None if the state has to be rebuilt."""
+        m = self._committed
+        if m == 0:
+            return 0
+        if len(df) <= m:
+            return None
+        ts, values = self._anchor
+        last_folded = df.iloc[m - 1][self.CANDLE_FIELDS].to_numpy(dtype=np.float64)
+        if df.index[m - 1] != ts or not np.array_equal(last_folded, values, equal_nan=True):
+            return None
+        return m
+
+    def _advance(self, o: float, h: float, l: float, c: float, v: float, commit: bool) -> tuple:
+        prev_close = self._prev_close
+
+        vol_ma = self._vol_ma.push(v) if commit else self._vol_ma.peek(v)
+        vol_ratio = v / vol_ma if vol_ma > 0 else NAN
+        price_change = (_divide(c, prev_close) - 1) * 100
+
+        delta = c - prev_close
+        gain = delta if delta != delta or delta >= 0 else 0.0
+        loss = -(delta if delta != delta or delta <= 0 else 0.0)
+
+        tr_parts = [x for x in (h - l, abs(h - prev_close), abs(l - prev_close)) if x == x]
+        tr = max(tr_parts) if tr_parts else NAN
+
+        tpv = (h + l + c) / 3.0 * v
+        vol = v if v != 0 else NAN
+        cum_tpv = self._cum_tpv + tpv if tpv == tpv else self._cum_tpv
+        cum_vol = self._cum_vol + vol if vol == vol else self._cum_vol
+
+        if commit:
+            avg_gain, avg_loss = self._avg_gain.push(gain), self._avg_loss.push(loss)
+            ema_fast, ema_slow = self._ema_fast.push(c), self._ema_slow.push(c)
+            macd = ema_fast - ema_slow
+            macd_signal = self._macd_signal.push(macd)
+            atr = self._atr.push(tr)
+            self._cum_tpv, self._cum_vol, self._prev_close = cum_tpv, cum_vol, c
+        else:
+            avg_gain, avg_loss = self._avg_gain.peek(gain), self._avg_loss.peek(loss)
+            ema_fast, ema_slow = self._ema_fast.peek(c), self._ema_slow.peek(c)
+            macd = ema_fast - ema_slow
+            macd_signal = self._macd_signal.peek(macd)
+            atr = self._atr.peek(tr)
+
+        rs = avg_gain / (avg_loss if avg_loss != 0 else NAN)
+        rsi = 100 - _divide(100, 1 + rs)
+        vwap = _divide(cum_tpv if tpv == tpv else NAN, cum_vol if vol == vol else NAN)
+
+        return (vol_ma, vol_ratio, price_change, h - l, abs(c - o), rsi, macd, macd_signal, macd - macd_signal, atr, vwap)
+
+    @timed_stage
+    def update(self, df: pd.DataFrame, as_frame: bool = True):
+        """
+        Return compute_indicator_frame(df, volume_ma_window), reusing the
+        state from the previous call. With as_frame=False only the indicator
+        values of the last row are returned, skipping the O(n) frame copy.
+        """
+        with self._lock:
+            n = len(df)
+            start = self._resume_from(df)
+            if start is None:
+                self._reset()
+                start = 0
+
+            if len(self._out) < n:
+                grown = np.empty((max(n, 2 * len(self._out)), len(INDICATOR_COLUMNS)), dtype=np.float64)
+                grown[: self._committed] = self._out[: self._committed]
+                self._out = grown
+
+            rows = df.iloc[start:][self.CANDLE_FIELDS].to_numpy(dtype=np.float64).tolist()
+            for offset, row in enumerate(rows[:-1]):
+                self._out[start + offset] = self._advance(*row, commit=True)
+            if rows:
+                self._out[n - 1] = self._advance(*rows[-1], commit=False)
+
+            self._committed = max(n - 1, 0)
+            if n >= 2:
+                self._anchor = (df.index[n - 2], np.array(rows[-2] if len(rows) >= 2 else self._anchor[1]))
+
+            if not as_frame:
+                return pd.Series(self._out[n - 1] if n else np.nan, index=INDICATOR_COLUMNS, dtype=np.float64)
+
+            out = df.copy()
+            for j, column in enumerate(INDICATOR_COLUMNS):
+                out[column] = self._out[:n, j].copy()
+            return out
+
+
+_INDICATOR_ENGINES: OrderedDict[tuple[str, str, int], IndicatorEngine] = OrderedDict()
+_INDICATOR_ENGINES_LOCK = threading.Lock()
+
+
+def get_indicator_engine(instrument_key: str, interval: str, volume_ma_window: int) -> IndicatorEngine:
+    key = (instrument_key, interval, int(volume_ma_window))
+    with _INDICATOR_ENGINES_LOCK:
+        engine = _INDICATOR_ENGINES.get(key)
+        if engine is None:
+            engine = _INDICATOR_ENGINES[key] = IndicatorEngine(volume_ma_window)
+        _INDICATOR_ENGINES.move_to_end(key)
+        while len(_INDICATOR_ENGINES) > INDICATOR_ENGINE_MAX_ENTRIES:
+            _INDICATOR_ENGINES.popitem(last=False)
+    return engine
+
+
+# ============================================================
+# PRICE STRUCTURE
+# ============================================================
+def rolling_extreme(values: np.ndarray, width: int, ufunc=np.fmax) -> np.ndarray:
+    """
+    Max (np.fmax) or min (np.fmin) of every window of `width` consecutive
+    values; entry j covers values[j:j + width]. Built as a sparse table, so
+    the cost is O(n log width) regardless of window size. fmax/fmin skip NaN
+    the way Series.max()/min() do.
+    """
+    out = np.asarray(values, dtype=np.float64)
+    span = 1
+    while span * 2 <= width:
+        out = ufunc(out[:-span], out[span:])
+        span *= 2
+    if span < width:
+        out = ufunc(out[: len(values) - width + 1], out[width - span:])
+    return out
+
+
+@timed_stage
+def find_pivots(
+    df: pd.DataFrame,
+    left_bars: int = 3,
+    right_bars: int = 3,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Swing highs/lows: bars whose high (low) equals the highest high (lowest
+    low) of the surrounding left_bars + 1 + right_bars window. Equal highs
+    inside one window all count as pivots.
+    """
+    width = left_bars + right_bars + 1
+    if len(df) < width:
+        return (
+            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
+            pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS),
+        )
+
+    end = len(df) - right_bars
+    pivots = []
+    for column, ufunc, pivot_type in (("High", np.fmax, "Resistance"), ("Low", np.fmin, "Support")):
+        values = df[column].to_numpy(dtype=np.float64)
+        centre = values[left_bars:end]
+        positions = np.flatnonzero(centre == rolling_extreme(values, width, ufunc)) + left_bars
+        if len(positions) == 0:
+            pivots.append(pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS))
+            continue
+        pivots.append(
+            pd.DataFrame(
+                {
+                    "Date": df.index[positions],
+                    "Price": values[positions],
+                    "Type": pivot_type,
+                },
+                columns=EMPTY_PIVOT_COLUMNS,
+            )
+        )
+
+    return pivots[0], pivots[1]
+
+
+@dataclass(slots=True)
+class Zone:
+    zone_type: str
+    center: float
+    lower: float
+    upper: float
+    touches: int
+    last_touch: pd.Timestamp
+
+
+def _cluster_bounds(prices: np.ndarray, band: float) -> np.ndarray:
+    """Cluster boundaries in ascending prices, as the start of each cluster followed by len(prices)."""
+    values = prices.tolist()
+
+    # Single pass with a running sum. np.mean (used for the reported centres)
+    # sums pairwise, so when a pivot sits within rounding distance of the band
+    # edge the membership test is redone with np.mean to keep the same split.
+    tolerance = 1e-9 * (float(np.nanmax(np.abs(prices), initial=0.0)) + band)
+    starts = [0]
+    start, total, count = 0, values[0], 1
+    for i in range(1, len(values)):
+        price = values[i]
+        distance = abs(price - total / count)
+        if -tolerance <= distance - band <= tolerance:
+            distance = abs(price - float(np.mean(prices[start:i])))
+
+        if distance <= band:
+            total += price
+            count += 1
+        else:
+            starts.append(i)
+            start, total, count = i, price, 1
+
+    return np.append(starts, len(values))
+
+
+@timed_stage
+def cluster_levels(
+    pivots: pd.DataFrame,
+    current_price: float,
+    zone_width_pct: float,
+    zone_type: str,
+    min_touches: int,
+) -> list[Zone]:
+    """
+    Walk the pivot prices in ascending order; a pivot joins the current
+    cluster while it is within zone_width_pct of current_price from the
+    cluster mean, otherwise it starts a new cluster. Clusters with at least
+    min_touches pivots become zones around their mean.
+    """
+    if pivots is None or pivots.empty or "Price" not in pivots.columns or "Date" not in pivots.columns:
+        return []
+
+    band = current_price * zone_width_pct / 100.0
+    if band <= 0:
+        return []
+
+    raw_prices = pivots["Price"].to_numpy(dtype=np.float64)
+    order = np.argsort(raw_prices, kind="stable")
+    prices = raw_prices[order]
+    bounds = _cluster_bounds(prices, band)
+    touches = np.diff(bounds)
+    dates = pd.DatetimeIndex(pivots["Date"])
+    last_touches = pd.DatetimeIndex(np.maximum.reduceat(dates.asi8[order], bounds[:-1]).astype(f"M8[{dates.unit}]"))
+    if dates.tz is not None:
+        last_touches = last_touches.tz_localize("UTC").tz_convert(dates.tz)
+
+    zones: list[Zone] = []
+    for k in np.flatnonzero(touches >= min_touches):
+        center = float(np.mean(prices[bounds[k]: bounds[k + 1]]))
+        zones.append(
+            Zone(
+                zone_type=zone_type,
+                center=center,
+                lower=center - band,
+                upper=center + band,
+                touches=int(touches[k]),
+                last_touch=last_touches[k],
+            )
+        )
+    return zones
+
+
+@dataclass
+class Trendline:
+    line_type: str
+    x0: pd.Timestamp
+    y0: float
+    x1: pd.Timestamp
+    y1: float
+    slope_per_bar: float
+    touches: int
+    status: str
+
+
+def _pivot_positions(df: pd.DataFrame, points: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Bar positions and prices of the pivots that fall on df's index, in time order."""
+    if points is None or len(points) == 0 or "Date" not in points.columns or "Price" not in points.columns:
+        return np.empty(0), np.empty(0)
+    x = df.index.get_indexer(pd.DatetimeIndex(points["Date"])).astype(np.float64)
+    y = points["Price"].to_numpy(dtype=np.float64)
+    keep = (x >= 0) & ~np.isnan(y)
+    order = np.argsort(x[keep], kind="stable")
+    return x[keep][order], y[keep][order]
+
+
+def _touches(y: np.ndarray, projected: np.ndarray, tolerance_pct: float) -> np.ndarray:
+    return np.abs(y - projected) / np.maximum(np.abs(projected), 1e-9) * 100 <= tolerance_pct
+
+
+def rank_trendlines(
+    x: np.ndarray,
+    y: np.ndarray,
+    line_type: str,
+    tolerance_pct: float,
+    max_lines: int,
+    max_anchors: int = TRENDLINE_MAX_ANCHORS,
+) -> list[tuple[float, float, float, int]]:
+    """
+    Best lines through two pivots, as (x0, y0, slope, touches).
+
+    Every pair among the last max_anchors pivots is a candidate (rising pairs
+    for support, falling pairs for resistance) and all candidates are
+    projected onto all pivots in one broadcast. A candidate is kept only if no
+    pivot from its first anchor on pierces it by more than
+    tolerance_pct; the rest are ranked by touches, then by the most recent
+    second anchor, then by length. Near-identical lines are reported once.
+    """
+    x, y = x[-max_anchors:], y[-max_anchors:]
+    if len(x) < 2:
+        return []
+
+    first, second = np.triu_indices(len(x), k=1)
+    dx = x[second] - x[first]
+    dy = y[second] - y[first]
+    keep = (dx > 0) & ((dy > 0) if line_type == "Support Trendline" else (dy < 0))
+    first, second = first[keep], second[keep]
+    if len(first) == 0:
+        return []
+
+    x0, y0 = x[first], y[first]
+    slope = dy[keep] / dx[keep]
+    # Projected price of every pivot on every candidate, then the signed
+    # distance from it in % of the line; NaN before the candidate starts so
+    # those pivots neither touch nor break it. Done in place: the candidate x
+    # pivot matrices are the only large allocations here.
+    projected = np.subtract(x[None, :], x0[:, None])
+    projected *= slope[:, None]
+    projected += y0[:, None]
+    deviation = np.subtract(y[None, :], projected)
+    np.abs(projected, out=projected)
+    np.maximum(projected, 1e-9, out=projected)
+    deviation /= projected
+    deviation *= 100
+    deviation[x[None, :] < x0[:, None]] = np.nan
+
+    touches = (np.abs(deviation) <= tolerance_pct).sum(axis=1)
+    if line_type == "Support Trendline":
+        valid = ~(deviation < -tolerance_pct).any(axis=1)
+    else:
+        valid = ~(deviation > tolerance_pct).any(axis=1)
+
+    order = np.lexsort((x0, -x[second], -touches))
+    order = order[valid[order]]
+
+    lines = []
+    available = np.ones(len(order), dtype=bool)
+    while len(lines) < max_lines and available.any():
+        best = order[np.argmax(available)]
+        lines.append((float(x0[best]), float(y0[best]), float(slope[best]), int(touches[best])))
+
+        # Drop candidates that run within tolerance of the chosen line at both
+        # their own start and the latest pivot; they are the same line.
+        cand = order
+        at_start = y0[best] + slope[best] * (x0[cand] - x0[best])
+        at_end = y0[best] + slope[best] * (x[-1] - x0[best])
+        cand_end = y0[cand] + slope[cand] * (x[-1] - x0[cand])
+        same = _touches(y0[cand], at_start, tolerance_pct) & _touches(cand_end, at_end, tolerance_pct)
+        available &= ~same
+    return lines
+
+
+def _trendline_status(line_type: str, last_close: float, projected_now: float, tolerance_pct: float) -> str:
+    if line_type in ("Support Trendline", "Lower Channel"):
+        return "Holding" if last_close >= projected_now * (1 - tolerance_pct / 100) else "Broken"
+    return "Holding" if last_close <= projected_now * (1 + tolerance_pct / 100) else "Broken"
+
+
+@timed_stage
+def detect_trendlines(
+    df: pd.DataFrame,
+    pivot_highs: pd.DataFrame,
+    pivot_lows: pd.DataFrame,
+    tolerance_pct: float = 1.0,
+    max_lines: int = 1,
+    include_channels: bool = False,
+    max_anchors: int = TRENDLINE_MAX_ANCHORS,
+) -> list[Trendline]:
+    """
+    Up to max_lines support and resistance trendlines each, best first, so
+    the first line of a type is the one the confirmation engine reads. With
+    include_channels every line also gets the parallel through the furthest
+    opposite pivot since its start (an upper channel for a support line, a
+    lower channel for a resistance line).
+    """
+    if df.empty:
+        return []
+
+    last_idx = len(df) - 1
+    last_close = float(df["Close"].iloc[-1])
+    highs = _pivot_positions(df, pivot_highs)
+    lows = _pivot_positions(df, pivot_lows)
+
+    def _line(line_type: str, x0: float, y0: float, slope: float, touches: int) -> Trendline:
+        projected_now = y0 + slope * (last_idx - x0)
+        return Trendline(
+            line_type=line_type,
+            x0=df.index[int(x0)],
+            y0=float(y0),
+            x1=df.index[-1],
+            y1=float(projected_now),
+            slope_per_bar=float(slope),
+            touches=int(touches),
+            status=_trendline_status(line_type, last_close, projected_now, tolerance_pct),
+        )
+
+    trendlines: list[Trendline] = []
+    channels: list[Trendline] = []
+    for line_type, (x, y), channel_type, (ox, oy) in (
+        ("Support Trendline", lows, "Upper Channel", highs),
+        ("Resistance Trendline", highs, "Lower Channel", lows),
+    ):
+        for x0, y0, slope, touches in rank_trendlines(x, y, line_type, tolerance_pct, max_lines, max_anchors):
+            trendlines.append(_line(line_type, x0, y0, slope, touches))
+            if not include_channels:
+                continue
+
+            span = ox >= x0
+            if not span.any():
+                continue
+            offsets = oy[span] - (y0 + slope * (ox[span] - x0))
+            offset = offsets.max() if channel_type == "Upper Channel" else offsets.min()
+            projected = y0 + offset + slope * (ox[span] - x0)
+            channel_touches = int(_touches(oy[span], projected, tolerance_pct).sum())
+            channels.append(_line(channel_type, x0, y0 + offset, slope, channel_touches))
+
+    return trendlines + channels
+
+
+# ============================================================
+# TRADE CONFIRMATION
+# ============================================================
+@dataclass
+class MarketStructure:
+    structure: str
+    trend_bias: str
+    latest_swing_high: float | None
+    previous_swing_high: float | None
+    latest_swing_low: float | None
+    previous_swing_low: float | None
+    summary: str
+
+
+@dataclass
+class TradeConfirmation:
+    signal: str
+    confidence: int
+    buy_score: int
+    sell_score: int
+    quality: str
+    reasons: list[str]
+    breakout_confirmed: bool
+    breakdown_confirmed: bool
+    retest_buy_ready: bool
+    retest_sell_ready: bool
+
+
+@timed_stage
+def detect_market_structure(pivot_highs: pd.DataFrame, pivot_lows: pd.DataFrame) -> MarketStructure:
+    highs = pivot_highs.copy() if pivot_highs is not None else pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
+    lows = pivot_lows.copy() if pivot_lows is not None else pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
+
+    if "Date" not in highs.columns:
+        highs = pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
+    if "Date" not in lows.columns:
+        lows = pd.DataFrame(columns=EMPTY_PIVOT_COLUMNS)
+
+    highs = highs.sort_values("Date").copy()
+    lows = lows.sort_values("Date").copy()
+
+    latest_h = prev_h = latest_l = prev_l = None
+
+    if len(highs) >= 2:
+        prev_h = float(highs.iloc[-2]["Price"])
+        latest_h = float(highs.iloc[-1]["Price"])
+    if len(lows) >= 2:
+        prev_l = float(lows.iloc[-2]["Price"])
+        latest_l = float(lows.iloc[-1]["Price"])
+
+    if latest_h is not None and prev_h is not None and latest_l is not None and prev_l is not None:
+        hh = latest_h > prev_h
+        hl = latest_l > prev_l
+        lh = latest_h < prev_h
+        ll = latest_l < prev_l
+
+        if hh and hl:
+            return MarketStructure(
+                "Higher Highs / Higher Lows",
+                "Bullish",
+                latest_h,
+                prev_h,
+                latest_l,
+                prev_l,
+                "Price structure remains bullish with both the latest swing high and swing low above the previous ones.",
+            )
+        if lh and ll:
+            return MarketStructure(
+                "Lower Highs / Lower Lows",
+                "Bearish",
+                latest_h,
+                prev_h,
+                latest_l,
+                prev_l,
+                "Price structure remains bearish with both the latest swing high and swing low below the previous ones.",
+            )
+        if hh and ll:
+            return MarketStructure(
+                "Expansion / Volatile Mixed Structure",
+                "Neutral",
+                latest_h,
+                prev_h,
+                latest_l,
+                prev_l,
+                "The chart is making a higher high but also a lower low, which suggests expansion and unstable structure.",
+            )
+        if lh and hl:
+            return MarketStructure(
+                "Compression / Range Structure",
+                "Neutral",
+                latest_h,
+                prev_h,
+                latest_l,
+                prev_l,
+                "The chart is making a lower high and a higher low, which suggests compression or range behaviour.",
+            )
+
+    return MarketStructure(
+        "Insufficient swing structure",
+        "Neutral",
+        latest_h,
+        prev_h,
+        latest_l,
+        prev_l,
+        "There are not enough clear swing highs and swing lows yet to classify market structure confidently.",
+    )
+
+
+def nearest_zones(zones: list[Zone], current_price: float) -> tuple[Zone | None, Zone | None]:
+    supports = [z for z in zones if z.zone_type == "Support" and z.center <= current_price]
+    resistances = [z for z in zones if z.zone_type == "Resistance" and z.center >= current_price]
+
+    nearest_support = max(supports, key=lambda x: x.center) if supports else None
+    nearest_resistance = min(resistances, key=lambda x: x.center) if resistances else None
+    return nearest_support, nearest_resistance
+
+
+def get_trendline_status(trendlines: list[Trendline], line_type: str) -> Optional[str]:
+    for tl in trendlines:
+        if tl.line_type == line_type:
+            return tl.status
+    return None
+
+
+def get_projected_trendline_price(trendlines: list[Trendline], line_type: str) -> Optional[float]:
+    for tl in trendlines:
+        if tl.line_type == line_type:
+            return tl.y1
+    return None
+
+
+def detect_breakout_breakdown(
+    df: pd.DataFrame,
+    nearest_support: Zone | None,
+    nearest_resistance: Zone | None,
+    breakout_buffer_pct: float = 0.15,
+):
+    if len(df) < 2:
+        return False, False
+
+    latest = df.iloc[-1]
+    prev = df.iloc[-2]
+
+    breakout_confirmed = False
+    breakdown_confirmed = False
+
+    if nearest_resistance is not None:
+        res_level = nearest_resistance.upper
+        breakout_level = res_level * (1 + breakout_buffer_pct / 100)
+        breakout_confirmed = (
+            float(prev["Close"]) <= breakout_level and
+            float(latest["Close"]) > breakout_level and
+            float(latest["Close"]) > float(latest["Open"])
+        )
+
+    if nearest_support is not None:
+        sup_level = nearest_support.lower
+        breakdown_level = sup_level * (1 - breakout_buffer_pct / 100)
+        breakdown_confirmed = (
+            float(prev["Close"]) >= breakdown_level and
+            float(latest["Close"]) < breakdown_level and
+            float(latest["Close"]) < float(latest["Open"])
+        )
+
+    return breakout_confirmed, breakdown_confirmed
+
+
+def detect_retest_logic(
+    df: pd.DataFrame,
+    nearest_support: Zone | None,
+    nearest_resistance: Zone | None,
+    atr_multiplier: float = 0.35,
+):
+    if len(df) < 3:
+        return False, False
+
+    latest = df.iloc[-1]
+    latest_close = float(latest["Close"])
+    latest_low = float(latest["Low"])
+    latest_high = float(latest["High"])
+    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
+
+    retest_buy_ready = False
+    retest_sell_ready = False
+
+    if nearest_resistance is not None and pd.notna(atr):
+        resistance_test_zone = nearest_resistance.upper
+        if latest_close > resistance_test_zone and latest_low <= resistance_test_zone + atr * atr_multiplier:
+            retest_buy_ready = True
+
+    if nearest_support is not None and pd.notna(atr):
+        support_test_zone = nearest_support.lower
+        if latest_close < support_test_zone and latest_high >= support_test_zone - atr * atr_multiplier:
+            retest_sell_ready = True
+
+    return retest_buy_ready, retest_sell_ready
+
+
+@timed_stage
+def evaluate_trade_confirmation(
+    df: pd.DataFrame,
+    trendlines: list[Trendline],
+    market_structure: MarketStructure,
+    nearest_support: Zone | None,
+    nearest_resistance: Zone | None,
+    require_trendline_confirmation: bool = False,
+    use_retest_bonus: bool = True,
+    breakout_buffer_pct: float = 0.15,
+) -> TradeConfirmation:
+    latest = df.iloc[-1]
+
+    close_price = float(latest["Close"])
+    open_price = float(latest["Open"])
+    high_price = float(latest["High"])
+    low_price = float(latest["Low"])
+    volume = float(latest["Volume"])
+    avg_volume = float(latest["Vol_MA"]) if pd.notna(latest["Vol_MA"]) else np.nan
+    vol_ratio = float(latest["Vol_Ratio"]) if pd.notna(latest["Vol_Ratio"]) else np.nan
+    rsi = float(latest["RSI"]) if pd.notna(latest["RSI"]) else np.nan
+    macd = float(latest["MACD"]) if pd.notna(latest["MACD"]) else np.nan
+    macd_signal = float(latest["MACD_Signal"]) if pd.notna(latest["MACD_Signal"]) else np.nan
+    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
+    vwap = float(latest["VWAP"]) if pd.notna(latest["VWAP"]) else np.nan
+
+    support_status = get_trendline_status(trendlines, "Support Trendline")
+    resistance_status = get_trendline_status(trendlines, "Resistance Trendline")
+
+    breakout_confirmed, breakdown_confirmed = detect_breakout_breakdown(
+        df=df,
+        nearest_support=nearest_support,
+        nearest_resistance=nearest_resistance,
+        breakout_buffer_pct=breakout_buffer_pct,
+    )
+
+    retest_buy_ready, retest_sell_ready = detect_retest_logic(
+        df=df,
+        nearest_support=nearest_support,
+        nearest_resistance=nearest_resistance,
+    )
+
+    buy_score = 0
+    sell_score = 0
+    buy_reasons = []
+    sell_reasons = []
+
+    # VWAP
+    if pd.notna(vwap):
+        if close_price > vwap:
+            buy_score += 2
+            buy_reasons.append("Price is above VWAP")
+        elif close_price < vwap:
+            sell_score += 2
+            sell_reasons.append("Price is below VWAP")
+
+    # RSI
+    if pd.notna(rsi):
+        if 55 <= rsi <= 70:
+            buy_score += 1
+            buy_reasons.append("RSI is in bullish range")
+        elif 30 <= rsi <= 45:
+            sell_score += 1
+            sell_reasons.append("RSI is in bearish range")
+        elif rsi > 75:
+            sell_score += 1
+            sell_reasons.append("RSI is overbought")
+        elif rsi < 25:
+            buy_score += 1
+            buy_reasons.append("RSI is in oversold bounce zone")
+
+    # MACD
+    if pd.notna(macd) and pd.notna(macd_signal):
+        if macd > macd_signal:
+            buy_score += 2
+            buy_reasons.append("MACD is above signal line")
+        elif macd < macd_signal:
+            sell_score += 2
+            sell_reasons.append("MACD is below signal line")
+
+    # Volume
+    if pd.notna(vol_ratio):
+        if vol_ratio >= 1.2 and close_price > open_price:
+            buy_score += 1
+            buy_reasons.append("Bullish candle has above-average volume")
+        elif vol_ratio >= 1.2 and close_price < open_price:
+            sell_score += 1
+            sell_reasons.append("Bearish candle has above-average volume")
+
+    # Trendline
+    if support_status == "Holding":
+        buy_score += 2
+        buy_reasons.append("Support trendline is holding")
+    elif support_status == "Broken":
+        sell_score += 2
+        sell_reasons.append("Support trendline is broken")
+
+    if resistance_status == "Broken":
+        buy_score += 2
+        buy_reasons.append("Resistance trendline is broken")
+    elif resistance_status == "Holding":
+        sell_score += 2
+        sell_reasons.append("Resistance trendline is still holding")
+
+    # Market structure
+    if market_structure.trend_bias == "Bullish":
+        buy_score += 2
+        buy_reasons.append("Market structure is bullish")
+    elif market_structure.trend_bias == "Bearish":
+        sell_score += 2
+        sell_reasons.append("Market structure is bearish")
+
+    # Breakout / breakdown
+    if breakout_confirmed:
+        buy_score += 2
+        buy_reasons.append("Resistance breakout candle is confirmed")
+
+    if breakdown_confirmed:
+        sell_score += 2
+        sell_reasons.append("Support breakdown candle is confirmed")
+
+    # Retest logic
+    if use_retest_bonus and retest_buy_ready:
+        buy_score += 1
+        buy_reasons.append("Price is retesting breakout zone constructively")
+
+    if use_retest_bonus and retest_sell_ready:
+        sell_score += 1
+        sell_reasons.append("Price is retesting breakdown zone weakly")
+
+    # Zone distance filter
+    if nearest_resistance is not None:
+        upside_room_pct = ((nearest_resistance.center - close_price) / close_price) * 100
+        if 0 <= upside_room_pct <= 0.4:
+            buy_score -= 1
+            buy_reasons.append("Upside room is limited due to nearby resistance")
+
+    if nearest_support is not None:
+        downside_room_pct = ((close_price - nearest_support.center) / close_price) * 100
+        if 0 <= downside_room_pct <= 0.4:
+            sell_score -= 1
+            sell_reasons.append("Downside room is limited due to nearby support")
+
+    # ATR chop filter
+    if pd.notna(atr) and close_price > 0:
+        atr_pct = (atr / close_price) * 100
+        if atr_pct < 0.35:
+            buy_score -= 1
+            sell_score -= 1
+
+    if require_trendline_confirmation:
+        if support_status is None and resistance_status is None:
+            buy_score -= 1
+            sell_score -= 1
+
+    # Final signal
+    reasons = []
+    signal = "Hold / Neutral"
+    confidence = 50
+    quality = "Low"
+
+    if buy_score >= 10 and buy_score > sell_score:
+        signal = "Strong Buy"
+        confidence = min(95, 55 + buy_score * 4)
+        quality = "High"
+        reasons = buy_reasons
+    elif buy_score >= 7 and buy_score > sell_score:
+        signal = "Buy"
+        confidence = min(90, 48 + buy_score * 4)
+        quality = "Medium" if buy_score < 9 else "High"
+        reasons = buy_reasons
+    elif sell_score >= 10 and sell_score > buy_score:
+        signal = "Strong Sell"
+        confidence = min(95, 55 + sell_score * 4)
+        quality = "High"
+        reasons = sell_reasons
+    elif sell_score >= 7 and sell_score > buy_score:
+        signal = "Sell"
+        confidence = min(90, 48 + sell_score * 4)
+        quality = "Medium" if sell_score < 9 else "High"
+        reasons = sell_reasons
+    else:
+        signal = "Hold / Neutral"
+        confidence = 50
+        quality = "Low"
+        reasons = ["No strong multi-indicator confirmation"]
+
+    return TradeConfirmation(
+        signal=signal,
+        confidence=int(confidence),
+        buy_score=int(buy_score),
+        sell_score=int(sell_score),
+        quality=quality,
+        reasons=reasons,
+        breakout_confirmed=breakout_confirmed,
+        breakdown_confirmed=breakdown_confirmed,
+        retest_buy_ready=retest_buy_ready,
+        retest_sell_ready=retest_sell_ready,
+    )
+
+
+def get_trade_levels(trade_confirmation: TradeConfirmation, df: pd.DataFrame):
+    latest = df.iloc[-1]
+
+    close_price = float(latest["Close"])
+    high_price = float(latest["High"])
+    low_price = float(latest["Low"])
+    atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else np.nan
+
+    if pd.isna(atr) or atr <= 0:
+        return None
+
+    signal = trade_confirmation.signal
+
+    if signal in ["Buy", "Strong Buy"]:
+        entry = close_price
+        safe_entry = high_price + (0.2 * atr)
+        stop_loss = entry - (1.5 * atr)
+        target_1 = entry + (1.5 * atr)
+        target_2 = entry + (2.5 * atr)
+
+        return {
+            "side": "BUY",
+            "entry": round(entry, 2),
+            "safe_entry": round(safe_entry, 2),
+            "stop_loss": round(stop_loss, 2),
+            "target_1": round(target_1, 2),
+            "target_2": round(target_2, 2),
+        }
+
+    elif signal in ["Sell", "Strong Sell"]:
+        entry = close_price
+        safe_entry = low_price - (0.2 * atr)
+        stop_loss = entry + (1.5 * atr)
+        target_1 = entry - (1.5 * atr)
+        target_2 = entry - (2.5 * atr)
+
+        return {
+            "side": "SELL",
+            "entry": round(entry, 2),
+            "safe_entry": round(safe_entry, 2),
+            "stop_loss": round(stop_loss, 2),
+            "target_1": round(target_1, 2),
+            "target_2": round(target_2, 2),
+        }
+
+    return None
+
+
+# ============================================================
+# BACKTEST
+# ============================================================
+BACKTEST_TRADE_COLUMNS = [
+    "Entry Time",
+    "Exit Time",
+    "Side",
+    "Signal",
+    "Entry",
+    "Stop Loss",
+    "Target 1",
+    "Target 2",
+    "Exit Price",
+    "Bars Held",
+    "Outcome",
+    "Return %",
+    "R Multiple",
+]
+
+
+@dataclass
+class BacktestResult:
+    signals: pd.DataFrame
+    trades: pd.DataFrame
+    summary: dict
+
+
+def _confirmation_scores(
+    bars: dict,
+    support: np.ndarray,
+    support_band: np.ndarray,
+    resistance: np.ndarray,
+    resistance_band: np.ndarray,
+    support_line: np.ndarray,
+    resistance_line: np.ndarray,
+    bullish: np.ndarray,
+    bearish: np.ndarray,
+    can_retest: np.ndarray,
+    trendline_tolerance_pct: float,
+    require_trendline_confirmation: bool,
+    use_retest_bonus: bool,
+    breakout_buffer_pct: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    evaluate_trade_confirmation's buy and sell scores, element by element.
+    bars holds Close, Open, High, Low, Previous_Close, VWAP, RSI, MACD,
+    MACD_Signal, Vol_Ratio and ATR arrays; support / resistance are nearest
+    zone centres with their half-widths and the *_line arrays trendline
+    projections, NaN where there is none.
+    """
+    close, open_, high, low = bars["Close"], bars["Open"], bars["High"], bars["Low"]
+    rsi, atr = bars["RSI"], bars["ATR"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        has_support_line = ~np.isnan(support_line)
+        has_resistance_line = ~np.isnan(resistance_line)
+        support_holding = close >= support_line * (1 - trendline_tolerance_pct / 100)
+        resistance_holding = close <= resistance_line * (1 + trendline_tolerance_pct / 100)
+
+        previous_close = bars["Previous_Close"]
+        breakout_level = (resistance + resistance_band) * (1 + breakout_buffer_pct / 100)
+        breakdown_level = (support - support_band) * (1 - breakout_buffer_pct / 100)
+        breakout = (previous_close <= breakout_level) & (close > breakout_level) & (close > open_)
+        breakdown = (previous_close >= breakdown_level) & (close < breakdown_level) & (close < open_)
+
+        retest_buy = can_retest & (close > resistance + resistance_band) & (low <= resistance + resistance_band + atr * 0.35)
+        retest_sell = can_retest & (close < support - support_band) & (high >= support - support_band - atr * 0.35)
+
+        upside_room = (resistance - close) / close * 100
+        downside_room = (close - support) / close * 100
+        choppy = (close > 0) & (atr / close * 100 < 0.35)
+        high_volume = bars["Vol_Ratio"] >= 1.2
+
+        buy_score = (
+            2 * (close > bars["VWAP"])
+            + ((55 <= rsi) & (rsi <= 70) | (rsi < 25))
+            + 2 * (bars["MACD"] > bars["MACD_Signal"])
+            + (high_volume & (close > open_))
+            + 2 * (has_support_line & support_holding)
+            + 2 * (has_resistance_line & ~resistance_holding)
+            + 2 * bullish
+            + 2 * breakout
+            + (use_retest_bonus & retest_buy)
+            - ((0 <= upside_room) & (upside_room <= 0.4))
+            - choppy
+        ).astype(np.int64)
+        sell_score = (
+            2 * (close < bars["VWAP"])
+            + ((30 <= rsi) & (rsi <= 45) | (rsi > 75))
+            + 2 * (bars["MACD"] < bars["MACD_Signal"])
+            + (high_volume & (close < open_))
+            + 2 * (has_support_line & ~support_holding)
+            + 2 * (has_resistance_line & resistance_holding)
+            + 2 * bearish
+            + 2 * breakdown
+            + (use_retest_bonus & retest_sell)
+            - ((0 <= downside_room) & (downside_room <= 0.4))
+            - choppy
+        ).astype(np.int64)
+
+    if require_trendline_confirmation:
+        unconfirmed = ~has_support_line & ~has_resistance_line
+        buy_score -= unconfirmed
+        sell_score -= unconfirmed
+    return buy_score, sell_score
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """round(x, 2) element-wise; np.round scales by 100 first and can land on the other side of a half."""
+    return np.array([round(value, 2) for value in values.tolist()], dtype=np.float64)
+
+
+def _signal_labels(buy_score: np.ndarray, sell_score: np.ndarray) -> np.ndarray:
+    return np.select(
+        [
+            (buy_score >= 10) & (buy_score > sell_score),
+            (buy_score >= 7) & (buy_score > sell_score),
+            (sell_score >= 10) & (sell_score > buy_score),
+            (sell_score >= 7) & (sell_score > buy_score),
+        ],
+        ["Strong Buy", "Buy", "Strong Sell", "Sell"],
+        default="Hold / Neutral",
+    )
+
+
+def _trade_direction(signal: np.ndarray, atr: np.ndarray) -> np.ndarray:
+    """+1 / -1 where get_trade_levels would return BUY / SELL levels, else 0."""
+    tradable = ~np.isnan(atr) & (atr > 0)
+    return np.select(
+        [tradable & np.isin(signal, ["Buy", "Strong Buy"]), tradable & np.isin(signal, ["Sell", "Strong Sell"])],
+        [1, -1],
+        default=0,
+    )
+
+
+def _zone_centres(prices: np.ndarray, band: float, min_touches: int) -> np.ndarray:
+    """Ascending centres of the zones cluster_levels would build from these pivot prices."""
+    ordered = np.sort(prices, kind="stable")
+    bounds = _cluster_bounds(ordered, band) if len(ordered) else np.zeros(1, dtype=np.int64)
+    kept = np.flatnonzero(np.diff(bounds) >= min_touches)
+    return np.array([np.mean(ordered[bounds[j]: bounds[j + 1]]) for j in kept], dtype=np.float64)
+
+
+def _nearest_centre(centres: np.ndarray, prices: np.ndarray, zone_type: str) -> np.ndarray:
+    """nearest_zones for every price: the highest support centre at or below it, or the lowest resistance centre at or above it."""
+    if len(centres) == 0:
+        return np.full(np.shape(prices), NAN)
+    if zone_type == "Support":
+        pick = np.searchsorted(centres, prices, side="right") - 1
+        found = pick >= 0
+    else:
+        pick = np.searchsorted(centres, prices, side="left")
+        found = pick < len(centres)
+    return np.where(found, centres[np.clip(pick, 0, len(centres) - 1)], NAN)
+
+
+@dataclass
+class ZoneWalk:
+    center: np.ndarray
+    members: np.ndarray
+    first: np.ndarray
+    end: np.ndarray
+    redo: np.ndarray
+
+
+def _walk_nearest_zones(
+    close: np.ndarray,
+    band: np.ndarray,
+    tolerance: np.ndarray,
+    steps,
+    zone_type: str,
+    min_touches: int,
+) -> ZoneWalk:
+    """
+    _cluster_bounds followed by nearest_zones for many groups at once (the
+    bars of one series, or the symbols of a panel), each against its own
+    close and band. steps yields (step, groups, prices): the step-th pivot in
+    ascending price order, the groups that see it and its price for each;
+    a group must see its pivots in ascending price.
+
+    Per group the result holds the running-mean centre of the nearest zone,
+    its member count and the steps [first, end) it spans (the centre is NaN
+    where there is no zone), and whether a pivot landed within rounding
+    distance of a band edge or a zone centre within rounding distance of the
+    close, in which case the caller should redo that group exactly.
+    """
+    size = len(close)
+    ids = np.arange(size)
+    walk = ZoneWalk(
+        center=np.full(size, NAN),
+        members=np.zeros(size, dtype=np.int64),
+        first=np.zeros(size, dtype=np.int64),
+        end=np.zeros(size, dtype=np.int64),
+        redo=np.zeros(size, dtype=bool),
+    )
+    total = np.zeros(size)
+    count = np.zeros(size, dtype=np.int64)
+    first = np.zeros(size, dtype=np.int64)
+
+    def settle(groups: np.ndarray, end: int) -> None:
+        # The open cluster of these groups closes before step `end`.
+        centre = total[groups] / count[groups]
+        price = close[groups]
+        kept = count[groups] >= min_touches
+        walk.redo[groups] |= kept & (np.abs(centre - price) <= 1e-9 * np.abs(price))
+        if zone_type == "Support":
+            take = kept & (centre <= price)
+        else:
+            take = kept & (centre >= price) & (walk.members[groups] == 0)
+        groups = groups[take]
+        walk.center[groups] = centre[take]
+        walk.members[groups] = count[groups]
+        walk.first[groups] = first[groups]
+        walk.end[groups] = end
+
+    last_step = 0
+    for step, groups, price in steps:
+        running, seen = total[groups], count[groups]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            distance = np.abs(price - running / seen)
+        open_ = seen > 0
+        walk.redo[groups] |= open_ & (np.abs(distance - band[groups]) <= tolerance[groups])
+        joins = open_ & (distance <= band[groups])
+        settle(ids[groups][open_ & ~joins], step)
+        total[groups] = np.where(joins, running + price, price)
+        first[groups] = np.where(joins, first[groups], step)
+        count[groups] = np.where(joins, seen + 1, 1)
+        last_step = step + 1
+    settle(np.flatnonzero(count > 0), last_step)
+    return walk
+
+
+def _zone_levels(
+    close: np.ndarray,
+    positions: np.ndarray,
+    prices: np.ndarray,
+    zone_type: str,
+    right_bars: int,
+    zone_width_pct: float,
+    min_touches: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per bar: centre and half-width of the zone nearest_zones would pick from
+    cluster_levels on the candles up to that bar (NaN where there is none).
+
+    Every bar is one group of _walk_nearest_zones: pivots are walked in
+    ascending price and each is seen by the bars that have confirmed it.
+    Flagged bars are redone one at a time through _zone_centres.
+    """
+    n = len(close)
+    band = close * zone_width_pct / 100.0
+    if len(prices) == 0:
+        return np.full(n, NAN), np.full(n, NAN)
+
+    order = np.argsort(prices, kind="stable")
+    ordered = prices[order]
+    known_from = (positions + right_bars)[order]
+    tolerance = 1e-9 * (float(np.abs(prices).max()) + band)
+    steps = (
+        (s, slice(int(known_from[s]), n), ordered[s])
+        for s in range(len(ordered))
+        if known_from[s] < n
+    )
+    walk = _walk_nearest_zones(close, band, tolerance, steps, zone_type, min_touches)
+    center = walk.center
+
+    # np.mean sums pairwise from eight values on, which can differ from the
+    # running total in the last bit; those centres are taken from the members.
+    known_count = np.searchsorted(np.sort(known_from), np.arange(n), side="right")
+    means: dict[tuple[int, int, int], float] = {}
+    for t in np.flatnonzero(walk.members >= 8):
+        key = (int(walk.first[t]), int(walk.end[t]), int(known_count[t]))
+        if key not in means:
+            members = slice(key[0], key[1])
+            means[key] = float(np.mean(ordered[members][known_from[members] <= t]))
+        center[t] = means[key]
+
+    confirmed = positions + right_bars
+    for t in np.flatnonzero(walk.redo):
+        centres = _zone_centres(prices[confirmed <= t], band[t], min_touches)
+        center[t] = _nearest_centre(centres, close[t: t + 1], zone_type)[0]
+
+    center[~(band > 0)] = NAN
+    return center, np.where(np.isnan(center), NAN, band)
+
+
+def _trendline_levels(
+    positions: np.ndarray,
+    prices: np.ndarray,
+    n: int,
+    line_type: str,
+    right_bars: int,
+    tolerance_pct: float,
+    max_anchors: int,
+) -> np.ndarray:
+    """
+    Per bar: the projection of the line rank_trendlines would rank first on
+    the pivots confirmed by that bar (NaN where there is none).
+
+    Candidates are kept from one confirmation to the next instead of being
+    re-ranked from scratch: candidate (j, d) runs from pivot j - d to pivot
+    j, and each new pivot adds the lines ending on it and updates the touches
+    and validity of the lines still inside the max_anchors window, with the
+    same arithmetic as rank_trendlines.
+    """
+    projected = np.full(n, NAN)
+    count = len(positions)
+    width = max_anchors
+    if count < 2 or width < 2:
+        return projected
+
+    x = positions.astype(np.float64)
+    y = prices
+    support = line_type == "Support Trendline"
+    touches = np.zeros((count, width), dtype=np.int64)
+    valid = np.zeros((count, width), dtype=bool)
+    x0 = np.zeros((count, width))
+    y0 = np.zeros((count, width))
+    slope = np.zeros((count, width))
+    starts = positions + right_bars
+    ends = np.append(starts[1:], n)
+
+    def deviation(x0, y0, line_slope, at_x, at_y):
+        line = np.subtract(at_x, x0)
+        line *= line_slope
+        line += y0
+        gap = np.subtract(at_y, line)
+        np.abs(line, out=line)
+        np.maximum(line, 1e-9, out=line)
+        gap /= line
+        gap *= 100
+        return gap
+
+    def broken(gap):
+        return gap < -tolerance_pct if support else gap > tolerance_pct
+
+    for k in range(count):
+        lo = max(0, k - width + 1)
+        if lo > 0:
+            # Pivot lo - 1 left the window, and with it the lines starting there.
+            rows = np.arange(lo, k)
+            valid[rows, rows - lo + 1] = False
+
+        # Pivot k against the lines that end before it.
+        if k > lo:
+            rows = slice(lo, k)
+            gap = deviation(x0[rows], y0[rows], slope[rows], x[k], y[k])
+            touches[rows] += np.abs(gap) <= tolerance_pct
+            valid[rows] &= ~broken(gap)
+
+        # Lines from every earlier pivot in the window to pivot k, checked
+        # against the pivots from their first anchor on.
+        first = np.arange(k - 1, lo - 1, -1)
+        if len(first):
+            dy = y[k] - y[first]
+            rise = dy / (x[k] - x[first])
+            window = np.arange(lo, k + 1)
+            gap = deviation(x[first][:, None], y[first][:, None], rise[:, None], x[window][None, :], y[window][None, :])
+            gap[window[None, :] < first[:, None]] = np.nan
+            span = slice(1, len(first) + 1)
+            touches[k, span] = (np.abs(gap) <= tolerance_pct).sum(axis=1)
+            valid[k, span] = ((dy > 0) if support else (dy < 0)) & ~broken(gap).any(axis=1)
+            x0[k, span], y0[k, span], slope[k, span] = x[first], y[first], rise
+
+        live = valid[lo: k + 1]
+        if not live.any():
+            continue
+        # Most touches, then the latest second anchor, then the earliest first.
+        score = np.where(live, touches[lo: k + 1], -1)
+        best = score == score.max()
+        row = lo + int(np.flatnonzero(best.any(axis=1))[-1])
+        col = int(np.flatnonzero(best[row - lo])[-1])
+        bars = np.arange(starts[k], ends[k])
+        projected[bars] = y0[row, col] + slope[row, col] * (bars - x0[row, col])
+
+    return projected
+
+
+def _swing_bias(positions: np.ndarray, prices: np.ndarray, right_bars: int, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Per bar: the latest confirmed swing price and the one before it (NaN until there are two)."""
+    known = np.searchsorted(positions + right_bars, np.arange(n), side="right")
+    padded = np.r_[NAN, NAN, prices]
+    return padded[known + 1], padded[known]
+
+
+def _first_hit(mask: np.ndarray, start: int = 0) -> int:
+    """Index of the first True at or after start, or len(mask)."""
+    hits = np.flatnonzero(mask[start:])
+    return start + int(hits[0]) if len(hits) else len(mask)
+
+
+def _simulate_trades(
+    index: pd.Index,
+    signal: np.ndarray,
+    direction: np.ndarray,
+    entry: np.ndarray,
+    stop: np.ndarray,
+    target_1: np.ndarray,
+    target_2: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    max_hold_bars: Optional[int],
+) -> pd.DataFrame:
+    """
+    One position at a time, entered at the close of a signal bar. Half is
+    booked at target_1 and half at target_2; whatever is open exits at
+    stop_loss, or at the close once max_hold_bars have passed. When one bar
+    reaches both the stop and a target the stop is assumed to come first.
+    """
+    n = len(close)
+    rows = []
+    free_from = 0
+    for i in np.flatnonzero(direction != 0):
+        if i < free_from or i >= n - 1:
+            continue
+
+        last = n - 1 if max_hold_bars is None else min(n - 1, i + max_hold_bars)
+        ahead_high, ahead_low = high[i + 1: last + 1], low[i + 1: last + 1]
+        if direction[i] > 0:
+            stopped, first_hit, second_hit = ahead_low <= stop[i], ahead_high >= target_1[i], ahead_high >= target_2[i]
+        else:
+            stopped, first_hit, second_hit = ahead_high >= stop[i], ahead_low <= target_1[i], ahead_low <= target_2[i]
+
+        span = len(stopped)
+        stop_at = _first_hit(stopped)
+        target_at = _first_hit(first_hit)
+        if stop_at < span and stop_at <= target_at:
+            legs = [(1.0, stop[i])]
+            exit_at, outcome = stop_at, "Stop Loss"
+        elif target_at < span:
+            second_at = _first_hit(second_hit, target_at)
+            stop_at = _first_hit(stopped, target_at + 1)
+            if second_at < stop_at:
+                legs = [(0.5, target_1[i]), (0.5, target_2[i])]
+                exit_at, outcome = second_at, "Target 2"
+            elif stop_at < span:
+                legs = [(0.5, target_1[i]), (0.5, stop[i])]
+                exit_at, outcome = stop_at, "Target 1 + Stop"
+            else:
+                legs = [(0.5, target_1[i]), (0.5, close[last])]
+                exit_at, outcome = span - 1, "Target 1 + Time Exit"
+        else:
+            legs = [(1.0, close[last])]
+            exit_at, outcome = span - 1, "Time Exit"
+
+        exit_bar = i + 1 + exit_at
+        exit_price = sum(weight * price for weight, price in legs)
+        points = (exit_price - entry[i]) * direction[i]
+        rows.append(
+            {
+                "Entry Time": index[i],
+                "Exit Time": index[exit_bar],
+                "Side": "BUY" if direction[i] > 0 else "SELL",
+                "Signal": signal[i],
+                "Entry": entry[i],
+                "Stop Loss": stop[i],
+                "Target 1": target_1[i],
+                "Target 2": target_2[i],
+                "Exit Price": exit_price,
+                "Bars Held": exit_bar - i,
+                "Outcome": outcome,
+                "Return %": points / entry[i] * 100,
+                "R Multiple": points / abs(entry[i] - stop[i]),
+            }
+        )
+        free_from = exit_bar + 1
+
+    return pd.DataFrame(rows, columns=BACKTEST_TRADE_COLUMNS)
+
+
+def summarize_trades(trades: pd.DataFrame, signal_bars: int = 0) -> dict:
+    returns = trades["Return %"].to_numpy(dtype=np.float64)
+    equity = np.cumprod(np.r_[1.0, 1 + returns / 100])
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    return {
+        "signal_bars": int(signal_bars),
+        "trades": len(trades),
+        "hit_rate": float(trades["Outcome"].str.startswith("Target").mean() * 100) if len(trades) else NAN,
+        "win_rate": float((returns > 0).mean() * 100) if len(trades) else NAN,
+        "expectancy_pct": float(returns.mean()) if len(trades) else NAN,
+        "expectancy_r": float(trades["R Multiple"].mean()) if len(trades) else NAN,
+        "total_return_pct": float((equity[-1] - 1) * 100),
+        "max_drawdown_pct": float(drawdown.max() * 100),
+        "avg_bars_held": float(trades["Bars Held"].mean()) if len(trades) else NAN,
+    }
+
+
+@timed_stage
+def backtest_trade_confirmation(
+    df: pd.DataFrame,
+    left_bars: int = 3,
+    right_bars: int = 3,
+    zone_width_pct: float = 0.8,
+    min_touches: int = 2,
+    trendline_tolerance_pct: float = 1.0,
+    require_trendline_confirmation: bool = False,
+    use_retest_bonus: bool = True,
+    breakout_buffer_pct: float = 0.15,
+    max_anchors: int = TRENDLINE_MAX_ANCHORS,
+    max_hold_bars: Optional[int] = 50,
+    warmup_bars: int = 0,
+) -> BacktestResult:
+    """
+    evaluate_trade_confirmation and get_trade_levels at every bar of an
+    indicator frame, as arrays, followed by a trade simulation on the
+    resulting signals.
+
+    Bar t gets the signal run_analysis_pipeline reports on the candles up to
+    and including t: the indicators are causal, a pivot counts from the bar
+    that confirms it (right_bars later), zones are clustered on every
+    confirmed pivot with the band sized on bar t's close, and trendlines are
+    ranked over the last max_anchors confirmed pivots, as detect_trendlines
+    does. The score terms are the same as in evaluate_trade_confirmation.
+    Signals before warmup_bars are scored but not traded.
+    """
+    n = len(df)
+    close = df["Close"].to_numpy(dtype=np.float64)
+    high = df["High"].to_numpy(dtype=np.float64)
+    low = df["Low"].to_numpy(dtype=np.float64)
+    atr = df["ATR"].to_numpy(dtype=np.float64)
+
+    pivot_highs, pivot_lows = find_pivots(df, left_bars=left_bars, right_bars=right_bars)
+    high_positions = df.index.get_indexer(pd.DatetimeIndex(pivot_highs["Date"]))
+    low_positions = df.index.get_indexer(pd.DatetimeIndex(pivot_lows["Date"]))
+    high_prices = pivot_highs["Price"].to_numpy(dtype=np.float64)
+    low_prices = pivot_lows["Price"].to_numpy(dtype=np.float64)
+
+    zone_params = (right_bars, zone_width_pct, min_touches)
+    support, support_band = _zone_levels(close, low_positions, low_prices, "Support", *zone_params)
+    resistance, resistance_band = _zone_levels(close, high_positions, high_prices, "Resistance", *zone_params)
+    line_params = (right_bars, trendline_tolerance_pct, max_anchors)
+    support_line = _trendline_levels(low_positions, low_prices, n, "Support Trendline", *line_params)
+    resistance_line = _trendline_levels(high_positions, high_prices, n, "Resistance Trendline", *line_params)
+
+    latest_high, previous_high = _swing_bias(high_positions, high_prices, right_bars, n)
+    latest_low, previous_low = _swing_bias(low_positions, low_prices, right_bars, n)
+
+    bars = {
+        "Close": close,
+        "Open": df["Open"].to_numpy(dtype=np.float64),
+        "High": high,
+        "Low": low,
+        "Previous_Close": np.r_[NAN, close[:-1]],
+        "ATR": atr,
+    }
+    for column in ("VWAP", "RSI", "MACD", "MACD_Signal", "Vol_Ratio"):
+        bars[column] = df[column].to_numpy(dtype=np.float64)
+
+    buy_score, sell_score = _confirmation_scores(
+        bars,
+        support=support,
+        support_band=support_band,
+        resistance=resistance,
+        resistance_band=resistance_band,
+        support_line=support_line,
+        resistance_line=resistance_line,
+        bullish=(latest_high > previous_high) & (latest_low > previous_low),
+        bearish=(latest_high < previous_high) & (latest_low < previous_low),
+        can_retest=np.arange(n) >= 2,
+        trendline_tolerance_pct=trendline_tolerance_pct,
+        require_trendline_confirmation=require_trendline_confirmation,
+        use_retest_bonus=use_retest_bonus,
+        breakout_buffer_pct=breakout_buffer_pct,
+    )
+    signal = _signal_labels(buy_score, sell_score)
+    direction = _trade_direction(signal, atr)
+    entry = _round2(close)
+    stop = _round2(close - direction * 1.5 * atr)
+    target_1 = _round2(close + direction * 1.5 * atr)
+    target_2 = _round2(close + direction * 2.5 * atr)
+
+    signals = pd.DataFrame(
+        {
+            "Buy_Score": buy_score,
+            "Sell_Score": sell_score,
+            "Signal": signal,
+            "Side": np.select([direction > 0, direction < 0], ["BUY", "SELL"], default=""),
+            "Stop_Loss": np.where(direction != 0, stop, NAN),
+            "Target_1": np.where(direction != 0, target_1, NAN),
+            "Target_2": np.where(direction != 0, target_2, NAN),
+            "Support": support,
+            "Resistance": resistance,
+        },
+        index=df.index,
+    )
+    traded = direction.copy()
+    traded[:warmup_bars] = 0
+    trades = _simulate_trades(
+        df.index, signal, traded, entry, stop, target_1, target_2, high, low, close, max_hold_bars
+    )
+    return BacktestResult(signals=signals, trades=trades, summary=summarize_trades(trades, int((traded != 0).sum())))
+
+
+# ============================================================
+# CROSS-SECTIONAL SCORING
+# ============================================================
+PANEL_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+@dataclass
+class CandlePanel:
+    symbols: list[str]
+    candles: dict[str, np.ndarray]
+    lengths: np.ndarray
+    last_times: pd.Series
+
+
+@timed_stage
+def build_candle_panel(frames: dict[str, pd.DataFrame], max_bars: Optional[int] = None) -> CandlePanel:
+    """
+    Stack per-symbol candle frames into bars x symbols arrays aligned on
+    each symbol's own latest candle: row -1 is every symbol's last bar, row
+    -2 the one before, and so on. Shorter histories are NaN above their
+    first candle, so no symbol's series gets gaps from another's calendar.
+    """
+    symbols = [symbol for symbol, frame in frames.items() if frame is not None and not frame.empty]
+    lengths = np.array([len(frames[symbol]) for symbol in symbols], dtype=np.int64)
+    if max_bars is not None:
+        lengths = np.minimum(lengths, max_bars)
+    rows = int(lengths.max()) if len(lengths) else 0
+
+    candles = {column: np.full((rows, len(symbols)), NAN) for column in PANEL_COLUMNS}
+    for j, symbol in enumerate(symbols):
+        frame = frames[symbol].iloc[-int(lengths[j]):]
+        for column in PANEL_COLUMNS:
+            candles[column][rows - lengths[j]:, j] = frame[column].to_numpy(dtype=np.float64)
+
+    last_times = pd.Series([frames[symbol].index[-1] for symbol in symbols], index=symbols, dtype=object)
+    return CandlePanel(symbols=symbols, candles=candles, lengths=lengths, last_times=last_times)
+
+
+def _panel_pivots(
+    values: np.ndarray, first_rows: np.ndarray, left_bars: int, right_bars: int, ufunc
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    find_pivots on every column at once: (symbol, row) of each pivot, by
+    symbol and then time. A pivot needs left_bars of the symbol's own
+    candles before it, as it would in the symbol's frame.
+    """
+    width = left_bars + right_bars + 1
+    if len(values) < width:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    centre = values[left_bars: len(values) - right_bars]
+    is_pivot = centre == rolling_extreme(values, width, ufunc)
+    is_pivot &= np.arange(len(centre))[:, None] >= first_rows[None, :]
+    symbol, row = np.nonzero(is_pivot.T)
+    return symbol, row + left_bars
+
+
+def _last_two(values: np.ndarray, symbol: np.ndarray, row: np.ndarray, count: int) -> tuple[np.ndarray, np.ndarray]:
+    """Per symbol: the latest pivot price and the one before it (NaN when missing)."""
+    prices = values[row, symbol]
+    ends = np.searchsorted(symbol, np.arange(count), side="right")
+    starts = np.searchsorted(symbol, np.arange(count), side="left")
+    padded = np.r_[NAN, prices]
+    latest = np.where(ends - starts >= 1, padded[ends], NAN)
+    previous = np.where(ends - starts >= 2, padded[np.maximum(ends - 1, 0)], NAN)
+    return latest, previous
+
+
+def _panel_zones(
+    prices: np.ndarray,
+    symbol: np.ndarray,
+    close: np.ndarray,
+    zone_type: str,
+    zone_width_pct: float,
+    min_touches: int,
+) -> np.ndarray:
+    """
+    Per symbol: the centre of the zone nearest_zones would pick from
+    cluster_levels on that symbol's pivots. Every symbol is one group of
+    _walk_nearest_zones, fed its k-th lowest pivot at step k; flagged
+    symbols are redone through _zone_centres.
+    """
+    count = len(close)
+    band = close * zone_width_pct / 100.0
+    order = np.lexsort((prices, symbol))
+    ordered = prices[order]
+    starts = np.searchsorted(symbol, np.arange(count), side="left")
+    sizes = np.searchsorted(symbol, np.arange(count), side="right") - starts
+    largest = np.zeros(count)
+    if len(prices):
+        np.maximum.at(largest, symbol, np.abs(prices))
+    tolerance = 1e-9 * (largest + band)
+
+    def steps():
+        for k in range(int(sizes.max(initial=0))):
+            groups = np.flatnonzero(sizes > k)
+            yield k, groups, ordered[starts[groups] + k]
+
+    walk = _walk_nearest_zones(close, band, tolerance, steps(), zone_type, min_touches)
+    center = walk.center
+
+    # As in _zone_levels: np.mean sums eight or more values pairwise. A
+    # symbol's last cluster ends at its own pivot count, not the walk's.
+    ends = np.minimum(walk.end, sizes)
+    for j in np.flatnonzero(walk.members >= 8):
+        center[j] = float(np.mean(ordered[starts[j] + walk.first[j]: starts[j] + ends[j]]))
+    for j in np.flatnonzero(walk.redo):
+        own = prices[starts[j]: starts[j] + sizes[j]]
+        center[j] = _nearest_centre(_zone_centres(own, band[j], min_touches), close[j], zone_type)
+
+    center[~(band > 0)] = NAN
+    return center
+
+
+def _panel_trendlines(
+    x: np.ndarray,
+    prices: np.ndarray,
+    symbol: np.ndarray,
+    line_type: str,
+    at_x: float,
+    count: int,
+    tolerance_pct: float,
+    max_anchors: int = TRENDLINE_MAX_ANCHORS,
+    max_elements: int = 2_000_000,
+) -> np.ndarray:
+    """
+    Per symbol: the projection at at_x of the line rank_trendlines would
+    rank first on that symbol's pivots (x, prices, by symbol and then
+    time), NaN where there is none. Symbols with the same number of anchors
+    are ranked together as dense symbols x candidates x pivots blocks of at
+    most max_elements, with the same arithmetic as rank_trendlines.
+    """
+    projected = np.full(count, NAN)
+    ends = np.searchsorted(symbol, np.arange(count), side="right")
+    sizes = np.minimum(ends - np.searchsorted(symbol, np.arange(count), side="left"), max_anchors)
+    support = line_type == "Support Trendline"
+
+    for size in np.unique(sizes[sizes >= 2]):
+        first, second = np.triu_indices(size, k=1)
+        group = np.flatnonzero(sizes == size)
+        chunk = max(1, max_elements // (len(first) * size))
+        for lo in range(0, len(group), chunk):
+            symbols = group[lo: lo + chunk]
+            take = ends[symbols][:, None] - size + np.arange(size)[None, :]
+            px, py = x[take], prices[take]
+
+            x0, y0 = px[:, first], py[:, first]
+            dx = px[:, second] - x0
+            dy = py[:, second] - y0
+            keep = (dx > 0) & ((dy > 0) if support else (dy < 0))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                slope = dy / dx
+            line = np.subtract(px[:, None, :], x0[:, :, None])
+            line *= slope[:, :, None]
+            line += y0[:, :, None]
+            deviation = np.subtract(py[:, None, :], line)
+            np.abs(line, out=line)
+            np.maximum(line, 1e-9, out=line)
+            deviation /= line
+            deviation *= 100
+            deviation[px[:, None, :] < x0[:, :, None]] = np.nan
+
+            touches = (np.abs(deviation) <= tolerance_pct).sum(axis=2)
+            if support:
+                valid = keep & ~(deviation < -tolerance_pct).any(axis=2)
+            else:
+                valid = keep & ~(deviation > tolerance_pct).any(axis=2)
+
+            # Most touches, then the latest second anchor, then the earliest first.
+            score = np.where(valid, touches, -1)
+            best = score == score.max(axis=1, keepdims=True)
+            latest = np.where(best, px[:, second], -np.inf)
+            best &= latest == latest.max(axis=1, keepdims=True)
+            pick = np.argmin(np.where(best, x0, np.inf), axis=1)
+
+            rows = np.arange(len(symbols))
+            found = valid.any(axis=1)
+            x0, y0, slope = x0[rows, pick], y0[rows, pick], slope[rows, pick]
+            projected[symbols[found]] = (y0 + slope * (at_x - x0))[found]
+    return projected
+
+
+@timed_stage
+def score_candle_panel(
+    panel: CandlePanel,
+    volume_ma_window: int = 20,
+    left_bars: int = 3,
+    right_bars: int = 3,
+    zone_width_pct: float = 0.8,
+    min_touches: int = 2,
+    trendline_tolerance_pct: float = 1.0,
+    require_trendline_confirmation: bool = False,
+    use_retest_bonus: bool = True,
+    breakout_buffer_pct: float = 0.15,
+) -> pd.DataFrame:
+    """
+    evaluate_trade_confirmation and get_trade_levels for the latest candle
+    of every symbol in the panel, one row per symbol. Indicators, pivots,
+    zones, trendlines and the score terms are all array operations across
+    symbols; the remaining loops run over pivot ranks and pivot counts, not
+    symbols. Results equal the per-symbol functions run on each symbol's
+    frame.
+    """
+    count = len(panel.symbols)
+    rows = len(panel.candles["Close"])
+    frames = {column: pd.DataFrame(panel.candles[column]) for column in PANEL_COLUMNS}
+    indicators = compute_indicators(frames, volume_ma_window)
+    first_rows = rows - panel.lengths
+
+    def last(values) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        return values[-1] if rows else np.empty(0)
+
+    close = last(panel.candles["Close"])
+    bars = {column: last(panel.candles[column]) for column in ("Open", "High", "Low", "Close")}
+    bars["Previous_Close"] = panel.candles["Close"][-2] if rows >= 2 else np.full(count, NAN)
+    for column in ("VWAP", "RSI", "MACD", "MACD_Signal", "Vol_Ratio", "ATR"):
+        bars[column] = last(indicators[column])
+
+    high_symbol, high_row = _panel_pivots(panel.candles["High"], first_rows, left_bars, right_bars, np.fmax)
+    low_symbol, low_row = _panel_pivots(panel.candles["Low"], first_rows, left_bars, right_bars, np.fmin)
+    latest_high, previous_high = _last_two(panel.candles["High"], high_symbol, high_row, count)
+    latest_low, previous_low = _last_two(panel.candles["Low"], low_symbol, low_row, count)
+    bullish = (latest_high > previous_high) & (latest_low > previous_low)
+    bearish = (latest_high < previous_high) & (latest_low < previous_low)
+
+    low_prices = panel.candles["Low"][low_row, low_symbol]
+    high_prices = panel.candles["High"][high_row, high_symbol]
+    support = _panel_zones(low_prices, low_symbol, close, "Support", zone_width_pct, min_touches)
+    resistance = _panel_zones(high_prices, high_symbol, close, "Resistance", zone_width_pct, min_touches)
+    line_params = (rows - 1, count, trendline_tolerance_pct)
+    support_line = _panel_trendlines(low_row.astype(np.float64), low_prices, low_symbol, "Support Trendline", *line_params)
+    resistance_line = _panel_trendlines(
+        high_row.astype(np.float64), high_prices, high_symbol, "Resistance Trendline", *line_params
+    )
+    band = close * zone_width_pct / 100.0
+
+    buy_score, sell_score = _confirmation_scores(
+        bars,
+        support=support,
+        support_band=np.where(np.isnan(support), NAN, band),
+        resistance=resistance,
+        resistance_band=np.where(np.isnan(resistance), NAN, band),
+        support_line=support_line,
+        resistance_line=resistance_line,
+        bullish=bullish,
+        bearish=bearish,
+        can_retest=panel.lengths >= 3,
+        trendline_tolerance_pct=trendline_tolerance_pct,
+        require_trendline_confirmation=require_trendline_confirmation,
+        use_retest_bonus=use_retest_bonus,
+        breakout_buffer_pct=breakout_buffer_pct,
+    )
+    signal = _signal_labels(buy_score, sell_score)
+    strong = np.isin(signal, ["Strong Buy", "Strong Sell"])
+    leading = np.where(np.isin(signal, ["Buy", "Strong Buy"]), buy_score, sell_score)
+    confidence = np.select(
+        [strong, np.isin(signal, ["Buy", "Sell"])],
+        [np.minimum(95, 55 + leading * 4), np.minimum(90, 48 + leading * 4)],
+        default=50,
+    )
+    quality = np.select(
+        [strong, np.isin(signal, ["Buy", "Sell"]) & (leading >= 9), np.isin(signal, ["Buy", "Sell"])],
+        ["High", "High", "Medium"],
+        default="Low",
+    )
+
+    atr = bars["ATR"]
+    direction = _trade_direction(signal, atr)
+    traded = direction != 0
+    safe_entry = np.where(direction > 0, bars["High"] + 0.2 * atr, bars["Low"] - 0.2 * atr)
+
+    def levels(values: np.ndarray) -> np.ndarray:
+        return np.where(traded, _round2(np.where(traded, values, NAN)), NAN)
+
+    return pd.DataFrame(
+        {
+            "Last_Time": panel.last_times.to_numpy(),
+            "Close": close,
+            "Buy_Score": buy_score,
+            "Sell_Score": sell_score,
+            "Signal": signal,
+            "Confidence": confidence.astype(np.int64),
+            "Quality": quality,
+            "Trend_Bias": np.select([bullish, bearish], ["Bullish", "Bearish"], default="Neutral"),
+            "Nearest_Support": support,
+            "Nearest_Resistance": resistance,
+            "RSI": bars["RSI"],
+            "Vol_Ratio": bars["Vol_Ratio"],
+            "ATR": atr,
+            "Side": np.select([direction > 0, direction < 0], ["BUY", "SELL"], default=""),
+            "Entry": levels(close),
+            "Safe_Entry": levels(safe_entry),
+            "Stop_Loss": levels(close - direction * 1.5 * atr),
+            "Target_1": levels(close + direction * 1.5 * atr),
+            "Target_2": levels(close + direction * 2.5 * atr),
+        },
+        index=pd.Index(panel.symbols, name="Symbol"),
+    )
+
+
+# ============================================================
+# UNIVERSE SCAN
+# ============================================================
+def universe_symbols(instruments_df: pd.DataFrame, universe: str) -> list[str]:
+    """Trading symbols of every NSE equity ("NSE_EQ") or of those with NSE futures ("NSE F&O")."""
+    index = get_instrument_index(instruments_df)
+    symbols = index.symbols[index.mode_rows("Equity", "NSE")]
+
+    if universe == "NSE F&O":
+        futures = index.mode_rows("Futures", "NSE")
+        if "underlying_symbol" not in instruments_df.columns:
+            return []
+        underlying = instruments_df["underlying_symbol"].astype(object).fillna("").astype(str).str.upper()
+        symbols = symbols[np.isin(symbols, underlying.to_numpy(dtype=object)[futures])]
+    elif universe != "NSE_EQ":
+        raise ValueError(f"Unknown scan universe: {universe}")
+
+    return sorted({symbol for symbol in symbols if symbol})
+
+
+def _load_universe_series(
+    access_token: str,
+    instrument_key: str,
+    interval: str,
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+    store: CandleStore | None,
+    include_live: bool,
+    live_quote: pd.DataFrame | None,
+) -> pd.DataFrame:
+    parts = [load_cached_history(access_token, instrument_key, interval, from_date, to_date, store)]
+    if live_quote is not None:
+        parts.append(live_quote)
+    elif include_live and interval in INTRADAY_INTERVALS:
+        try:
+            parts.append(fetch_intraday_v3(access_token, instrument_key, interval))
+        except Exception:
+            pass
+
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame()
+
+    df = pd.concat(parts)
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def scan_universe(
+    access_token: str,
+    instrument_keys: dict[str, Optional[str]],
+    period: str,
+    interval: str,
+    analysis_params: dict,
+    store: CandleStore | None = None,
+    include_live: bool = True,
+    fetch_workers: int = UNIVERSE_FETCH_WORKERS,
+    chunk_size: int = UNIVERSE_SCORE_CHUNK,
+) -> Iterator[tuple[int, pd.DataFrame]]:
+    """
+    Scan {symbol: instrument_key} and yield (symbols_done, rows) as results
+    come in; rows are score_candle_panel rows indexed by symbol, with an
+    "Error" column for symbols that could not be scored.
+
+    Completed sessions come from the candle store, which is asked only for
+    what it has not stored yet; a rescan on the same day requests only the
+    current session, which is never stored. With include_live the current
+    session also comes from the live endpoints, batched quotes for daily
+    candles. Fetches run on
+    fetch_workers threads and every chunk_size fetched symbols are scored as
+    one panel on a separate thread while the remaining fetches continue.
+    """
+    to_date = now_ist().normalize()
+    from_date = period_to_from_date(period, to_date)
+
+    missing = [symbol for symbol, key in instrument_keys.items() if key is None]
+    if missing:
+        yield len(missing), pd.DataFrame({"Error": "Not Found"}, index=pd.Index(missing, name="Symbol"))
+    done = len(missing)
+
+    live_quotes = {}
+    keys = [key for key in instrument_keys.values() if key is not None]
+    if include_live and interval == "1d" and keys:
+        try:
+            live_quotes = fetch_live_ohlc_batch_v3(access_token, keys, interval)
+        except Exception:
+            live_quotes = {}
+
+    fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="universe-fetch")
+    score_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="universe-score")
+    scoring = {}
+
+    def _score(frames: dict[str, pd.DataFrame]) -> pd.DataFrame:
+        return score_candle_panel(build_candle_panel(frames), **analysis_params)
+
+    def _drain(block: bool) -> Iterator[tuple[int, pd.DataFrame]]:
+        nonlocal done
+        finished = list(scoring) if block else [f for f in scoring if f.done()]
+        for future in finished:
+            count = scoring.pop(future)
+            done += count
+            yield done, future.result()
+
+    try:
+        fetches = {
+            submit_traced(
+                fetch_pool,
+                symbol,
+                _load_universe_series,
+                access_token,
+                key,
+                interval,
+                from_date,
+                to_date,
+                store,
+                include_live,
+                live_quotes.get(key, pd.DataFrame()) if interval == "1d" and include_live else None,
+            ): symbol
+            for symbol, key in instrument_keys.items()
+            if key is not None
+        }
+
+        fetched: dict[str, pd.DataFrame] = {}
+        for position, future in enumerate(as_completed(fetches), start=1):
+            symbol = fetches[future]
+            try:
+                frame = future.result()
+            except Exception as e:
+                done += 1
+                yield done, pd.DataFrame({"Error": str(e)}, index=pd.Index([symbol], name="Symbol"))
+                frame = None
+            if frame is not None:
+                if frame.empty:
+                    done += 1
+                    yield done, pd.DataFrame({"Error": "No Data"}, index=pd.Index([symbol], name="Symbol"))
+                else:
+                    fetched[symbol] = frame
+
+            if fetched and (len(fetched) >= chunk_size or position == len(fetches)):
+                scoring[submit_traced(score_pool, f"{len(fetched)} symbols", _score, fetched)] = len(fetched)
+                fetched = {}
+            yield from _drain(block=False)
+
+        yield from _drain(block=True)
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        score_pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ============================================================
+# MULTI-TIMEFRAME
+# ============================================================
+def finest_interval(intervals) -> str:
+    return min(intervals, key=MULTI_TIMEFRAME_INTERVALS.index)
+
+
+@timed_stage
+def resample_candles(df: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """
+    Aggregate finer candles into `interval` candles aligned the way Upstox
+    aligns its own: intraday buckets count from the 09:15 IST session open,
+    daily buckets are IST calendar days. df must be sorted by time.
+    """
+    if df.empty:
+        return df.copy()
+
+    buckets = session_bucket_starts(df.index.as_unit("ns").asi8, interval)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(df)] - 1
+
+    columns = {
+        "Open": df["Open"].to_numpy(dtype=np.float64)[starts],
+        "High": np.fmax.reduceat(df["High"].to_numpy(dtype=np.float64), starts),
+        "Low": np.fmin.reduceat(df["Low"].to_numpy(dtype=np.float64), starts),
+        "Close": df["Close"].to_numpy(dtype=np.float64)[ends],
+        "Volume": np.add.reduceat(np.nan_to_num(df["Volume"].to_numpy(dtype=np.float64)), starts),
+    }
+    if "Open Interest" in df.columns:
+        columns["Open Interest"] = df["Open Interest"].to_numpy(dtype=np.float64)[ends]
+
+    index = pd.DatetimeIndex(buckets[starts].astype("datetime64[ns]")).tz_localize("UTC").tz_convert(INDIA_TZ)
+    return pd.DataFrame(columns, index=index.rename(df.index.name))
+
+
+# ============================================================
+# ANALYSIS PIPELINE CACHE
+# ============================================================
+def frame_fingerprint(df: pd.DataFrame, instrument_key: str, interval: Optional[str]) -> tuple:
+    """
+    Cheap identity of a candle series: which instrument and interval it is,
+    how many rows it has and where it starts and ends. The last candle's
+    values are part of it so a revised live candle counts as new data.
+    """
+    if df is None or df.empty:
+        return (instrument_key, interval, 0)
+    last = df[["Open", "High", "Low", "Close", "Volume"]].iloc[-1].to_numpy(dtype=np.float64)
+    return (instrument_key, interval, len(df), df.index[0], df.index[-1], tuple(last.tolist()))
+
+
+def estimate_nbytes(value) -> int:
+    """Rough in-memory size of a cached stage result."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=False))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items())
+    if is_dataclass(value) and not isinstance(value, type):
+        return sys.getsizeof(value) + sum(estimate_nbytes(getattr(value, f.name)) for f in fields(value))
+    return sys.getsizeof(value)
+
+
+class PipelineCache:
+    """
+    LRU memo for analysis stages, keyed by (stage, fingerprint, parameters
+    the stage depends on). Once the estimated size of the entries passes
+    max_bytes the least recently used ones are dropped. Cached values are
+    shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int = PIPELINE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple, tuple[object, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], T]) -> T:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Computed outside the lock so one slow stage does not block other
+        # sessions; two threads missing the same key may both compute it.
+        value = compute()
+        size = estimate_nbytes(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_PIPELINE_CACHE: PipelineCache | None = None
+_PIPELINE_CACHE_LOCK = threading.Lock()
+
+
+def get_pipeline_cache() -> PipelineCache:
+    global _PIPELINE_CACHE
+    if _PIPELINE_CACHE is None:
+        with _PIPELINE_CACHE_LOCK:
+            if _PIPELINE_CACHE is None:
+                _PIPELINE_CACHE = PipelineCache()
+    return _PIPELINE_CACHE
+
+
+# ============================================================
+# ANALYSIS HELPERS
+# ============================================================
+@timed_stage
+def summarize_volume(df: pd.DataFrame) -> dict:
+    latest = df.iloc[-1]
+    recent = df.tail(min(10, len(df))).copy()
+
+    vol_ratio = float(latest["Vol_Ratio"]) if pd.notna(latest["Vol_Ratio"]) else np.nan
+    price_change = float(latest["Price_Change_%"]) if pd.notna(latest["Price_Change_%"]) else 0.0
+
+    if pd.isna(vol_ratio):
+        latest_signal = "Not enough data"
+    elif vol_ratio >= 2.0:
+        latest_signal = "Very high volume spike"
+    elif vol_ratio >= 1.5:
+        latest_signal = "High volume"
+    elif vol_ratio >= 1.1:
+        latest_signal = "Slightly above average volume"
+    elif vol_ratio >= 0.8:
+        latest_signal = "Normal volume"
+    else:
+        latest_signal = "Below-average volume"
+
+    avg_recent_vol_ratio = float(recent["Vol_Ratio"].replace([np.inf, -np.inf], np.nan).dropna().mean()) if len(recent) else np.nan
+    recent_up_days = recent[recent["Close"] > recent["Open"]]
+    recent_down_days = recent[recent["Close"] < recent["Open"]]
+
+    up_vol = float(recent_up_days["Volume"].mean()) if not recent_up_days.empty else np.nan
+    down_vol = float(recent_down_days["Volume"].mean()) if not recent_down_days.empty else np.nan
+
+    if not np.isnan(up_vol) and not np.isnan(down_vol):
+        if up_vol > down_vol * 1.15:
+            pressure = "Buying pressure is stronger than selling pressure"
+        elif down_vol > up_vol * 1.15:
+            pressure = "Selling pressure is stronger than buying pressure"
+        else:
+            pressure = "Buying and selling pressure look balanced"
+    else:
+        pressure = "Not enough directional candles to compare buying vs selling pressure"
+
+    if price_change > 0 and vol_ratio >= 1.2:
+        conviction = "Price rose with volume support"
+    elif price_change > 0 and vol_ratio < 1.0:
+        conviction = "Price rose, but volume confirmation is weak"
+    elif price_change < 0 and vol_ratio >= 1.2:
+        conviction = "Price fell with strong participation"
+    elif price_change < 0 and vol_ratio < 1.0:
+        conviction = "Price fell on lighter participation"
+    else:
+        conviction = "Price and volume are neutral"
+
+    return {
+        "latest_signal": latest_signal,
+        "pressure": pressure,
+        "conviction": conviction,
+        "latest_vol_ratio": vol_ratio,
+        "avg_recent_vol_ratio": avg_recent_vol_ratio,
+    }
+
+
+def zones_to_dataframe(zones: list[Zone], current_price: float) -> pd.DataFrame:
+    if not zones:
+        return pd.DataFrame(columns=["Type", "Zone Range", "Center", "Touches", "Distance %", "Last Touch"])
+
+    rows = []
+    for z in zones:
+        distance_pct = ((z.center - current_price) / current_price) * 100 if current_price else np.nan
+        rows.append(
+            {
+                "Type": z.zone_type,
+                "Zone Range": f"{z.lower:,.2f} - {z.upper:,.2f}",
+                "Center": round(z.center, 2),
+                "Touches": z.touches,
+                "Distance %": round(distance_pct, 2),
+                "Last Touch": format_indian_date(z.last_touch),
+            }
+        )
+
+    out = pd.DataFrame(rows)
+    return out.sort_values(["Type", "Center"], ascending=[True, True]).reset_index(drop=True)
+
+
+def get_volatility_label(price: float, atr: float) -> str:
+    if pd.isna(price) or pd.isna(atr):
+        return "N/A"
+
+    if price <= 500:
+        if atr < 1.5:
+            return "Low Volatility"
+        elif atr < 3:
+            return "Medium Volatility"
+        else:
+            return "High Volatility"
+
+    elif price <= 1500:
+        if atr < 5:
+            return "Low Volatility"
+        elif atr < 15:
+            return "Medium Volatility"
+        else:
+            return "High Volatility"
+
+    else:
+        if atr < 10:
+            return "Low Volatility"
+        elif atr < 30:
+            return "Medium Volatility"
+        else:
+            return "High Volatility"
+
+
+# ============================================================
+# VOLUME STRENGTH LABEL
+# ============================================================
+def get_volume_strength_label(vol_ratio):
+
+    if pd.isna(vol_ratio):
+        return ""
+
+    if vol_ratio < 0.5:
+        return "Very weak participation"
+
+    elif vol_ratio < 1.0:
+        return "Below average volume"
+
+    elif vol_ratio < 1.5:
+        return "Good volume support"
+
+    elif vol_ratio < 2.0:
+        return "Strong participation"
+
+    else:
+        return "Major volume spike"
+
+# ============================================================
+# ANALYSIS PIPELINE
+# ============================================================
+def run_analysis_pipeline(
+    raw: pd.DataFrame,
+    series_id: tuple,
+    volume_ma_window: int,
+    left_bars: int,
+    right_bars: int,
+    zone_width_pct: float,
+    min_touches: int,
+    trendline_tolerance_pct: float,
+    require_trendline_confirmation: bool,
+    use_retest_bonus: bool,
+    breakout_buffer_pct: float,
+    max_trendlines: int = 1,
+    include_channels: bool = False,
+    indicator_source=None,
+    run_backtest: bool = False,
+    backtest_max_hold_bars: int = 50,
+) -> dict:
+    """
+    Indicators -> pivots -> zones / trendlines / structure -> confirmation.
+
+    Each stage is memoized on the series fingerprint (series_id is the
+    (instrument_key, interval) pair) plus only the parameters it reads, so a
+    widget change reruns just the stages downstream of it. indicator_source
+    optionally replaces the batch indicator computation, e.g. with an
+    IndicatorEngine while streaming. With run_backtest the confirmation is
+    also replayed over every bar ("backtest" key, otherwise None).
+    """
+    cache = get_pipeline_cache()
+    fingerprint = frame_fingerprint(raw, *series_id)
+    pivot_key = (fingerprint, left_bars, right_bars)
+
+    df = cache.get_or_compute(
+        ("indicators", fingerprint, volume_ma_window),
+        indicator_source or (lambda: compute_indicator_frame(raw, volume_ma_window)),
+    )
+    pivot_highs, pivot_lows = cache.get_or_compute(
+        ("pivots",) + pivot_key,
+        lambda: find_pivots(df, left_bars=left_bars, right_bars=right_bars),
+    )
+
+    current_price = float(df["Close"].iloc[-1])
+
+    support_zones, resistance_zones = cache.get_or_compute(
+        ("zones",) + pivot_key + (zone_width_pct, min_touches),
+        lambda: (
+            cluster_levels(
+                pivots=pivot_lows,
+                current_price=current_price,
+                zone_width_pct=zone_width_pct,
+                zone_type="Support",
+                min_touches=min_touches,
+            ),
+            cluster_levels(
+                pivots=pivot_highs,
+                current_price=current_price,
+                zone_width_pct=zone_width_pct,
+                zone_type="Resistance",
+                min_touches=min_touches,
+            ),
+        ),
+    )
+    all_zones = support_zones + resistance_zones
+    nearest_support, nearest_resistance = nearest_zones(all_zones, current_price)
+
+    trendlines = cache.get_or_compute(
+        ("trendlines",) + pivot_key + (trendline_tolerance_pct, max_trendlines, include_channels),
+        lambda: detect_trendlines(
+            df=df,
+            pivot_highs=pivot_highs,
+            pivot_lows=pivot_lows,
+            tolerance_pct=trendline_tolerance_pct,
+            max_lines=max_trendlines,
+            include_channels=include_channels,
+        ),
+    )
+    market_structure = cache.get_or_compute(
+        ("structure",) + pivot_key,
+        lambda: detect_market_structure(pivot_highs=pivot_highs, pivot_lows=pivot_lows),
+    )
+    vol_summary = cache.get_or_compute(
+        ("volume", fingerprint, volume_ma_window),
+        lambda: summarize_volume(df),
+    )
+
+    def _confirm():
+        trade_confirmation = evaluate_trade_confirmation(
+            df=df,
+            trendlines=trendlines,
+            market_structure=market_structure,
+            nearest_support=nearest_support,
+            nearest_resistance=nearest_resistance,
+            require_trendline_confirmation=require_trendline_confirmation,
+            use_retest_bonus=use_retest_bonus,
+            breakout_buffer_pct=breakout_buffer_pct,
+        )
+        return trade_confirmation, get_trade_levels(trade_confirmation, df)
+
+    # The confirmation only reads the best line of each type, which does not
+    # depend on how many lines or channels are drawn.
+    trade_confirmation, trade_levels = cache.get_or_compute(
+        ("confirmation",) + pivot_key + (
+            volume_ma_window,
+            zone_width_pct,
+            min_touches,
+            trendline_tolerance_pct,
+            require_trendline_confirmation,
+            use_retest_bonus,
+            breakout_buffer_pct,
+        ),
+        _confirm,
+    )
+
+    backtest = None
+    if run_backtest:
+        backtest = cache.get_or_compute(
+            ("backtest",) + pivot_key + (
+                volume_ma_window,
+                zone_width_pct,
+                min_touches,
+                trendline_tolerance_pct,
+                require_trendline_confirmation,
+                use_retest_bonus,
+                breakout_buffer_pct,
+                backtest_max_hold_bars,
+            ),
+            lambda: backtest_trade_confirmation(
+                df,
+                left_bars=left_bars,
+                right_bars=right_bars,
+                zone_width_pct=zone_width_pct,
+                min_touches=min_touches,
+                trendline_tolerance_pct=trendline_tolerance_pct,
+                require_trendline_confirmation=require_trendline_confirmation,
+                use_retest_bonus=use_retest_bonus,
+                breakout_buffer_pct=breakout_buffer_pct,
+                max_hold_bars=backtest_max_hold_bars,
+            ),
+        )
+
+    return {
+        "df": df,
+        "pivot_highs": pivot_highs,
+        "pivot_lows": pivot_lows,
+        "current_price": current_price,
+        "support_zones": support_zones,
+        "resistance_zones": resistance_zones,
+        "all_zones": all_zones,
+        "nearest_support": nearest_support,
+        "nearest_resistance": nearest_resistance,
+        "trendlines": trendlines,
+        "market_structure": market_structure,
+        "vol_summary": vol_summary,
+        "trade_confirmation": trade_confirmation,
+        "trade_levels": trade_levels,
+        "backtest": backtest,
+    }
+
+
+# ============================================================
+# WATCHLIST RESCAN CACHE
+# ============================================================
+def last_session_close(now: pd.Timestamp) -> pd.Timestamp:
+    """The latest weekday 15:30 IST close at or before now."""
+    close = now.normalize() + pd.Timedelta(hours=15, minutes=30)
+    if close > now:
+        close -= pd.Timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= pd.Timedelta(days=1)
+    return close
+
+
+def candles_unchanged_since(scanned_at: pd.Timestamp) -> bool:
+    """
+    True when no candle can have changed since scanned_at: it is the same
+    IST day (the lookback window moves with the date), the market is closed
+    and the last session closed before scanned_at.
+    """
+    now = now_ist()
+    return (
+        scanned_at.normalize() == now.normalize()
+        and not is_market_hours_india()
+        and last_session_close(now) < scanned_at
+    )
+
+
+@dataclass
+class RescanEntry:
+    fingerprint: tuple
+    live_mark: Optional[tuple]
+    result: dict
+    scanned_at: pd.Timestamp
+
+
+class WatchlistRescanCache:
+    """
+    The last scanner row of each (symbol, instrument, scan settings), with
+    the frame_fingerprint of the candles it came from, the fingerprint of
+    the live quote candle seen then, and when it was scanned. Lets
+    scan_watchlist_concurrently skip symbols whose candles cannot have
+    changed (market closed since) or did not (same quote candle, or same
+    fetched candles).
+    """
+
+    def __init__(self, max_entries: int = WATCHLIST_RESCAN_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.reused = 0
+        self.analyzed = 0
+        self._entries: OrderedDict[tuple, RescanEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[RescanEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def reuse(self, key: tuple, live_mark: Optional[tuple]) -> dict:
+        """Mark the entry as current as of now and return a copy of its row."""
+        with self._lock:
+            entry = self._entries[key]
+            entry.scanned_at = now_ist()
+            if live_mark is not None:
+                entry.live_mark = live_mark
+            self.reused += 1
+            return dict(entry.result)
+
+    def put(self, key: tuple, fingerprint: tuple, live_mark: Optional[tuple], result: dict) -> None:
+        with self._lock:
+            self._entries[key] = RescanEntry(fingerprint, live_mark, dict(result), now_ist())
+            self._entries.move_to_end(key)
+            self.analyzed += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "reused": self.reused, "analyzed": self.analyzed}
+
+
+# ============================================================
+# WATCHLIST ANALYSIS FUNCTION
+# ============================================================
+def analyze_symbol_data(
+    symbol,
+    raw,
+    volume_ma_window,
+    left_bars,
+    right_bars,
+    zone_width_pct,
+    min_touches,
+    trendline_tolerance_pct,
+    require_trendline_confirmation,
+    use_retest_bonus,
+    breakout_buffer_pct,
+    series_id=None,
+):
+    try:
+
+        analysis = run_analysis_pipeline(
+            raw=raw,
+            series_id=series_id or (symbol, None),
+            volume_ma_window=volume_ma_window,
+            left_bars=left_bars,
+            right_bars=right_bars,
+            zone_width_pct=zone_width_pct,
+            min_touches=min_touches,
+            trendline_tolerance_pct=trendline_tolerance_pct,
+            require_trendline_confirmation=require_trendline_confirmation,
+            use_retest_bonus=use_retest_bonus,
+            breakout_buffer_pct=breakout_buffer_pct,
+        )
+
+        current_price = analysis["current_price"]
+        nearest_support = analysis["nearest_support"]
+        nearest_resistance = analysis["nearest_resistance"]
+        market_structure = analysis["market_structure"]
+        vol_summary = analysis["vol_summary"]
+        trade_confirmation = analysis["trade_confirmation"]
+        trade_levels = analysis["trade_levels"]
+
+        return {
+            "Stock": symbol,
+            "Current Price": round(current_price, 2),
+
+            "Nearest Support":
+                round(nearest_support.center, 2)
+                if nearest_support else None,
+
+            "Nearest Resistance":
+                round(nearest_resistance.center, 2)
+                if nearest_resistance else None,
+
+            "Volume vs MA":
+                (
+                    f"{vol_summary['latest_vol_ratio']:.2f} "
+                    f"({get_volume_strength_label(vol_summary['latest_vol_ratio'])})"
+                )
+                if pd.notna(vol_summary["latest_vol_ratio"])
+                else "",
+
+            "Structure": market_structure.trend_bias,
+
+            "Signal": trade_confirmation.signal,
+
+            "Confidence": trade_confirmation.confidence,
+
+            "Buy Score": trade_confirmation.buy_score,
+
+            "Sell Score": trade_confirmation.sell_score,
+
+            "Recommended Action":
+                trade_levels["side"]
+                if trade_levels
+                else "HOLD",
+
+            "Buy Price":
+                trade_levels["entry"]
+                if trade_levels and trade_levels["side"] == "BUY"
+                else None,
+
+            "Safe Buy Above":
+                trade_levels["safe_entry"]
+                if trade_levels and trade_levels["side"] == "BUY"
+                else None,
+
+            "Stop Loss":
+                trade_levels["stop_loss"]
+                if trade_levels
+                else None,
+
+            "Target 1":
+                trade_levels["target_1"]
+                if trade_levels
+                else None,
+        }
+
+    except Exception as e:
+        return {
+            "Stock": symbol,
+            "Recommended Action": "Error",
+            "Error": str(e),
+        }
+
+
+def analyze_timeframes(
+    instrument_key: str,
+    base: pd.DataFrame,
+    base_interval: str,
+    timeframes: list[str],
+    analysis_params: dict,
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """Resample one fetched series into every timeframe and analyze each, finest first."""
+    frames = {}
+    rows = []
+    for timeframe in sorted(set(timeframes) | {base_interval}, key=MULTI_TIMEFRAME_INTERVALS.index):
+        frame = base if timeframe == base_interval else resample_candles(base, timeframe)
+        frames[timeframe] = frame
+        if timeframe not in timeframes:
+            continue
+
+        result = analyze_symbol_data(
+            symbol=timeframe,
+            raw=frame,
+            series_id=(instrument_key, timeframe),
+            **analysis_params,
+        )
+        result["Timeframe"] = result.pop("Stock")
+        result["Bars"] = len(frame)
+        rows.append(result)
+
+    columns = [
+        "Timeframe",
+        "Bars",
+        "Structure",
+        "Signal",
+        "Confidence",
+        "Nearest Support",
+        "Nearest Resistance",
+        "Volume vs MA",
+        "Recommended Action",
+        "Stop Loss",
+        "Target 1",
+    ]
+    confluence = pd.DataFrame(rows).reindex(columns=columns)
+    return frames, confluence
+
+
+def analyze_single_symbol(
+    access_token,
+    symbol,
+    instruments_df,
+    period,
+    interval,
+    lookup_exchange,
+    volume_ma_window,
+    left_bars,
+    right_bars,
+    zone_width_pct,
+    min_touches,
+    trendline_tolerance_pct,
+    include_live,
+    require_trendline_confirmation,
+    use_retest_bonus,
+    breakout_buffer_pct,
+    candle_store=None,
+):
+    try:
+
+        instrument_key = resolve_instrument_keys(
+            instruments_df,
+            [symbol],
+            mode="Equity",
+            exchange=lookup_exchange,
+        )[symbol]
+
+        if instrument_key is None:
+            return {
+                "Stock": symbol,
+                "Recommended Action": "Not Found",
+            }
+
+        raw = load_upstox_data(
+            access_token=access_token,
+            instrument_key=instrument_key,
+            period=period,
+            interval=interval,
+            include_live=include_live,
+            store=candle_store,
+        )
+
+        if raw.empty:
+            return {
+                "Stock": symbol,
+                "Recommended Action": "No Data",
+            }
+
+        return analyze_symbol_data(
+            symbol=symbol,
+            raw=raw,
+            series_id=(instrument_key, interval),
+            volume_ma_window=volume_ma_window,
+            left_bars=left_bars,
+            right_bars=right_bars,
+            zone_width_pct=zone_width_pct,
+            min_touches=min_touches,
+            trendline_tolerance_pct=trendline_tolerance_pct,
+            require_trendline_confirmation=require_trendline_confirmation,
+            use_retest_bonus=use_retest_bonus,
+            breakout_buffer_pct=breakout_buffer_pct,
+        )
+
+    except Exception as e:
+        return {
+            "Stock": symbol,
+            "Recommended Action": "Error",
+            "Error": str(e),
+        }
+
+
+def scan_watchlist_concurrently(
+    access_token,
+    symbols,
+    instruments_df,
+    period,
+    interval,
+    lookup_exchange,
+    analysis_params,
+    include_live,
+    candle_store=None,
+    fetch_workers=8,
+    analysis_workers=4,
+    rescan_cache: WatchlistRescanCache | None = None,
+):
+    """
+    Run the watchlist scan as a two-stage pipeline and yield
+    (position, result) pairs as soon as each symbol finishes.
+
+    Network fetches overlap on a bounded thread pool (the shared Upstox
+    client applies the API rate limit across all of them) and each fetched
+    frame is handed to a separate analysis pool, so slow downloads never
+    block the CPU stage and vice versa.
+
+    With a rescan_cache, a symbol scanned before with the same settings is
+    not fetched again if the market has not been open since, or if its live
+    quote candle (one batched request, for intervals the quote endpoint
+    serves) is the one seen last time; a symbol whose fetched candles have
+    the same fingerprint as last time is not analyzed again.
+    """
+    fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="scan-fetch")
+    analysis_pool = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix="scan-analysis")
+    pending = {}
+    settings = (period, interval, include_live, tuple(sorted(analysis_params.items())))
+    scan_day = now_ist().normalize()
+    rescan_keys = {}
+    live_marks = {}
+    fingerprints = {}
+
+    try:
+        instrument_keys = resolve_instrument_keys(
+            instruments_df,
+            symbols,
+            mode="Equity",
+            exchange=lookup_exchange,
+        )
+
+        # Daily live candles for the whole watchlist come from one batched quote call;
+        # with a rescan cache, current candles of other quoted intervals flag changed symbols.
+        live_quotes = None
+        quote_changes = rescan_cache is not None and ohlc_quote_interval(interval) is not None
+        if include_live and (interval == "1d" or quote_changes) and is_market_hours_india():
+            try:
+                live_quotes = fetch_live_ohlc_batch_v3(
+                    access_token,
+                    [k for k in instrument_keys.values() if k is not None],
+                    interval,
+                )
+            except Exception:
+                live_quotes = None
+
+        for position, symbol in enumerate(symbols):
+            instrument_key = instrument_keys[symbol]
+            if instrument_key is None:
+                yield position, {"Stock": symbol, "Recommended Action": "Not Found"}
+                continue
+
+            live_quote = live_quotes.get(instrument_key, pd.DataFrame()) if live_quotes is not None else None
+            if rescan_cache is not None:
+                rescan_keys[position] = (symbol, instrument_key) + settings
+                live_marks[position] = (
+                    frame_fingerprint(live_quote, instrument_key, interval)
+                    if live_quote is not None and not live_quote.empty
+                    else None
+                )
+                entry = rescan_cache.get(rescan_keys[position])
+                if entry is not None and (
+                    candles_unchanged_since(entry.scanned_at)
+                    or (
+                        live_marks[position] is not None
+                        and live_marks[position] == entry.live_mark
+                        and entry.scanned_at.normalize() == scan_day
+                    )
+                ):
+                    yield position, rescan_cache.reuse(rescan_keys[position], live_marks[position])
+                    continue
+
+            future = submit_traced(
+                fetch_pool,
+                symbol,
+                load_upstox_data,
+                access_token=access_token,
+                instrument_key=instrument_key,
+                period=period,
+                interval=interval,
+                include_live=include_live,
+                store=candle_store,
+                live_quote=live_quote if interval == "1d" else None,
+            )
+            pending[future] = ("fetch", position, symbol)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, position, symbol = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    yield position, {"Stock": symbol, "Recommended Action": "Error", "Error": str(e)}
+                    continue
+
+                if stage == "analysis":
+                    if rescan_cache is not None and "Error" not in value:
+                        rescan_cache.put(rescan_keys[position], fingerprints[position], live_marks[position], value)
+                    yield position, value
+                elif value.empty:
+                    yield position, {"Stock": symbol, "Recommended Action": "No Data"}
+                else:
+                    if rescan_cache is not None:
+                        fingerprints[position] = frame_fingerprint(value, instrument_keys[symbol], interval)
+                        entry = rescan_cache.get(rescan_keys[position])
+                        if entry is not None and entry.fingerprint == fingerprints[position]:
+                            yield position, rescan_cache.reuse(rescan_keys[position], live_marks[position])
+                            continue
+                    next_future = submit_traced(
+                        analysis_pool,
+                        symbol,
+                        analyze_symbol_data,
+                        symbol=symbol,
+                        raw=value,
+                        series_id=(instrument_keys[symbol], interval),
+                        **analysis_params,
+                    )
+                    pending[next_future] = ("analysis", position, symbol)
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        analysis_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def panel_scanner_rows(scored: pd.DataFrame) -> pd.DataFrame:
+    """score_candle_panel / scan_universe rows in the columns analyze_symbol_data returns."""
+    scored = scored.reindex(
+        columns=[
+            "Close", "Nearest_Support", "Nearest_Resistance", "Vol_Ratio", "Trend_Bias", "Signal",
+            "Confidence", "Buy_Score", "Sell_Score", "Side", "Entry", "Safe_Entry", "Stop_Loss",
+            "Target_1", "Error",
+        ]
+    )
+    is_buy = scored["Side"] == "BUY"
+
+    rows = pd.DataFrame(
+        {
+            "Stock": scored.index,
+            "Current Price": scored["Close"].astype(float).round(2),
+            "Nearest Support": scored["Nearest_Support"].astype(float).round(2),
+            "Nearest Resistance": scored["Nearest_Resistance"].astype(float).round(2),
+            "Volume vs MA": [
+                f"{ratio:.2f} ({get_volume_strength_label(ratio)})" if pd.notna(ratio) else ""
+                for ratio in scored["Vol_Ratio"]
+            ],
+            "Structure": scored["Trend_Bias"],
+            "Signal": scored["Signal"],
+            "Confidence": scored["Confidence"],
+            "Buy Score": scored["Buy_Score"],
+            "Sell Score": scored["Sell_Score"],
+            "Recommended Action": scored["Side"].replace("", "HOLD"),
+            "Buy Price": scored["Entry"].where(is_buy),
+            "Safe Buy Above": scored["Safe_Entry"].where(is_buy),
+            "Stop Loss": scored["Stop_Loss"],
+            "Target 1": scored["Target_1"],
+        }
+    ).reset_index(drop=True)
+
+    error = scored["Error"].to_numpy(dtype=object)
+    failed = pd.notna(error)
+    if failed.any():
+        status = np.where(np.isin(error, ["Not Found", "No Data"]), error, "Error")
+        rows.loc[failed, "Recommended Action"] = status[failed]
+        rows["Error"] = np.where(failed & (status == "Error"), error, None)
+    return rows
+
+
+# ============================================================
+# PRE-MARKET WARM-UP
+# ============================================================
+def is_preopen_window_india(window: tuple[str, str] = WARMUP_WINDOW) -> bool:
+    current = now_ist()
+    if current.weekday() >= 5 or is_market_hours_india():
+        return False
+
+    start, end = (
+        current.normalize() + pd.Timedelta(hours=int(hour), minutes=int(minute))
+        for hour, minute in (bound.split(":") for bound in window)
+    )
+    return start <= current < end
+
+
+def warm_up_watchlists(
+    access_token: str,
+    symbols: list[str],
+    series: list[tuple[str, str]],
+    volume_ma_window: int,
+    store: CandleStore | None,
+    exchange: str = "NSE",
+    load_instruments: Callable[[str], pd.DataFrame] = load_upstox_instruments,
+    workers: int = HISTORY_FETCH_WORKERS,
+) -> dict:
+    """
+    Fill the caches the first analysis of the day would otherwise fill:
+    the instrument master and its search index, the candle store up to the
+    last complete session for each (interval, period) in series, and the
+    incremental indicator engine. At the open a watchlist run then fetches
+    only the new candles and folds only those into the indicators. The
+    analysis stage cache is not primed: its keys include the fingerprint of
+    the whole candle frame, which the first candle of the session changes.
+    """
+    started = time.monotonic()
+    instruments_df = load_instruments(exchange)
+    instrument_keys = resolve_instrument_keys(instruments_df, symbols, mode="Equity", exchange=exchange)
+    failed = {symbol: "Not Found" for symbol, key in instrument_keys.items() if key is None}
+
+    def _warm(symbol: str, instrument_key: str, interval: str, period: str) -> None:
+        raw = load_upstox_data(access_token, instrument_key, period, interval, include_live=False, store=store)
+        if raw.empty:
+            raise ValueError("No Data")
+        get_indicator_engine(instrument_key, interval, volume_ma_window).update(raw, as_frame=False)
+
+    tasks = [
+        (symbol, key, interval, period)
+        for symbol, key in instrument_keys.items()
+        if key is not None
+        for interval, period in series
+    ]
+    warmed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmup") as pool:
+        futures = {pool.submit(_warm, *task): task for task in tasks}
+        for future in as_completed(futures):
+            symbol, _, interval, period = futures[future]
+            try:
+                future.result()
+                warmed += 1
+            except Exception as e:
+                failed[f"{symbol} {interval}/{period}"] = str(e)
+
+    return {
+        "finished_at": now_ist(),
+        "symbols": len(symbols),
+        "series_warmed": warmed,
+        "failed": failed,
+        "seconds": time.monotonic() - started,
+    }
+
+
+class WarmupJob:
+    """
+    Background thread that runs warm_up_watchlists once per trading day
+    inside the pre-open window. The page calls configure() on every rerun
+    with the current token, watchlist and settings; the job uses the latest
+    configuration when the window opens. configure() with no arguments
+    disables it.
+    """
+
+    def __init__(self, window: tuple[str, str] = WARMUP_WINDOW, poll_seconds: float = WARMUP_POLL_SECONDS):
+        self.window = window
+        self.poll_seconds = poll_seconds
+        self.config: dict | None = None
+        self.last_summary: dict | None = None
+        self.error: Exception | None = None
+        self._last_day = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="warmup-job", daemon=True)
+
+    def configure(self, **config) -> None:
+        with self._lock:
+            self.config = config or None
+
+    def start(self) -> "WarmupJob":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_once(self) -> dict:
+        with self._lock:
+            config = dict(self.config or {})
+        self.last_summary = warm_up_watchlists(**config)
+        self._last_day = self.last_summary["finished_at"].normalize()
+        return self.last_summary
+
+    def _due(self) -> bool:
+        return (
+            self.config is not None
+            and self._last_day != now_ist().normalize()
+            and is_preopen_window_india(self.window)
+        )
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._due():
+                try:
+                    self.run_once()
+                    self.error = None
+                except Exception as e:
+                    self.error = e
+            self._stop.wait(self.poll_seconds)
+
+
+# ============================================================
+# PARAMETER SWEEP
+# ============================================================
+SWEEP_RESULT_COLUMNS = [
+    "points",
+    "trades",
+    "win_rate",
+    "expectancy_pct",
+    "total_return_pct",
+    "zone_tests",
+    "zone_hit_rate",
+    "cached",
+]
+
+
+@dataclass
+class SweepSettings:
+    volume_ma_window: int = 20
+    require_trendline_confirmation: bool = False
+    use_retest_bonus: bool = True
+    max_hold_bars: int = 20
+    warmup_bars: int = 100
+
+
+def sweep_param_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True)
+
+
+def _zone_tests(
+    zone_type: str,
+    center: np.ndarray,
+    band: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    horizon_bars: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per bar, for the zone centre +/- band known at its close: whether one of
+    the next horizon_bars bars reached the zone, and whether none of them
+    closed through it from that first test on.
+    """
+    n = len(close)
+    ahead = np.arange(1, horizon_bars + 1)
+    # Row t holds bars t + 1 .. t + horizon_bars, NaN past the end.
+    rows = np.minimum(np.arange(n)[:, None] + ahead[None, :], n)
+    forward_close = np.append(close, NAN)[rows]
+    lower, upper = (center - band)[:, None], (center + band)[:, None]
+
+    with np.errstate(invalid="ignore"):
+        if zone_type == "Support":
+            reached = np.append(low, NAN)[rows] <= upper
+            through = forward_close < lower
+        else:
+            reached = np.append(high, NAN)[rows] >= lower
+            through = forward_close > upper
+    tested = reached.any(axis=1)
+    after_test = np.arange(horizon_bars)[None, :] >= np.argmax(reached, axis=1)[:, None]
+    return tested, tested & ~(through & after_test).any(axis=1)
+
+
+def evaluate_sweep_params(df: pd.DataFrame, params: dict, settings: SweepSettings) -> dict:
+    """
+    Walk-forward score of one parameter set on an indicator frame.
+
+    backtest_trade_confirmation replays the trade confirmation on every bar
+    from what was known at its close and trades the signals after the
+    warm-up with its stop / target / time exits, max_hold_bars at most. The
+    nearest support and resistance of each of those bars are also judged on
+    the next max_hold_bars bars: a zone holds when no bar closes through it
+    once price has reached it.
+    """
+    result = backtest_trade_confirmation(
+        df,
+        left_bars=int(params["left_bars"]),
+        right_bars=int(params["right_bars"]),
+        zone_width_pct=params["zone_width_pct"],
+        min_touches=params["min_touches"],
+        trendline_tolerance_pct=params["trendline_tolerance_pct"],
+        require_trendline_confirmation=settings.require_trendline_confirmation,
+        use_retest_bonus=settings.use_retest_bonus,
+        breakout_buffer_pct=params["breakout_buffer_pct"],
+        max_hold_bars=settings.max_hold_bars,
+        warmup_bars=settings.warmup_bars,
+    )
+    summary = result.summary
+
+    high = df["High"].to_numpy(dtype=np.float64)
+    low = df["Low"].to_numpy(dtype=np.float64)
+    close = df["Close"].to_numpy(dtype=np.float64)
+    band = close * params["zone_width_pct"] / 100.0
+    scored = slice(settings.warmup_bars, max(settings.warmup_bars, len(df) - 1))
+    tests, holds = 0, 0
+    for zone_type in ("Support", "Resistance"):
+        center = result.signals[zone_type].to_numpy(dtype=np.float64)
+        tested, held = _zone_tests(zone_type, center, band, high, low, close, settings.max_hold_bars)
+        tests += int(tested[scored].sum())
+        holds += int(held[scored].sum())
+
+    return {
+        "points": len(range(len(df))[scored]),
+        "trades": summary["trades"],
+        "win_rate": summary["win_rate"],
+        "expectancy_pct": summary["expectancy_pct"],
+        "total_return_pct": summary["total_return_pct"],
+        "zone_tests": tests,
+        "zone_hit_rate": holds / tests * 100 if tests else NAN,
+    }
+
+
+def sweep_grid_size(grid: dict) -> int:
+    return math.prod(len(values) for values in grid.values())
+
+
+def _grid_point(grid: dict, index: int) -> dict:
+    params = {}
+    for name, values in reversed(grid.items()):
+        index, digit = divmod(index, len(values))
+        params[name] = values[digit]
+    return {name: params[name] for name in grid}
+
+
+def sample_sweep_params(grid: dict, method: str, samples: int, seed: int = 0) -> list[dict]:
+    """Every grid point for method "grid", else `samples` distinct points drawn at random."""
+    total = sweep_grid_size(grid)
+    if method == "grid" or samples >= total:
+        indices = range(total)
+    else:
+        indices = sorted(random.Random(seed).sample(range(total), samples))
+    return [_grid_point(grid, i) for i in indices]
+
+
+def suggest_tpe_params(
+    grid: dict,
+    history: list[tuple[dict, float]],
+    count: int,
+    rng: random.Random,
+    gamma: float = 0.25,
+    startup: int = 10,
+    candidates: int = 64,
+) -> list[dict]:
+    """
+    Tree-structured Parzen estimator over the grid: split the scored sets
+    into the best `gamma` share and the rest, model each parameter's values
+    in both groups with smoothed frequencies, and propose the unseen grid
+    points that maximise the good/rest likelihood ratio. Falls back to random
+    points until `startup` sets have finite scores.
+    """
+    seen = {sweep_param_key(params) for params, _ in history}
+    total = sweep_grid_size(grid)
+    suggestions: list[dict] = []
+
+    def _take(params: dict) -> bool:
+        key = sweep_param_key(params)
+        if key in seen:
+            return False
+        seen.add(key)
+        suggestions.append(params)
+        return True
+
+    scored = sorted(
+        ((params, value) for params, value in history if math.isfinite(value)),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    if len(scored) >= startup:
+        n_good = max(1, math.ceil(gamma * len(scored)))
+        log_ratio = {}
+        for name, values in grid.items():
+            good = np.ones(len(values))
+            rest = np.ones(len(values))
+            for rank, (params, _) in enumerate(scored):
+                if params[name] in values:
+                    (good if rank < n_good else rest)[values.index(params[name])] += 1
+            good /= good.sum()
+            rest /= rest.sum()
+            log_ratio[name] = (good, np.log(good) - np.log(rest))
+
+        while len(suggestions) < count:
+            draws = [
+                {name: int(rng.choices(range(len(grid[name])), weights=good)[0]) for name, (good, _) in log_ratio.items()}
+                for _ in range(candidates)
+            ]
+            draws.sort(key=lambda draw: -sum(log_ratio[name][1][i] for name, i in draw.items()))
+            if not any(_take({name: grid[name][i] for name, i in draw.items()}) for draw in draws):
+                break
+
+    while len(suggestions) < count and len(seen) < total:
+        _take(_grid_point(grid, rng.randrange(total)))
+    return suggestions
+
+
+class SweepResultStore:
+    """
+    Scores already computed for one history and one set of SweepSettings,
+    kept as a JSON file so later sweeps only evaluate parameter sets they
+    have not seen.
+    """
+
+    def __init__(self, history_key: tuple, settings: SweepSettings, root: str | Path = SWEEP_CACHE_DIR):
+        digest = hashlib.sha1(repr((history_key, asdict(settings))).encode()).hexdigest()
+        self.path = Path(root) / f"{digest}.json"
+
+    def load(self) -> dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, results: dict[str, dict]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(results))
+        os.replace(tmp_path, self.path)
+
+
+_SWEEP_FRAME: pd.DataFrame | None = None
+
+
+def _init_sweep_worker(df: pd.DataFrame) -> None:
+    global _SWEEP_FRAME
+    _SWEEP_FRAME = df
+
+
+def _run_sweep_task(params: dict, settings: SweepSettings) -> dict:
+    return evaluate_sweep_params(_SWEEP_FRAME, params, settings)
+
+
+def run_parameter_sweep(
+    df: pd.DataFrame,
+    grid: dict,
+    settings: SweepSettings,
+    method: str = "random",
+    samples: int = 64,
+    metric: str = "expectancy_pct",
+    workers: int = SWEEP_WORKERS,
+    history_key: tuple | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Score parameter sets drawn from `grid` ("grid", "random" or "bayesian")
+    on the indicator frame df with evaluate_sweep_params, best `metric`
+    first. Sets run on a pool of worker processes, each of which receives df
+    once. With a history_key (e.g. the frame_fingerprint of the candles)
+    scores are remembered on disk, so repeating or widening a sweep over the
+    same history only evaluates the new sets; a bayesian sweep also starts
+    from, and counts towards `samples`, every remembered set in the grid.
+    """
+    store = SweepResultStore(history_key, settings) if history_key is not None else None
+    results = store.load() if store is not None else {}
+    cached = set(results)
+    chosen: dict[str, dict] = {}
+    executor = None
+
+    def _evaluate(batch: list[dict]) -> None:
+        nonlocal executor
+        for params in batch:
+            chosen[sweep_param_key(params)] = params
+        pending = [params for params in batch if sweep_param_key(params) not in results]
+        first_done = len(chosen) - len(pending) + 1
+        if workers <= 1:
+            for done, params in enumerate(pending, start=first_done):
+                results[sweep_param_key(params)] = evaluate_sweep_params(df, params, settings)
+                if progress is not None:
+                    progress(done, target)
+            return
+
+        if executor is None and pending:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                # The Streamlit server is multi-threaded; forking it is not safe.
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_sweep_worker,
+                initargs=(df,),
+            )
+        futures = {executor.submit(_run_sweep_task, params, settings): params for params in pending}
+        for done, future in enumerate(as_completed(futures), start=first_done):
+            results[sweep_param_key(futures[future])] = future.result()
+            if progress is not None:
+                progress(done, target)
+
+    try:
+        if method == "bayesian":
+            target = min(samples, sweep_grid_size(grid))
+            rng = random.Random(seed)
+            history = []
+            for key, scores in results.items():
+                params = json.loads(key)
+                if params.keys() == grid.keys() and all(params[name] in values for name, values in grid.items()):
+                    chosen[key] = params
+                    history.append((params, scores.get(metric, NAN)))
+            while len(chosen) < target:
+                batch = suggest_tpe_params(grid, history, min(max(workers, 4), target - len(chosen)), rng)
+                if not batch:
+                    break
+                _evaluate(batch)
+                history.extend((params, results[sweep_param_key(params)].get(metric, NAN)) for params in batch)
+        else:
+            candidates = sample_sweep_params(grid, method, samples, seed)
+            target = len(candidates)
+            _evaluate(candidates)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if store is not None and len(results) > len(cached):
+            store.save(results)
+
+    rows = [
+        {**params, **results[key], "cached": key in cached}
+        for key, params in chosen.items()
+        if key in results
+    ]
+    table = pd.DataFrame(rows, columns=list(grid) + SWEEP_RESULT_COLUMNS)
+    return table.sort_values(metric, ascending=False, na_position="last", kind="stable").reset_index(drop=True)
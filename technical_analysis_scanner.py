@@ -0,0 +1,226 @@
+"""
+Headless watchlist / universe scanner.
+
+Runs the same analysis as the Watchlist Scanner of technical_analysis.py
+through technical_analysis_core, without Streamlit, and writes one row per
+symbol to Parquet or CSV (picked from the output suffix), once or on a
+schedule:
+
+    python technical_analysis_scanner.py --symbols RELIANCE TCS INFY --output scan.csv
+    python technical_analysis_scanner.py --watchlist watchlist.txt --output scans/{timestamp}.parquet
+    python technical_analysis_scanner.py --universe NSE_EQ --output nse_eq.parquet --every 900 --market-hours-only
+
+The Upstox access token is read from --token or UPSTOX_ACCESS_TOKEN. Candles
+go through the same local candle store as the app unless --no-store is given.
+--timings writes per-stage / per-symbol timings of each run as JSON; with
+TA_PROFILE_OUTPUT set each run is also captured with cProfile. Upstox HTTP
+and cache metrics go to a Prometheus text file after every run
+(--metrics-file) and/or are served on /metrics (--metrics-port, on
+localhost unless --metrics-host is given).
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from technical_analysis_core import (
+    METRICS_FILE,
+    METRICS_HOST,
+    METRICS_PORT,
+    PROFILE_OUTPUT,
+    SCAN_UNIVERSES,
+    UNIVERSE_FETCH_WORKERS,
+    CandleStore,
+    Telemetry,
+    WatchlistRescanCache,
+    activate_telemetry,
+    is_market_hours_india,
+    load_upstox_instruments,
+    now_ist,
+    panel_scanner_rows,
+    resolve_instrument_keys,
+    scan_universe,
+    scan_watchlist_concurrently,
+    start_metrics_export,
+    universe_symbols,
+    validate_period_interval,
+    write_metrics_file,
+)
+
+
+def read_watchlist(path: str) -> list[str]:
+    """One symbol per line; blank lines and # comments are skipped."""
+    with open(path) as fh:
+        lines = [line.split("#", 1)[0].strip().upper() for line in fh]
+    return [line for line in lines if line]
+
+
+def run_scan(
+    args: argparse.Namespace,
+    store: CandleStore | None,
+    rescan_cache: WatchlistRescanCache | None = None,
+) -> pd.DataFrame:
+    analysis_params = dict(
+        volume_ma_window=args.volume_ma_window,
+        left_bars=args.left_bars,
+        right_bars=args.right_bars,
+        zone_width_pct=args.zone_width_pct,
+        min_touches=args.min_touches,
+        trendline_tolerance_pct=args.trendline_tolerance_pct,
+        require_trendline_confirmation=args.require_trendline_confirmation,
+        use_retest_bonus=not args.no_retest_bonus,
+        breakout_buffer_pct=args.breakout_buffer_pct,
+    )
+
+    if args.universe:
+        instruments_df = load_upstox_instruments("NSE")
+        symbols = universe_symbols(instruments_df, args.universe)
+        chunks = [
+            rows
+            for _, rows in scan_universe(
+                access_token=args.token,
+                instrument_keys=resolve_instrument_keys(instruments_df, symbols, mode="Equity", exchange="NSE"),
+                period=args.period,
+                interval=args.interval,
+                analysis_params=analysis_params,
+                store=store,
+                include_live=not args.no_live,
+                fetch_workers=args.fetch_workers,
+            )
+        ]
+        scanner_df = panel_scanner_rows(pd.concat(chunks).reindex(symbols)) if chunks else pd.DataFrame()
+    else:
+        symbols = args.symbols or read_watchlist(args.watchlist)
+        results = [None] * len(symbols)
+        for position, result in scan_watchlist_concurrently(
+            access_token=args.token,
+            symbols=symbols,
+            instruments_df=load_upstox_instruments(args.exchange),
+            period=args.period,
+            interval=args.interval,
+            lookup_exchange=args.exchange,
+            analysis_params=analysis_params,
+            include_live=not args.no_live,
+            candle_store=store,
+            fetch_workers=args.fetch_workers,
+            analysis_workers=args.analysis_workers,
+            rescan_cache=rescan_cache,
+        ):
+            results[position] = result
+        scanner_df = pd.DataFrame(results)
+
+    scanner_df.insert(0, "Scanned At", now_ist().strftime("%Y-%m-%d %H:%M:%S"))
+    return scanner_df
+
+
+def output_path(output: str) -> Path:
+    """output with {timestamp} replaced by the scan time, parent directories created."""
+    path = Path(output.replace("{timestamp}", now_ist().strftime("%Y%m%d_%H%M%S")))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_results(scanner_df: pd.DataFrame, output: str) -> Path:
+    """Write to output through a temporary file."""
+    path = output_path(output)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    if path.suffix == ".parquet":
+        scanner_df.to_parquet(tmp_path, index=False)
+    elif path.suffix == ".csv":
+        scanner_df.to_csv(tmp_path, index=False)
+    else:
+        raise ValueError(f"Unsupported output format: {path.suffix or output} (use .parquet or .csv)")
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan a watchlist or an NSE segment and write the results to Parquet/CSV.")
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--symbols", nargs="+", metavar="SYMBOL", help="symbols to scan")
+    targets.add_argument("--watchlist", metavar="FILE", help="file with one symbol per line")
+    targets.add_argument("--universe", choices=SCAN_UNIVERSES, help="scan every instrument of an NSE segment")
+    parser.add_argument("--output", required=True, help="results file, .parquet or .csv; {timestamp} is filled in per run")
+    parser.add_argument("--token", default=os.environ.get("UPSTOX_ACCESS_TOKEN", ""), help="Upstox access token (default: $UPSTOX_ACCESS_TOKEN)")
+    parser.add_argument("--exchange", choices=["NSE", "BSE"], default="NSE", help="lookup exchange for --symbols/--watchlist")
+    parser.add_argument("--period", default="3mo", help="lookback period, as in the app (default: 3mo)")
+    parser.add_argument("--interval", default="1d", help="candle interval, as in the app (default: 1d)")
+    parser.add_argument("--every", type=float, metavar="SECONDS", help="repeat the scan on this schedule instead of running once")
+    parser.add_argument("--market-hours-only", action="store_true", help="with --every, skip runs outside NSE market hours")
+    parser.add_argument("--no-live", action="store_true", help="completed sessions only, no live/current-session candles")
+    parser.add_argument("--no-store", action="store_true", help="fetch everything from Upstox instead of the local candle store")
+    parser.add_argument("--full-rescan", action="store_true", help="with --every, re-analyze every symbol each run instead of only changed ones")
+    parser.add_argument("--fetch-workers", type=int, default=UNIVERSE_FETCH_WORKERS)
+    parser.add_argument("--analysis-workers", type=int, default=4, help="analysis threads for --symbols/--watchlist")
+    parser.add_argument("--timings", metavar="FILE", help="write per-stage / per-symbol timings of each run as JSON; {timestamp} is filled in")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, metavar="FILE", help="Prometheus text file rewritten after each run (default: $TA_METRICS_FILE)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics on this port, useful with --every (default: $TA_METRICS_PORT)")
+    parser.add_argument("--metrics-host", default=METRICS_HOST, help="interface for --metrics-port (default: $TA_METRICS_HOST or 127.0.0.1)")
+
+    detection = parser.add_argument_group("detection settings (defaults match the app sidebar)")
+    detection.add_argument("--left-bars", type=int, default=3)
+    detection.add_argument("--right-bars", type=int, default=3)
+    detection.add_argument("--zone-width-pct", type=float, default=0.8)
+    detection.add_argument("--min-touches", type=int, default=2)
+    detection.add_argument("--volume-ma-window", type=int, default=20)
+    detection.add_argument("--trendline-tolerance-pct", type=float, default=1.0)
+    detection.add_argument("--require-trendline-confirmation", action="store_true")
+    detection.add_argument("--no-retest-bonus", action="store_true")
+    detection.add_argument("--breakout-buffer-pct", type=float, default=0.15)
+    args = parser.parse_args()
+
+    if not args.token:
+        parser.error("pass --token or set UPSTOX_ACCESS_TOKEN")
+    validation_error = validate_period_interval(args.period, args.interval)
+    if validation_error:
+        parser.error(validation_error)
+
+    store = None if args.no_store else CandleStore()
+    # Scheduled watchlist runs skip symbols whose candles have not changed since the previous run.
+    rescan_cache = None if args.full_rescan else WatchlistRescanCache()
+    if args.metrics_port:
+        start_metrics_export(file_path="", port=args.metrics_port, host=args.metrics_host)
+
+    while True:
+        started = time.monotonic()
+        if args.every and args.market_hours_only and not is_market_hours_india():
+            print(f"{now_ist():%H:%M:%S} outside market hours, skipping", flush=True)
+        else:
+            telemetry = activate_telemetry(Telemetry(PROFILE_OUTPUT) if args.timings or PROFILE_OUTPUT else None)
+            try:
+                reused_before = rescan_cache.stats()["reused"] if rescan_cache is not None else 0
+                scanner_df = run_scan(args, store, rescan_cache)
+                path = write_results(scanner_df, args.output)
+                signals = scanner_df["Signal"].value_counts().to_dict() if "Signal" in scanner_df.columns else {}
+                reused = rescan_cache.stats()["reused"] - reused_before if rescan_cache is not None else 0
+                print(
+                    f"{now_ist():%H:%M:%S} {len(scanner_df)} symbols scanned in "
+                    f"{time.monotonic() - started:.1f}s{f' ({reused} unchanged)' if reused else ''} -> {path} {signals}",
+                    flush=True,
+                )
+            except Exception as e:
+                if not args.every:
+                    raise
+                print(f"{now_ist():%H:%M:%S} scan failed: {e}", file=sys.stderr, flush=True)
+            finally:
+                if telemetry is not None:
+                    profile_path = telemetry.finish()
+                    if profile_path:
+                        print(f"cProfile -> {profile_path}", flush=True)
+                    if args.timings:
+                        output_path(args.timings).write_text(telemetry.to_json())
+                activate_telemetry(None)
+                if args.metrics_file:
+                    write_metrics_file(args.metrics_file)
+
+        if not args.every:
+            return
+        time.sleep(max(0.0, args.every - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Local stand-in for the Upstox market-data feed.
+
+Plays a recorded tick file (JSONL lines of
+{"instrument_key", "ts", "ltp", "ltq"}, as written by UpstoxMarketFeed with
+record_path set) to every client that connects, one JSON tick per line, so
+the streaming mode of technical_analysis.py can be exercised and benchmarked
+offline.
+
+    python tick_replay_server.py ticks.jsonl --port 8765 --speed 10
+    python tick_replay_server.py --synthetic "NSE_EQ|INE002A01018" --port 8765
+
+In the app, enable "Streaming mode", pick "Local replay" and point it at
+127.0.0.1:8765.
+"""
+import argparse
+import json
+import socketserver
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def load_ticks(path: str) -> list[dict]:
+    with open(path) as fh:
+        ticks = [json.loads(line) for line in fh if line.strip()]
+    return sorted(ticks, key=lambda t: t["ts"])
+
+
+def synthetic_ticks(instrument_key: str, count: int = 20_000, start_price: float = 1000.0) -> list[dict]:
+    """Random-walk ticks through one session starting at 09:15 IST today."""
+    rng = np.random.default_rng(11)
+    session_open = pd.Timestamp.now(tz="Asia/Kolkata").normalize() + pd.Timedelta(hours=9, minutes=15)
+    start_ms = int(session_open.timestamp() * 1000)
+    gaps_ms = rng.integers(50, 1_000, count).cumsum()
+    prices = start_price + rng.standard_normal(count).cumsum() * 0.05
+    quantities = rng.integers(1, 500, count)
+    return [
+        {"instrument_key": instrument_key, "ts": int(start_ms + gap), "ltp": round(float(price), 2), "ltq": int(qty)}
+        for gap, price, qty in zip(gaps_ms, prices, quantities)
+    ]
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        ticks = self.server.ticks
+        speed = self.server.speed
+
+        while True:
+            wall_start = time.monotonic()
+            first_ts = ticks[0]["ts"] if ticks else 0
+            for tick in ticks:
+                if speed > 0:
+                    due = (tick["ts"] - first_ts) / 1000.0 / speed
+                    delay = due - (time.monotonic() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                # Stamp ticks with the current time so live candles land in today's session.
+                if self.server.restamp:
+                    tick = {**tick, "ts": int(time.time() * 1000)}
+                try:
+                    self.request.sendall((json.dumps(tick) + "\n").encode("utf-8"))
+                except OSError:
+                    return
+            if not self.server.loop:
+                return
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, ticks: list[dict], speed: float = 1.0, loop: bool = False, restamp: bool = False):
+        super().__init__(address, ReplayHandler)
+        self.ticks = ticks
+        self.speed = speed
+        self.loop = loop
+        self.restamp = restamp
+
+
+def serve_in_background(ticks: list[dict], port: int = 0, speed: float = 0.0, loop: bool = False) -> ReplayServer:
+    """Start a replay server on a daemon thread; handy for tests and benchmarks."""
+    server = ReplayServer(("127.0.0.1", port), ticks, speed=speed, loop=loop)
+    threading.Thread(target=server.serve_forever, name="tick-replay", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded market ticks over TCP (JSON lines).")
+    parser.add_argument("tick_file", nargs="?", help="JSONL tick file to replay")
+    parser.add_argument("--synthetic", metavar="INSTRUMENT_KEY", help="replay a generated random-walk session instead of a file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier; 0 sends as fast as possible")
+    parser.add_argument("--loop", action="store_true", help="start over when the file ends")
+    parser.add_argument("--restamp", action="store_true", help="replace recorded timestamps with the current time")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ticks = synthetic_ticks(args.synthetic)
+    elif args.tick_file:
+        ticks = load_ticks(args.tick_file)
+    else:
+        parser.error("pass a tick file or --synthetic INSTRUMENT_KEY")
+
+    with ReplayServer((args.host, args.port), ticks, speed=args.speed, loop=args.loop, restamp=args.restamp) as server:
+        print(f"Replaying {len(ticks):,} ticks on {args.host}:{args.port} (speed {args.speed}x)")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()